@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import time
+
+from poselib_v2.motion_loader import MotionLoader
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--files", type=str, nargs="+", required=True, help="Motion files")
+parser.add_argument("--device", type=str, default="cpu", help="Torch device")
+parser.add_argument("--startup", type=float, default=2.0, help="Duration of the simulated simulator startup, in sec")
+args, _ = parser.parse_known_args()
+
+
+def build_simulator() -> None:
+    """Stand-in for the simulator construction, which mostly waits on native code and the GPU"""
+    time.sleep(args.startup)
+
+
+def blocking() -> float:
+    start = time.perf_counter()
+    motions = [MotionLoader(file, args.device) for file in args.files]
+    build_simulator()
+    motions[0].sample(1024)
+    return time.perf_counter() - start
+
+
+def background() -> float:
+    start = time.perf_counter()
+    motions = [MotionLoader.load_async(file, args.device) for file in args.files]
+    build_simulator()
+    # first access of a field waits for the loading
+    motions[0].sample(1024)
+    for motion in motions:
+        motion.result()
+    return time.perf_counter() - start
+
+
+async def awaited() -> float:
+    start = time.perf_counter()
+    handles = [MotionLoader.load_async(file, args.device) for file in args.files]
+    await asyncio.to_thread(build_simulator)
+    motions = await asyncio.gather(*handles)
+    motions[0].sample(1024)
+    return time.perf_counter() - start
+
+
+load_start = time.perf_counter()
+for file in args.files:
+    MotionLoader(file, args.device)
+print(f"loading: {time.perf_counter() - load_start:.2f} s, simulator startup: {args.startup:.2f} s")
+print(f"blocking startup: {blocking():.2f} s")
+print(f"background startup: {background():.2f} s")
+print(f"asyncio startup: {asyncio.run(awaited()):.2f} s")
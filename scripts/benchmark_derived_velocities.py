@@ -0,0 +1,47 @@
+import argparse
+import time
+
+import torch
+
+from poselib_v2.motion_loader import MotionLoader
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", type=str, required=True, help="Motion file")
+parser.add_argument("--samples", type=int, default=4096, help="Number of samples per batch")
+parser.add_argument("--repeats", type=int, default=50, help="Number of timed batches")
+parser.add_argument("--device", type=str, default="cpu", help="Torch device")
+args, _ = parser.parse_known_args()
+
+
+def resident_memory(motion: MotionLoader) -> float:
+    """Memory used by the motion tensors, in MB"""
+    tensors = [value for value in vars(motion).values() if isinstance(value, torch.Tensor)]
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors) / 2**20
+
+
+def sample_time(motion: MotionLoader) -> float:
+    """Average time to sample a batch, in milliseconds"""
+    times = [motion.sample_times(args.samples) for _ in range(args.repeats)]
+    motion.sample(args.samples, times=times[0])
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for batch_times in times:
+        motion.sample(args.samples, times=batch_times)
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start) / args.repeats
+
+
+stored = MotionLoader(args.file, args.device)
+derived = MotionLoader(args.file, args.device, derive_velocities=True)
+
+times = stored.sample_times(args.samples)
+names = ["DOF velocities", "linear velocities", "angular velocities"]
+for name, a, b in zip(names, *[[motion.sample(0, times=times)[i] for i in (1, 4, 5)] for motion in (stored, derived)]):
+    print(f"{name}: mean difference with the stored velocities: {(a - b).abs().mean().item():.2e}")
+
+print(f"{'velocities':>10} {'memory (MB)':>12} {'sample (ms)':>12}")
+print(f"{'stored':>10} {resident_memory(stored):>12.1f} {sample_time(stored):>12.2f}")
+print(f"{'derived':>10} {resident_memory(derived):>12.1f} {sample_time(derived):>12.2f}")
@@ -0,0 +1,40 @@
+import argparse
+import os
+import tempfile
+import time
+
+from poselib_v2.motion_io import load_motion_data, save_motion_data
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--files", type=str, nargs="+", required=True, help="Motion files of the sample dataset")
+parser.add_argument("--workers", type=int, default=None, help="Number of compression threads")
+parser.add_argument("--repeats", type=int, default=3, help="Number of timed loads per option")
+args, _ = parser.parse_known_args()
+
+dataset = [load_motion_data(file) for file in args.files]
+options = [(None, False), ("zlib", False), ("zlib", True), ("lzma", False), ("lzma", True)]
+
+print(f"{'codec':>6} {'delta':>6} {'size (MB)':>10} {'ratio':>6} {'save (s)':>9} {'load (s)':>9}")
+with tempfile.TemporaryDirectory() as directory:
+    baseline_size = None
+    for codec, delta in options:
+        files = [os.path.join(directory, f"{i}.npz") for i in range(len(dataset))]
+
+        start = time.perf_counter()
+        for file, motion_data in zip(files, dataset):
+            save_motion_data(file, motion_data, codec=codec, delta=delta, num_workers=args.workers)
+        save_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for file in files:
+                load_motion_data(file, num_workers=args.workers)
+        load_time = (time.perf_counter() - start) / args.repeats
+
+        size = sum(os.path.getsize(file) for file in files)
+        baseline_size = baseline_size or size
+        print(
+            f"{str(codec):>6} {str(delta):>6} {size / 2**20:>10.2f} {baseline_size / size:>6.2f}"
+            f" {save_time:>9.3f} {load_time:>9.3f}"
+        )
@@ -0,0 +1,95 @@
+import argparse
+import time
+
+import torch
+
+from poselib_v2.motion_loader import MotionLoader
+from poselib_v2.observations import ObservationBuilder
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", type=str, required=True, help="Motion file")
+parser.add_argument("--samples", type=int, default=4096, help="Number of samples per batch")
+parser.add_argument("--repeats", type=int, default=50, help="Number of timed batches")
+parser.add_argument("--device", type=str, default="cpu", help="Torch device")
+args, _ = parser.parse_known_args()
+
+
+# reference implementation: the chain of generic quaternion ops usually written by the consumers
+def quat_mul(a, b):
+    w1, x1, y1, z1 = a.unbind(-1)
+    w2, x2, y2, z2 = b.unbind(-1)
+    return torch.stack(
+        [
+            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+            w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+        ],
+        dim=-1,
+    )
+
+
+def quat_rotate(q, v):
+    q_v = torch.cat([torch.zeros_like(v[..., :1]), v], dim=-1)
+    q_conj = q * torch.tensor([1.0, -1.0, -1.0, -1.0], device=q.device)
+    return quat_mul(quat_mul(q, q_v), q_conj)[..., 1:]
+
+
+def heading_quat_inv(q):
+    heading = quat_rotate(q, torch.tensor([1.0, 0.0, 0.0], device=q.device).expand(q.shape[0], 3))
+    yaw = torch.atan2(heading[:, 1], heading[:, 0])
+    zeros = torch.zeros_like(yaw)
+    return torch.stack([torch.cos(-0.5 * yaw), zeros, zeros, torch.sin(-0.5 * yaw)], dim=-1)
+
+
+def naive_observations(
+    dof_positions, dof_velocities, body_positions, body_rotations, linear_velocities, angular_velocities
+):
+    root_positions = body_positions[:, 0]
+    heading_inv = heading_quat_inv(body_rotations[:, 0])
+    heading_inv = heading_inv.unsqueeze(1).repeat(1, body_positions.shape[1], 1)
+    local_positions = quat_rotate(heading_inv, body_positions - root_positions.unsqueeze(1))
+    local_rotations = quat_mul(heading_inv, body_rotations)
+    x_axis = torch.tensor([1.0, 0.0, 0.0], device=body_positions.device).expand_as(local_positions)
+    z_axis = torch.tensor([0.0, 0.0, 1.0], device=body_positions.device).expand_as(local_positions)
+    tangent_normal = torch.cat([quat_rotate(local_rotations, x_axis), quat_rotate(local_rotations, z_axis)], dim=-1)
+    local_linear_velocities = quat_rotate(heading_inv, linear_velocities)
+    local_angular_velocities = quat_rotate(heading_inv, angular_velocities)
+    return torch.cat(
+        [
+            root_positions[:, 2:3],
+            dof_positions,
+            dof_velocities,
+            local_positions.flatten(1),
+            tangent_normal.flatten(1),
+            local_linear_velocities.flatten(1),
+            local_angular_velocities.flatten(1),
+        ],
+        dim=-1,
+    )
+
+
+def timeit(function) -> float:
+    """Average time of a function call, in milliseconds"""
+    function()
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        function()
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start) / args.repeats
+
+
+motion = MotionLoader(args.file, args.device)
+samples = motion.sample(args.samples)
+builder = ObservationBuilder(motion.body_names, motion.num_dofs)
+out = builder.allocate(args.samples, args.device)
+
+error = (builder.build(*samples) - naive_observations(*samples)).abs().max().item()
+print(f"observation dim: {builder.observation_dim}, max difference with the naive ops: {error:.2e}")
+print(f"naive ops:                    {timeit(lambda: naive_observations(*samples)):.2f} ms")
+print(f"builder:                      {timeit(lambda: builder.build(*samples)):.2f} ms")
+print(f"builder, preallocated output: {timeit(lambda: builder.build(*samples, out=out)):.2f} ms")
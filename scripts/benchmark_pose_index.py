@@ -0,0 +1,53 @@
+import argparse
+import time
+
+import torch
+
+from poselib_v2.motion_loader import MotionLoader
+from poselib_v2.pose_index import PoseIndex
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--files", type=str, nargs="+", required=True, help="Motion files to index")
+parser.add_argument("--copies", type=int, default=1, help="Number of times the files are indexed (dataset size)")
+parser.add_argument("--bodies", type=str, nargs="*", default=None, help="Indexed bodies")
+parser.add_argument("--clusters", type=int, default=1024, help="Number of k-means clusters")
+parser.add_argument("--probes", type=int, nargs="+", default=[4, 16, 64], help="Numbers of clusters searched")
+parser.add_argument("--queries", type=int, default=1024, help="Number of queries per batch")
+parser.add_argument("--k", type=int, default=8, help="Number of nearest frames per query")
+parser.add_argument("--device", type=str, default="cpu", help="Torch device")
+args, _ = parser.parse_known_args()
+
+
+def synchronize() -> None:
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def throughput(index: PoseIndex, queries: torch.Tensor, **kwargs) -> tuple[float, torch.Tensor]:
+    """Queries per second of a search, and the distances of the nearest frames found"""
+    synchronize()
+    start = time.perf_counter()
+    distances, _, _ = index.search(queries, k=args.k, **kwargs)
+    synchronize()
+    return queries.shape[0] / (time.perf_counter() - start), distances
+
+
+files = args.files * args.copies
+start = time.perf_counter()
+index = PoseIndex.build(files, bodies=args.bodies, num_clusters=args.clusters, device=args.device)
+synchronize()
+print(f"index: {index.num_frames} frames, {index.features.shape[1]} features, {index.num_clusters} clusters")
+print(f"build time: {time.perf_counter() - start:.1f} s")
+
+motion = MotionLoader(args.files[0], args.device)
+queries = index.encode(*motion.sample(args.queries))
+exact_speed, exact = throughput(index, queries)
+print(f"{'search':>12} {'queries/s':>12} {'recall@' + str(args.k):>10}")
+print(f"{'exact':>12} {exact_speed:>12.0f} {1.0:>10.3f}")
+for num_probes in args.probes:
+    speed, found = throughput(index, queries, num_probes=num_probes)
+    # fraction of the frames found by the approximate search which are among the exact nearest frames
+    # (compared by distance, as the copies of the files have identical frames)
+    recall = (found <= exact[:, -1:] + 1e-4).float().mean().item()
+    print(f"{'probes=' + str(num_probes):>12} {speed:>12.0f} {recall:>10.3f}")
@@ -0,0 +1,52 @@
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+
+from poselib_v2.motion_library import MotionLibrary
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset-dir", type=str, required=True, help="Directory of motion files")
+parser.add_argument("--world-sizes", type=int, nargs="+", default=[1, 2, 4], help="Numbers of local ranks")
+parser.add_argument("--device", type=str, default="cpu", help="Torch device")
+args, _ = parser.parse_known_args()
+
+
+def load_shard(rank: int, world_size: int, queue: multiprocessing.Queue) -> None:
+    """Load the shard of a rank, as a separate process of a data-parallel training would"""
+    start = time.perf_counter()
+    library = MotionLibrary(args.dataset_dir, args.device, rank=rank, world_size=world_size)
+    load_time = time.perf_counter() - start
+    if library.num_clips:
+        library.sample(library.sample_clips(1024))
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    weights = library.global_weights.tolist()
+    num_clips = library.num_dataset_clips
+    queue.put((rank, library.clip_ids.tolist(), weights, library.num_frames, load_time, peak_memory, num_clips))
+
+
+if __name__ == "__main__":
+    # the ranks create or update the manifest concurrently, as the processes of a training do
+    context = multiprocessing.get_context("spawn")
+    print(f"{'world size':>10} {'max frames':>12} {'imbalance':>10} {'max load (s)':>13} {'max peak RSS (MB)':>18}")
+    for world_size in args.world_sizes:
+        queue = context.Queue()
+        processes = [context.Process(target=load_shard, args=(rank, world_size, queue)) for rank in range(world_size)]
+        for process in processes:
+            process.start()
+        results = sorted(queue.get() for _ in processes)
+        for process in processes:
+            process.join()
+
+        # the shards are disjoint and cover the dataset, and the weights sum to 1 over the ranks
+        clip_ids = sorted(clip for result in results for clip in result[1])
+        assert clip_ids == list(range(results[0][6])), "The shards don't partition the dataset"
+        assert np.isclose(sum(sum(result[2]) for result in results), 1.0), "The global weights are inconsistent"
+        frames = [result[3] for result in results]
+        print(
+            f"{world_size:>10} {max(frames):>12} {max(frames) / np.mean(frames):>10.3f}"
+            f" {max(result[4] for result in results):>13.2f} {max(result[5] for result in results):>18.0f}"
+        )
@@ -0,0 +1,61 @@
+import argparse
+import multiprocessing
+
+import torch
+
+from poselib_v2.motion_io import load_motion_data
+from poselib_v2.motion_loader import MotionLoader
+from poselib_v2.shared_motion import SharedMotionData
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", type=str, required=True, help="Motion file")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Numbers of worker processes")
+args, _ = parser.parse_known_args()
+
+
+def proportional_memory() -> float:
+    """Proportional set size (PSS) of the process, in MB: shared pages are divided between the processes"""
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def worker(source: str, shared: bool, barrier, results) -> None:
+    """Load the motion, sample it, and report the memory used once all the workers have loaded it"""
+    baseline = proportional_memory()
+    motion = MotionLoader.from_shared(source, "cpu") if shared else MotionLoader(source, "cpu")
+    motion.sample(1024)
+    barrier.wait()
+    results.put(proportional_memory() - baseline)
+    barrier.wait()
+    if shared:
+        motion.close()
+
+
+def measure(source: str, shared: bool, num_workers: int) -> float:
+    """Total memory used by the motion data in all the workers, in MB"""
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(num_workers), context.Queue()
+    processes = [context.Process(target=worker, args=(source, shared, barrier, results)) for _ in range(num_workers)]
+    for process in processes:
+        process.start()
+    total = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return total
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    motion_data = load_motion_data(args.file)
+    size = sum(values.nbytes for values in motion_data.values()) / 2**20
+    print(f"motion data: {size:.1f} MB")
+    print(f"{'workers':>8} {'copies (MB)':>12} {'shared (MB)':>12}")
+    with SharedMotionData.create(motion_data) as shared:
+        for num_workers in args.workers:
+            copies = measure(args.file, False, num_workers)
+            shared_memory = measure(shared.name, True, num_workers)
+            print(f"{num_workers:>8} {copies:>12.1f} {shared_memory:>12.1f}")
@@ -0,0 +1,116 @@
+import argparse
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+from poselib_v2.math_utils import quat_to_matrix  # noqa: E402
+from poselib_v2.motion_loader import MotionLoader  # noqa: E402
+from poselib_v2.motion_viewer import MotionViewer  # noqa: E402
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", type=str, required=True, help="Motion file")
+parser.add_argument("--frames", type=int, default=200, help="Number of frames to render")
+parser.add_argument("--show-velocity", action="store_true", default=False, help="Show velocity vectors")
+parser.add_argument("--show-frames", type=str, nargs="*", default=[], help="Bodies whose frames are shown")
+args, _ = parser.parse_known_args()
+
+
+def draw_baseline_frame(axes, motion: MotionLoader, frame: int, render_scene: bool) -> None:
+    """Draw a frame as the viewer did before its artists were persistent: clear the axes and recreate every
+    artist, with one quiver call per arrow"""
+    vertices = motion.body_positions[frame].numpy()
+    velocities = motion.body_linear_velocities[frame].numpy()
+    rotations = motion.body_rotations[frame].numpy()
+    axes.clear()
+    axes.scatter(*vertices.T, color="black", depthshade=False)
+    for name in args.show_frames:
+        index = motion.body_names.index(name)
+        axes_vectors = quat_to_matrix(rotations[index]).T * 0.1
+        for vector, color in zip(axes_vectors, ("red", "green", "blue")):
+            axes.quiver(*vertices[index], *vector, color=color, arrow_length_ratio=0.2)
+    if args.show_velocity:
+        for position, velocity in zip(vertices, velocities):
+            if np.linalg.norm(velocity) > 1e-6:
+                axes.quiver(*position, *(velocity * 0.2), color="orange", alpha=0.7, arrow_length_ratio=0.3)
+    if render_scene:
+        positions = motion.body_positions.reshape(-1, 3).numpy()
+        minimum, maximum = positions.min(axis=0), positions.max(axis=0)
+        center, diff = 0.5 * (maximum + minimum), 0.75 * (maximum - minimum)
+    else:
+        minimum, maximum = vertices.min(axis=0), vertices.max(axis=0)
+        center, diff = 0.5 * (maximum + minimum), np.array([0.75 * np.max(maximum - minimum)] * 3)
+    axes.set_xlim((center[0] - diff[0], center[0] + diff[0]))
+    axes.set_ylim((center[1] - diff[1], center[1] + diff[1]))
+    axes.set_zlim((center[2] - diff[2], center[2] + diff[2]))
+    axes.set_box_aspect(aspect=diff / diff[0])
+    x, y = np.meshgrid([center[0] - diff[0], center[0] + diff[0]], [center[1] - diff[1], center[1] + diff[1]])
+    axes.plot_surface(x, y, np.zeros_like(x), color="green", alpha=0.2)
+    axes.set_xlabel("X")
+    axes.set_ylabel("Y")
+    axes.set_zlabel("Z")
+    axes.set_title(f"frame: {frame}/{motion.num_frames}")
+
+
+def benchmark_baseline(render_scene: bool) -> float:
+    """Render frames offscreen with the clear-and-redraw drawing of the previous viewer, and return the fps"""
+    motion = MotionLoader(args.file, "cpu")
+    figure = plt.figure()
+    axes = figure.add_subplot(projection="3d")
+    start = time.perf_counter()
+    for frame in range(args.frames):
+        draw_baseline_frame(axes, motion, frame % motion.num_frames, render_scene)
+        figure.canvas.draw()
+    fps = args.frames / (time.perf_counter() - start)
+    plt.close(figure)
+    return fps
+
+
+def benchmark(render_scene: bool, blit: bool) -> float:
+    """Render frames offscreen the same way the interactive animation does, and return the achieved fps"""
+    viewer = MotionViewer(
+        args.file, render_scene=render_scene, show_velocity=args.show_velocity, show_frames=args.show_frames
+    )
+    figure = viewer.create_figure()
+    canvas = figure.canvas
+
+    if blit:
+        # draw the static background once, without the animated artists
+        artists = viewer.draw_frame(0)
+        for artist in artists:
+            artist.set_visible(False)
+        canvas.draw()
+        background = canvas.copy_from_bbox(figure.bbox)
+        for artist in artists:
+            artist.set_visible(True)
+
+    start = time.perf_counter()
+    for frame in range(args.frames):
+        artists = viewer.draw_frame(frame)
+        if blit:
+            canvas.restore_region(background)
+            for artist in artists:
+                figure.draw_artist(artist)
+            canvas.blit(figure.bbox)
+        else:
+            canvas.draw()
+    fps = args.frames / (time.perf_counter() - start)
+    plt.close(figure)
+    return fps
+
+
+# all the modes render the same frames of the same clip
+baseline = benchmark_baseline(render_scene=True)
+full_redraw = benchmark(render_scene=True, blit=False)
+blitting = benchmark(render_scene=True, blit=True)
+print(f"scene view, clear and redraw (baseline): {baseline:.1f} fps")
+print(f"scene view, full redraw:                 {full_redraw:.1f} fps ({full_redraw / baseline:.1f}x)")
+print(f"scene view, blitting:                    {blitting:.1f} fps ({blitting / baseline:.1f}x)")
+baseline = benchmark_baseline(render_scene=False)
+skeleton = benchmark(render_scene=False, blit=False)
+print(f"skeleton view, clear and redraw (baseline): {baseline:.1f} fps")
+print(f"skeleton view:                              {skeleton:.1f} fps ({skeleton / baseline:.1f}x)")
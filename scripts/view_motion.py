@@ -17,6 +17,13 @@ parser.add_argument(
 )
 parser.add_argument("--matplotlib-backend", type=str, default="TkAgg", help="Matplotlib interactive backend")
 parser.add_argument("--show-velocity", action="store_true", default=False, help="Show velocity vectors")
+parser.add_argument(
+    "--realtime",
+    action="store_true",
+    default=False,
+    help="Synchronize the playback with the wall clock, skipping frames when drawing falls behind",
+)
+parser.add_argument("--playback-speed", type=float, default=1.0, help="Initial real-time playback speed")
 # parser.add_argument("--show-frames", type=str, default="", help="Show frames")
 
 args, _ = parser.parse_known_args()
@@ -31,5 +38,7 @@ viewer = MotionViewer(
     render_scene=args.render_scene,
     show_velocity=args.show_velocity,
     show_frames=frame_list,
+    realtime=args.realtime,
+    playback_speed=args.playback_speed,
 )
 viewer.show()
@@ -1,6 +1,31 @@
-import numpy as np
+import argparse
+import os
+import tempfile
 
-data = np.load("data/recorded_motion.npz", allow_pickle=True)
+import matplotlib
+from poselib_v2.evaluation import TrackingEvaluator, convert_recording, summarize
+from poselib_v2.motion_loader import MotionLoader
+from poselib_v2.motion_viewer import MotionViewer
 
 
-breakpoint()
+parser = argparse.ArgumentParser()
+parser.add_argument("--file", type=str, default="data/recorded_motion.npz", help="Recording file")
+parser.add_argument("--rollout", type=int, default=0, help="Rollout to view, if the recording is batched")
+parser.add_argument("--output", type=str, default=None, help="Motion file to which the rollout is converted")
+parser.add_argument("--reference", type=str, default=None, help="Reference motion file, to print the tracking errors")
+parser.add_argument("--start-time", type=float, default=0.0, help="Reference time of the first recorded frame")
+parser.add_argument("--align", action="store_true", default=False, help="Refine the start times of the rollouts")
+parser.add_argument("--matplotlib-backend", type=str, default="TkAgg", help="Matplotlib interactive backend")
+args, _ = parser.parse_known_args()
+
+if args.reference is not None:
+    evaluator = TrackingEvaluator(MotionLoader(args.reference, "cpu"))
+    summarize(evaluator.evaluate(args.file, args.start_time, align=args.align))
+
+# https://matplotlib.org/stable/users/explain/figure/backends.html#interactive-backends
+matplotlib.use(args.matplotlib_backend)
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    output = args.output or os.path.join(tmp_dir, "recording.npz")
+    convert_recording(args.file, output, rollout=args.rollout)
+    MotionViewer(output, render_scene=True).show()
@@ -0,0 +1,162 @@
+"""
+Motion augmentation applied to sampled motion data.
+
+Instead of writing augmented copies of the motion files, the augmentation (yaw rotation, planar translation,
+left/right mirroring and time scaling) is applied per sample, as a few batched tensor operations on the
+interpolated positions, rotations and velocities.
+"""
+
+import math
+from typing import Optional
+
+import torch
+
+
+class MotionAugmentation:
+    """
+    Per-sample augmentation parameters.
+
+    The augmentations are applied in the following order: mirroring across the XZ plane (left and right bodies
+    and joints are swapped), rotation about the world Z axis (yaw), then translation in the XY plane.
+    Time scaling plays the motion ``time_scale`` times faster: velocities are scaled accordingly.
+    """
+
+    def __init__(
+        self,
+        yaw: Optional[torch.Tensor] = None,
+        translation: Optional[torch.Tensor] = None,
+        mirror: Optional[torch.Tensor] = None,
+        time_scale: Optional[torch.Tensor] = None,
+    ) -> None:
+        """
+        Args:
+            yaw: Rotation angle about the world Z axis, in radians. Shape is (N,).
+            translation: Translation in the world XY plane. Shape is (N, 2).
+            mirror: Whether the sample is mirrored. Shape is (N,).
+            time_scale: Playback speed factor of the motion. Shape is (N,).
+        """
+        self.yaw = yaw
+        self.translation = translation
+        self.mirror = mirror
+        self.time_scale = time_scale
+
+    @classmethod
+    def random(
+        cls,
+        num_samples: int,
+        device: torch.device | str = "cpu",
+        max_yaw: float = math.pi,
+        max_translation: float = 0.0,
+        mirror_probability: float = 0.5,
+        time_scale_range: tuple[float, float] = (1.0, 1.0),
+    ) -> "MotionAugmentation":
+        """Sample random augmentation parameters uniformly.
+
+        Args:
+            num_samples: Number of samples.
+            device: The device of the parameters.
+            max_yaw: Maximum absolute yaw angle, in radians.
+            max_translation: Maximum absolute translation along the X and Y axes.
+            mirror_probability: Probability of mirroring a sample.
+            time_scale_range: Minimum and maximum time scale.
+
+        Returns:
+            The augmentation parameters.
+        """
+        low, high = time_scale_range
+        return cls(
+            yaw=max_yaw * (2.0 * torch.rand(num_samples, device=device) - 1.0) if max_yaw else None,
+            translation=(
+                max_translation * (2.0 * torch.rand(num_samples, 2, device=device) - 1.0) if max_translation else None
+            ),
+            mirror=torch.rand(num_samples, device=device) < mirror_probability if mirror_probability else None,
+            time_scale=(
+                low + (high - low) * torch.rand(num_samples, device=device) if (low, high) != (1.0, 1.0) else None
+            ),
+        )
+
+    def apply(
+        self,
+        dof_positions: torch.Tensor,
+        dof_velocities: torch.Tensor,
+        body_positions: torch.Tensor,
+        body_rotations: torch.Tensor,
+        body_linear_velocities: torch.Tensor,
+        body_angular_velocities: torch.Tensor,
+        body_mirror_indices: Optional[torch.Tensor] = None,
+        dof_mirror_indices: Optional[torch.Tensor] = None,
+        dof_mirror_signs: Optional[torch.Tensor] = None,
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Augment sampled motion data.
+
+        Args:
+            dof_positions: DOF positions. Shape is (N, num_dofs).
+            dof_velocities: DOF velocities. Shape is (N, num_dofs).
+            body_positions: Body positions. Shape is (N, num_bodies, 3).
+            body_rotations: Body rotations, as wxyz quaternions. Shape is (N, num_bodies, 4).
+            body_linear_velocities: Body linear velocities. Shape is (N, num_bodies, 3).
+            body_angular_velocities: Body angular velocities. Shape is (N, num_bodies, 3).
+            body_mirror_indices: Index of the mirrored counterpart of each body. Required for mirroring.
+            dof_mirror_indices: Index of the mirrored counterpart of each DOF. Required for mirroring.
+            dof_mirror_signs: Sign of each DOF under mirroring. Required for mirroring.
+
+        Returns:
+            The augmented motion data, in the same order as the arguments.
+        """
+        if self.mirror is not None:
+            mask = self.mirror.view(-1, 1)
+            dof_positions = torch.where(mask, dof_positions[:, dof_mirror_indices] * dof_mirror_signs, dof_positions)
+            dof_velocities = torch.where(
+                mask, dof_velocities[:, dof_mirror_indices] * dof_mirror_signs, dof_velocities
+            )
+            mask = mask.unsqueeze(-1)
+            # reflection across the XZ plane: y -> -y for vectors, (w, -x, y, -z) for rotations
+            # and (-x, y, -z) for angular velocities (pseudo vectors)
+            signs = body_positions.new_tensor([1.0, -1.0, 1.0])
+            body_positions = torch.where(mask, body_positions[:, body_mirror_indices] * signs, body_positions)
+            body_linear_velocities = torch.where(
+                mask, body_linear_velocities[:, body_mirror_indices] * signs, body_linear_velocities
+            )
+            body_angular_velocities = torch.where(
+                mask, body_angular_velocities[:, body_mirror_indices] * -signs, body_angular_velocities
+            )
+            signs = body_rotations.new_tensor([1.0, -1.0, 1.0, -1.0])
+            body_rotations = torch.where(mask, body_rotations[:, body_mirror_indices] * signs, body_rotations)
+
+        if self.yaw is not None:
+            cos, sin = torch.cos(self.yaw).view(-1, 1), torch.sin(self.yaw).view(-1, 1)
+            body_positions = _rotate_yaw(body_positions, cos, sin)
+            body_linear_velocities = _rotate_yaw(body_linear_velocities, cos, sin)
+            body_angular_velocities = _rotate_yaw(body_angular_velocities, cos, sin)
+            # left-multiply by the yaw quaternion (cos(yaw / 2), 0, 0, sin(yaw / 2))
+            cos, sin = torch.cos(0.5 * self.yaw).view(-1, 1), torch.sin(0.5 * self.yaw).view(-1, 1)
+            w, x, y, z = body_rotations.unbind(-1)
+            body_rotations = torch.stack(
+                [cos * w - sin * z, cos * x - sin * y, cos * y + sin * x, cos * z + sin * w], dim=-1
+            )
+
+        if self.translation is not None:
+            body_positions = body_positions.clone()
+            body_positions[..., :2] += self.translation.unsqueeze(1)
+
+        if self.time_scale is not None:
+            scale = self.time_scale.view(-1, 1)
+            dof_velocities = dof_velocities * scale
+            scale = scale.unsqueeze(-1)
+            body_linear_velocities = body_linear_velocities * scale
+            body_angular_velocities = body_angular_velocities * scale
+
+        return (
+            dof_positions,
+            dof_velocities,
+            body_positions,
+            body_rotations,
+            body_linear_velocities,
+            body_angular_velocities,
+        )
+
+
+def _rotate_yaw(vectors: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor) -> torch.Tensor:
+    """Rotate vectors of shape (N, M, 3) about the Z axis, given the (N, 1) cosine and sine of the angles"""
+    x, y, z = vectors.unbind(-1)
+    return torch.stack([cos * x - sin * y, sin * x + cos * y, z], dim=-1)
@@ -0,0 +1,339 @@
+"""
+Resumable parallel batch conversion of a directory of source motions.
+
+The progress of every conversion job is recorded in a manifest file in the output directory,
+so an interrupted run resumes where it stopped. Failed jobs are retried and isolated from the others.
+"""
+
+import fnmatch
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+
+MANIFEST_FILENAME = "batch_manifest.json"
+
+
+class ConverterBackend:
+    """
+    Base class of the converter backends.
+
+    A backend converts one source motion file into a motion file in the standard format.
+    Backends are sent to the worker processes, so they must be picklable.
+    """
+
+    def convert(self, source_file: str, output_file: str, mapping_name: str) -> None:
+        """Convert a source motion.
+
+        Args:
+            source_file: The source motion file.
+            output_file: The output motion file to write.
+            mapping_name: The mapping name, e.g. ``UnitreeG1Mapping.mmd_yyb``.
+
+        Raises:
+            Exception: If the conversion fails.
+        """
+        raise NotImplementedError
+
+
+class BlenderBackend(ConverterBackend):
+    """
+    Converter backend running each conversion in a headless Blender instance.
+    """
+
+    def __init__(
+        self,
+        blender: str = "blender",
+        blend_file: str | None = None,
+        armature: str | None = None,
+        scaling_ratio: float = 1.0,
+        timeout: float | None = None,
+    ) -> None:
+        """
+        Args:
+            blender: The Blender executable.
+            blend_file: The blend file to open before importing the source motion (e.g. the MMD model).
+            armature: The name of the armature in the blend file.
+            scaling_ratio: The scaling ratio of the armature.
+            timeout: Maximum time in seconds of one conversion.
+        """
+        self.blender = blender
+        self.blend_file = blend_file
+        self.armature = armature
+        self.scaling_ratio = scaling_ratio
+        self.timeout = timeout
+
+    def convert(self, source_file: str, output_file: str, mapping_name: str) -> None:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_convert.py")
+        command = [self.blender, "--background"]
+        if self.blend_file:
+            command.append(self.blend_file)
+        command += ["--python-exit-code", "1", "--python", script, "--"]
+        command += ["--source", source_file, "--output", output_file, "--mapping", mapping_name]
+        command += ["--scaling-ratio", str(self.scaling_ratio)]
+        if self.armature:
+            command += ["--armature", self.armature]
+
+        result = subprocess.run(command, capture_output=True, text=True, timeout=self.timeout)
+        if result.returncode != 0:
+            msg = f"Blender exited with code {result.returncode}: {result.stderr.strip()[-2000:]}"
+            raise RuntimeError(msg)
+
+
+class PythonBackend(ConverterBackend):
+    """
+    Converter backend calling a Python converter function in the worker process.
+    """
+
+    def __init__(self, converter: str) -> None:
+        """
+        Args:
+            converter: The converter function, as ``<module>:<function>``. The function is called
+                with the source file, the output file and the mapping name.
+        """
+        self.converter = converter
+
+    def convert(self, source_file: str, output_file: str, mapping_name: str) -> None:
+        module_name, _, function_name = self.converter.partition(":")
+        function: Callable = getattr(importlib.import_module(module_name), function_name)
+        function(source_file, output_file, mapping_name)
+
+
+def _run_job(backend: ConverterBackend, source_file: str, output_file: str, mapping_name: str) -> str | None:
+    """
+    Run one conversion job in a worker process.
+
+    The motion is first written to a temporary file, which is moved to the output path only
+    on success, so a partially written file is never taken for a finished conversion.
+
+    Returns:
+        None on success, otherwise the error message.
+    """
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    partial_file = output_file[: -len(".npz")] + ".partial.npz"
+    try:
+        backend.convert(source_file, partial_file, mapping_name)
+        os.replace(partial_file, output_file)
+    except Exception as error:  # noqa: BLE001 - isolate any failure to its own job
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        return f"{type(error).__name__}: {error}"
+    return None
+
+
+class BatchConverter:
+    """
+    Scheduler distributing the conversion of a directory of source motions over worker processes.
+    """
+
+    def __init__(
+        self,
+        input_dir: str,
+        output_dir: str,
+        mapping_name: str,
+        backend: ConverterBackend,
+        pattern: str = "*",
+        num_workers: int = 1,
+        max_retries: int = 2,
+    ) -> None:
+        """
+        Args:
+            input_dir: Directory of the source motions, searched recursively.
+            output_dir: Directory of the converted motions. The directory structure of the sources is kept.
+            mapping_name: The mapping name, e.g. ``UnitreeG1Mapping.mmd_yyb``.
+            backend: The converter backend.
+            pattern: File name pattern of the source motions, e.g. ``*.vmd``.
+            num_workers: Number of worker processes.
+            max_retries: Number of times a failed job is retried during a run.
+        """
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.mapping_name = mapping_name
+        self.backend = backend
+        self.pattern = pattern
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+
+        self.manifest_file = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        """Load the manifest of a previous run, or create an empty one."""
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, "r") as f:
+                manifest = json.load(f)
+            assert manifest["mapping"] == self.mapping_name, (
+                f"The output directory was converted with mapping {manifest['mapping']},"
+                f" not {self.mapping_name}"
+            )
+            return manifest
+        return {"mapping": self.mapping_name, "jobs": {}}
+
+    def _save_manifest(self) -> None:
+        """Atomically write the manifest."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        temporary_file = self.manifest_file + ".tmp"
+        with open(temporary_file, "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(temporary_file, self.manifest_file)
+
+    def find_sources(self) -> list[str]:
+        """Find the source motions, as paths relative to the input directory."""
+        sources = []
+        for root, _, files in os.walk(self.input_dir):
+            for name in fnmatch.filter(files, self.pattern):
+                sources.append(os.path.relpath(os.path.join(root, name), self.input_dir))
+        return sorted(sources)
+
+    def pending_jobs(self) -> list[str]:
+        """Get the source motions which are not converted yet."""
+        pending = []
+        for source in self.find_sources():
+            job = self.manifest["jobs"].setdefault(source, {"status": "pending", "attempts": 0})
+            job["output"] = os.path.splitext(source)[0] + ".npz"
+            finished = job["status"] == "done" and os.path.isfile(os.path.join(self.output_dir, job["output"]))
+            if not finished:
+                job["status"] = "pending"
+                pending.append(source)
+        return pending
+
+    def run(self) -> dict[str, int]:
+        """Run all the pending conversion jobs.
+
+        A job killing its worker process (e.g. a crash in native code) breaks the whole process pool. The pool
+        is then replaced, and the jobs which were in flight are run again one at a time, so the attempt is only
+        counted against the job which killed its worker.
+
+        Returns:
+            Number of jobs per final status.
+        """
+        pending = self.pending_jobs()
+        self._save_manifest()
+        print(f"Converting {len(pending)} motions ({len(self.manifest['jobs']) - len(pending)} already done)")
+
+        start_time = time.perf_counter()
+        self._retries = {source: 0 for source in pending}
+        queue = deque(pending)
+        # jobs in flight when a worker process died, run again one at a time to find the one which killed it
+        suspects: deque[str] = deque()
+        running: dict[Future, str] = {}
+        executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        try:
+            while queue or suspects or running:
+                # only the jobs being run are submitted, so a dead worker only breaks the jobs in flight
+                if suspects:
+                    if not running:
+                        source = suspects.popleft()
+                        running[self._submit(executor, source)] = source
+                else:
+                    while queue and len(running) < self.num_workers:
+                        source = queue.popleft()
+                        try:
+                            running[self._submit(executor, source)] = source
+                        except BrokenProcessPool:
+                            # a worker died, the jobs in flight are collected below
+                            queue.appendleft(source)
+                            break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                    # the pool is unusable, collect all the jobs in flight and start a new pool
+                    done, _ = wait(running)
+                    executor.shutdown(wait=True)
+                    executor = ProcessPoolExecutor(max_workers=self.num_workers)
+
+                crashed = []
+                for future in done:
+                    source = running.pop(future)
+                    try:
+                        error = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(source)
+                        continue
+                    except Exception as exception:  # noqa: BLE001 - e.g. the job could not be sent to the worker
+                        error = f"{type(exception).__name__}: {exception}"
+                    self._complete(source, error, queue)
+
+                if len(crashed) == 1:
+                    # the only job in flight killed its worker process
+                    self._complete(crashed[0], "BrokenProcessPool: the worker process died", queue)
+                else:
+                    suspects.extend(sorted(crashed))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        summary = {}
+        for job in self.manifest["jobs"].values():
+            summary[job["status"]] = summary.get(job["status"], 0) + 1
+        print(f"Done in {time.perf_counter() - start_time:.1f} sec: {summary}")
+        return summary
+
+    def _complete(self, source: str, error: str | None, queue: deque[str]) -> None:
+        """Record an attempt of a job, queuing it again if it failed and can still be retried."""
+        job = self.manifest["jobs"][source]
+        job["attempts"] += 1
+        if error is None:
+            job["status"] = "done"
+            job.pop("error", None)
+            print(f"Converted {source}")
+        elif self._retries[source] < self.max_retries:
+            self._retries[source] += 1
+            job["error"] = error
+            print(f"Retrying {source} ({self._retries[source]}/{self.max_retries}): {error}")
+            queue.append(source)
+        else:
+            job["status"] = "failed"
+            job["error"] = error
+            print(f"FAILED {source}: {error}")
+        self._save_manifest()
+
+    def _submit(self, executor: ProcessPoolExecutor, source: str) -> Future:
+        """Submit the conversion job of a source motion."""
+        source_file = os.path.join(self.input_dir, source)
+        output_file = os.path.join(self.output_dir, self.manifest["jobs"][source]["output"])
+        return executor.submit(_run_job, self.backend, source_file, output_file, self.mapping_name)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", type=str, required=True, help="Directory of the source motions")
+    parser.add_argument("--output-dir", type=str, required=True, help="Directory of the converted motions")
+    parser.add_argument("--mapping", type=str, required=True, help="Mapping name, e.g. UnitreeG1Mapping.mmd_yyb")
+    parser.add_argument("--pattern", type=str, default="*", help="File name pattern of the source motions")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--retries", type=int, default=2, help="Number of retries of a failed conversion")
+    parser.add_argument("--backend", type=str, choices=["blender", "python"], default="blender", help="Converter")
+    parser.add_argument("--blender", type=str, default="blender", help="Blender executable (blender backend)")
+    parser.add_argument("--blend-file", type=str, default=None, help="Blend file to open (blender backend)")
+    parser.add_argument("--armature", type=str, default=None, help="Armature name (blender backend)")
+    parser.add_argument("--scaling-ratio", type=float, default=1.0, help="Armature scaling (blender backend)")
+    parser.add_argument("--timeout", type=float, default=None, help="Conversion timeout (blender backend)")
+    parser.add_argument("--converter", type=str, default=None, help="<module>:<function> (python backend)")
+    args, _ = parser.parse_known_args()
+
+    if args.backend == "blender":
+        backend = BlenderBackend(args.blender, args.blend_file, args.armature, args.scaling_ratio, args.timeout)
+    else:
+        assert args.converter, "The python backend requires a --converter"
+        backend = PythonBackend(args.converter)
+
+    converter = BatchConverter(
+        args.input_dir,
+        args.output_dir,
+        args.mapping,
+        backend,
+        pattern=args.pattern,
+        num_workers=args.workers,
+        max_retries=args.retries,
+    )
+    summary = converter.run()
+    sys.exit(1 if summary.get("failed") else 0)
@@ -0,0 +1,86 @@
+"""
+Convert one source motion inside Blender.
+
+This script is run by the Blender batch conversion backend:
+
+    blender --background <blend_file> --python blender_convert.py -- \
+        --source <motion> --output <motion.npz> --mapping <MappingClass>.<table>
+"""
+
+import argparse
+import os
+import sys
+
+import bpy
+
+# make the sibling modules importable from Blender's interpreter
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from blender_drivers import build_motion_data, export_motion_data  # noqa: E402
+from mapping import get_mapping  # noqa: E402
+
+
+def import_source_motion(source_file: str, armature_name: str | None) -> bpy.types.Object:
+    """
+    Import the source motion and return the armature it animates.
+
+    Args:
+        source_file: The source motion file (``.vmd``, ``.bvh`` or ``.fbx``).
+        armature_name: The name of the armature already present in the scene. Required for
+            ``.vmd`` motions, which are applied onto an existing model.
+
+    Raises:
+        ValueError: If the file type is not supported or the armature cannot be found.
+
+    Returns:
+        The animated armature object.
+    """
+    extension = os.path.splitext(source_file)[1].lower()
+
+    if extension == ".vmd":
+        armature = bpy.data.objects.get(armature_name or "")
+        if armature is None:
+            msg = f"Cannot find armature {armature_name} to apply {source_file} on."
+            raise ValueError(msg)
+        bpy.context.view_layer.objects.active = armature
+        armature.select_set(True)
+        bpy.ops.mmd_tools.import_vmd(filepath=source_file)
+    elif extension == ".bvh":
+        bpy.ops.import_anim.bvh(filepath=source_file)
+        armature = bpy.context.active_object
+    elif extension == ".fbx":
+        bpy.ops.import_scene.fbx(filepath=source_file)
+        armature = bpy.data.objects.get(armature_name or "") or bpy.context.active_object
+    else:
+        msg = f"Unsupported source motion type: {source_file}"
+        raise ValueError(msg)
+
+    # use the animation range of the imported motion
+    action = armature.animation_data.action
+    start, end = action.frame_range
+    bpy.context.scene.frame_start = int(start)
+    bpy.context.scene.frame_end = int(end)
+    return armature
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, required=True, help="Source motion file")
+    parser.add_argument("--output", type=str, required=True, help="Output motion file")
+    parser.add_argument("--mapping", type=str, required=True, help="Mapping name, e.g. UnitreeG1Mapping.mmd_yyb")
+    parser.add_argument("--armature", type=str, default=None, help="Name of the armature in the blend file")
+    parser.add_argument("--scaling-ratio", type=float, default=1.0, help="Scaling ratio of the armature")
+    parser.add_argument("--codec", type=str, default=None, help="Compression codec of the output (zlib or lzma)")
+    parser.add_argument("--delta", action="store_true", default=False, help="Delta encode frames before compression")
+    parser.add_argument("--smooth", type=str, choices=["savgol", "lowpass"], default=None, help="Smoothing filter")
+    parser.add_argument("--smooth-window", type=int, default=9, help="Smoothing window length, in frames (odd)")
+    # Blender's own arguments come before "--"
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    args = parser.parse_args(argv)
+
+    armature = import_source_motion(args.source, args.armature)
+    smoothing = {"method": args.smooth, "window": args.smooth_window} if args.smooth else None
+    motion_data = build_motion_data(
+        armature, get_mapping(args.mapping), scaling_ratio=args.scaling_ratio, smoothing=smoothing
+    )
+    export_motion_data(args.output, motion_data, codec=args.codec, delta=args.delta)
@@ -1,10 +1,21 @@
-from typing import Callable
+import time
 
 import numpy as np
 import bpy
 import bpy_types
 from mathutils import Vector
 
+try:
+    from .mapping import compile_mapping
+    from .math_utils import matrix_to_quat
+    from .motion_io import MotionWriter, save_motion_data
+    from .processing import MotionPostProcessor, smooth_motion
+except ImportError:
+    from mapping import compile_mapping
+    from math_utils import matrix_to_quat
+    from motion_io import MotionWriter, save_motion_data
+    from processing import MotionPostProcessor, smooth_motion
+
 
 C = bpy.context
 D = bpy.data
@@ -36,44 +47,6 @@ armature.data.bones
 """
 
 
-def quat_mul(q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
-    """Multiply two quaternions together.
-
-    Args:
-        q1: The first quaternion in (w, x, y, z). Shape is (..., 4).
-        q2: The second quaternion in (w, x, y, z). Shape is (..., 4).
-
-    Returns:
-        The product of the two quaternions in (w, x, y, z). Shape is (..., 4).
-
-    Raises:
-        ValueError: Input shapes of ``q1`` and ``q2`` are not matching.
-    """
-    # check input is correct
-    if q1.shape != q2.shape:
-        msg = f"Expected input quaternion shape mismatch: {q1.shape} != {q2.shape}."
-        raise ValueError(msg)
-    # reshape to (N, 4) for multiplication
-    shape = q1.shape
-    q1 = q1.reshape(-1, 4)
-    q2 = q2.reshape(-1, 4)
-    # extract components from quaternions
-    w1, x1, y1, z1 = q1[:, 0], q1[:, 1], q1[:, 2], q1[:, 3]
-    w2, x2, y2, z2 = q2[:, 0], q2[:, 1], q2[:, 2], q2[:, 3]
-    # perform multiplication
-    ww = (z1 + x1) * (x2 + y2)
-    yy = (w1 - y1) * (w2 + z2)
-    zz = (w1 + y1) * (w2 - z2)
-    xx = ww + yy + zz
-    qq = 0.5 * (xx + (z1 - x1) * (x2 - y2))
-    w = qq - ww + (z1 - y1) * (y2 - z2)
-    x = qq - xx + (x1 + w1) * (x2 + w2)
-    y = qq - yy + (w1 - x1) * (y2 + z2)
-    z = qq - zz + (z1 + y1) * (w2 - x2)
-
-    return np.stack([w, x, y, z], axis=-1).reshape(shape)
-
-
 def cleanup_usd_axis_display(display_size: float = 0.01) -> None:
     """
     This function shrinks the axis display of the imported IsaacLab USD object
@@ -132,33 +105,86 @@ def set_bones_to_1d_rotation(armature: bpy_types.Object) -> None:
         bone.lock_ik_z = False
 
 
+def read_pose_bones(
+    pose_bones: bpy.types.bpy_prop_collection,
+    head_tail: np.ndarray,
+    matrices: np.ndarray,
+) -> None:
+    """
+    Read the head, tail and pose matrix of all the pose bones in bulk.
+
+    Args:
+        pose_bones: The pose bones collection of the armature.
+        head_tail: Output buffer for the head and tail positions. Shape is (num_bones, 2, 3).
+        matrices: Output buffer for the pose matrices. Shape is (num_bones, 4, 4).
+    """
+    n_bone = len(pose_bones)
+    # foreach_get needs flat contiguous buffers matching the property type
+    heads = np.empty(n_bone * 3, dtype=np.float32)
+    tails = np.empty(n_bone * 3, dtype=np.float32)
+    flat_matrices = np.empty(n_bone * 16, dtype=np.float32)
+
+    pose_bones.foreach_get("head", heads)
+    pose_bones.foreach_get("tail", tails)
+    pose_bones.foreach_get("matrix", flat_matrices)
+
+    head_tail[:, 0, :] = heads.reshape(n_bone, 3)
+    head_tail[:, 1, :] = tails.reshape(n_bone, 3)
+    # matrices are flattened in column-major order
+    matrices[:] = flat_matrices.reshape(n_bone, 4, 4).transpose(0, 2, 1)
+
+
 def build_motion_data(
     armature: bpy_types.Object,
-    mapping: dict[str, tuple[str, Callable]],
+    mapping: dict[str, tuple],
     scaling_ratio: float = 1.0,
-) -> dict:
+    force_redraw: bool = False,
+    progress_interval: float = 1.0,
+    writer: MotionWriter | None = None,
+    smoothing: dict | None = None,
+) -> dict | None:
     """
     Build motion data from the source armature.
 
+    Each frame is evaluated through the dependency graph and all the pose bones are read in bulk.
+    When a ``writer`` is given, the frames are extracted, post-processed and flushed to disk chunk by chunk
+    instead of being held in memory, which allows arbitrarily long motions.
+
     Args:
         armature: The source armature object.
-        mapping: The mapping from bone names to their positions.
+        mapping: The mapping from body names to their source bone entries.
         scaling_ratio: The scaling ratio of the armature.
+        force_redraw: Whether to force a UI redraw on every frame. Only needed for rigs that
+            update the pose from UI handlers, this makes the extraction significantly slower.
+        progress_interval: Minimum time in seconds between two progress reports.
+        writer: The motion writer to stream the frames to. The caller finalizes the writer.
+            Use :func:`create_motion_writer` to create it.
+        smoothing: The parameters of :func:`~poselib_v2.processing.smooth_motion` (e.g. ``{"method": "savgol",
+            "window": 9}``) to smooth the extracted motion and re-derive its velocities, or None to not smooth it.
+            Smoothing needs the whole motion, so it cannot be combined with ``writer``.
 
     Returns:
-        A dictionary containing the motion data.
+        A dictionary containing the motion data, or None if the frames are streamed to ``writer``.
     """
-    fps_exact = C.scene.render.fps / C.scene.render.fps_base
-    start_frame = C.scene.frame_start
-    end_frame = C.scene.frame_end
+    scene = C.scene
+    fps_exact = scene.render.fps / scene.render.fps_base
+    start_frame = scene.frame_start
+    end_frame = scene.frame_end
 
     assert end_frame >= start_frame, f"Frame range is invalid: {start_frame} to {end_frame}"
+    assert writer is None or smoothing is None, "Streamed motions cannot be smoothed, smooth the finalized file"
+
+    # resolve the source bones once, this fails early if any of them is missing
+    plan = compile_mapping(mapping, armature.pose.bones.keys())
 
-    link_names = list(mapping.keys())
+    # the per-frame buffers only hold the bones referenced by the mapping (rigs can have hundreds of bones)
+    used_bones = plan.used_bone_indices
+    body_plan = plan.used_bones_plan()
 
     n_frames = end_frame - start_frame + 1
     n_dof = 0  # the number of skeleton DOFs
-    n_body = len(link_names)
+    n_bone = body_plan.num_bones
+    chunk_size = n_frames if writer is None else writer.chunk_size
 
     # === create motion data buffers ===
     # frame rate
@@ -166,115 +192,115 @@ def build_motion_data(
     # joint names
     dof_names = np.array([])
     # body names
-    body_names = np.array(link_names)
+    body_names = np.array(plan.body_names)
     # joint positions
-    dof_positions = np.zeros((n_frames, n_dof), dtype=np.float32)
-    # joint velocities
-    dof_velocities = np.zeros((n_frames, n_dof), dtype=np.float32)
-    # body world positions
-    body_positions = np.zeros((n_frames, n_body, 3), dtype=np.float32)
-    # body world rotations
-    body_rotations = np.zeros((n_frames, n_body, 4), dtype=np.float32)
-    # body world linear velocities
-    body_linear_velocities = np.zeros((n_frames, n_body, 3), dtype=np.float32)
-    # body world angular velocities
-    body_angular_velocities = np.zeros((n_frames, n_body, 3), dtype=np.float32)
-
-    # used to calculate angular velocities
-    body_rotations_euler = np.zeros((n_frames, n_body, 3), dtype=np.float32)
-
-    # ensure correct default quaternion representation
-    body_rotations[:, :, 0] = 1.0
+    dof_positions = np.zeros((chunk_size, n_dof), dtype=np.float32)
+
+    # source bone head and tail positions
+    bone_head_tail = np.zeros((chunk_size, n_bone, 2, 3), dtype=np.float32)
+    # source bone pose matrices
+    bone_matrices = np.zeros((chunk_size, n_bone, 4, 4), dtype=np.float32)
+    # scratch buffers of a single frame, for all the pose bones read in bulk
+    frame_head_tail = np.zeros((plan.num_bones, 2, 3), dtype=np.float32)
+    frame_matrices = np.zeros((plan.num_bones, 4, 4), dtype=np.float32)
+
+    post_processor = MotionPostProcessor(fps_exact, scaling_ratio=scaling_ratio)
+    chunks = []
 
     # === extract motion data ===
-    for frame in range(n_frames):
-        # navigate to the corresponding frame
-        bpy.context.scene.frame_set(start_frame + frame)
-        bpy.context.view_layer.update()
-
-        # force UI update to update bone pose matrix
-        bpy.ops.wm.redraw_timer(type="DRAW_WIN_SWAP", iterations=1)
-
-        # read bone positions
-        for idx, name in enumerate(body_names):
-            entry = mapping.get(name)
-            if not entry:
-                print(f"WARNING: cannot find link mapping for {name}")
-                continue
-        
-            source_bone_name, mapping_function = entry
-
-            source_bone = armature.pose.bones.get(source_bone_name)
-            if not source_bone:
-                print(f"WARNING: cannot find source bone {source_bone_name}")
-                continue
-
-            body_positions[frame, idx, :] = mapping_function(source_bone)
-
-            matrix = source_bone.matrix
-            body_rotations[frame, idx, :] = matrix.to_quaternion()
-            body_rotations_euler[frame, idx, :] = matrix.to_euler()
-
-        print(f"Processing: #{frame}/{n_frames} ({frame / n_frames * 100:.2f}%)")
-
-    # === post-process motion data ===
-    # cancel first frame global offset
-    offset_x = np.mean(body_positions[0, :, 0])
-    offset_y = np.mean(body_positions[0, :, 1])
-    body_positions[:, :, 0] -= offset_x
-    body_positions[:, :, 1] -= offset_y
-
-    # in Blender, scaling the armature does not scale the retreived bone position, so we need to
-    # manually apply the scaling to the sampled data here.
-    body_positions[:] *= scaling_ratio
-
-    # calculate velocities
-    body_linear_velocities[1:] = np.diff(body_positions, axis=0) / (1 / fps_exact)
-
-    # calculate angular velocities
-    # handle euler angle discontinuity
-    # TODO: this is not quite correct, we need to use quaternions to calculate angular velocities
-    body_rotations_euler = np.unwrap(body_rotations_euler, axis=0)
-    body_angular_velocities[1:] = np.diff(body_rotations_euler, axis=0) / (1 / fps_exact)
-
-    # handle euler angle wrapping
-    body_angular_velocities = np.unwrap(body_angular_velocities, axis=0)
+    depsgraph = C.evaluated_depsgraph_get()
+    last_report = time.perf_counter()
+    for chunk_start in range(0, n_frames, chunk_size):
+        chunk_frames = min(chunk_size, n_frames - chunk_start)
+
+        for offset in range(chunk_frames):
+            frame = chunk_start + offset
+            # navigate to the corresponding frame, this re-evaluates the dependency graph
+            scene.frame_set(start_frame + frame)
+
+            if force_redraw:
+                C.view_layer.update()
+                O.wm.redraw_timer(type="DRAW_WIN_SWAP", iterations=1)
+
+            pose_bones = armature.evaluated_get(depsgraph).pose.bones
+            read_pose_bones(pose_bones, frame_head_tail, frame_matrices)
+            bone_head_tail[offset] = frame_head_tail[used_bones]
+            bone_matrices[offset] = frame_matrices[used_bones]
+
+            now = time.perf_counter()
+            if now - last_report >= progress_interval:
+                print(f"Processing: #{frame}/{n_frames} ({frame / n_frames * 100:.2f}%)")
+                last_report = now
+
+        # convert the pose matrices of the bones referenced by the mapping
+        body_matrices = body_plan.gather(bone_matrices[:chunk_frames])
+        body_rotations = matrix_to_quat(body_matrices).astype(np.float32)
+        body_positions = body_plan.gather_positions(bone_head_tail[:chunk_frames])
+
+        # === post-process motion data ===
+        chunk = post_processor.process(dof_positions[:chunk_frames], body_positions, body_rotations)
+        if writer is None:
+            chunks.append(chunk)
+        else:
+            writer.append(chunk)
 
     print(f"Done generating {n_frames} frames ({n_frames / fps_exact:.2f} seconds)")
 
-    return {
+    if writer is not None:
+        return None
+
+    motion_data = {
         "fps": fps,
         "dof_names": dof_names,
         "body_names": body_names,
-        "dof_positions": dof_positions,
-        "dof_velocities": dof_velocities,
-        "body_positions": body_positions,
-        "body_rotations": body_rotations,
-        "body_linear_velocities": body_linear_velocities,
-        "body_angular_velocities": body_angular_velocities
     }
+    motion_data.update(chunks[0])
+    if smoothing is not None:
+        motion_data = smooth_motion(motion_data, **smoothing)
+    return motion_data
 
 
-def export_motion_data(output_file: str, motion_data: dict) -> None:
+def create_motion_writer(
+    output_file: str,
+    armature: bpy_types.Object,
+    mapping: dict[str, tuple],
+    chunk_size: int = 1024,
+) -> MotionWriter:
+    """
+    Create a motion writer to stream the motion data of the source armature to disk.
+
+    Args:
+        output_file: The path to the output file.
+        armature: The source armature object.
+        mapping: The mapping from body names to their source bone entries.
+        chunk_size: Number of frames per chunk.
+
+    Returns:
+        The motion writer, to be passed to :func:`build_motion_data`.
+    """
+    fps = np.array([C.scene.render.fps / C.scene.render.fps_base], dtype=np.int64)
+    return MotionWriter(output_file, fps, np.array([]), np.array(list(mapping.keys())), chunk_size=chunk_size)
+
+
+def export_motion_data(
+    output_file: str,
+    motion_data: dict,
+    codec: str | None = None,
+    delta: bool = False,
+    num_workers: int | None = None,
+) -> None:
     """
     Export motion data to a Numpy npz file.
 
     Args:
         output_file: The path to the output file.
         motion_data: The motion data to export.
+        codec: The compression codec (``zlib`` or ``lzma``), or None to write an uncompressed npz file.
+            See :func:`motion_io.save_motion_data`.
+        delta: Whether to delta encode consecutive frames before compression.
+        num_workers: Number of compression threads. Defaults to the number of CPUs.
     """
-    np.savez(
-        output_file,
-        fps=motion_data["fps"],
-        dof_names=motion_data["dof_names"],
-        body_names=motion_data["body_names"],
-        dof_positions=motion_data["dof_positions"],
-        dof_velocities=motion_data["dof_velocities"],
-        body_positions=motion_data["body_positions"],
-        body_rotations=motion_data["body_rotations"],
-        body_linear_velocities=motion_data["body_linear_velocities"],
-        body_angular_velocities=motion_data["body_angular_velocities"]
-    )
+    save_motion_data(output_file, motion_data, codec=codec, delta=delta, num_workers=num_workers)
 
     print(f"Results saved to {output_file}")
 
@@ -623,6 +649,48 @@ def bind_to_armature(skeleton_tree: dict):
         frame.matrix_world = matrix_world.copy()
 
 
+def write_keyframes(
+    action: bpy.types.Action,
+    data_path: str,
+    frames: np.ndarray,
+    values: np.ndarray,
+    indices: list[int] | None = None,
+    group: str | None = None,
+) -> None:
+    """
+    Write the keyframes of all the frames into the F-curves of a property in bulk.
+
+    One F-curve is created (or cleared, if it already exists) per channel, and its keyframe points
+    are filled with a single ``foreach_set`` call.
+
+    Args:
+        action: The action to write the F-curves into.
+        data_path: The data path of the animated property, e.g. ``pose.bones["pelvis"].location``.
+        frames: The frame numbers. Shape is (F,).
+        values: The property values. Shape is (F, C).
+        indices: The property array index of each channel. Defaults to ``range(C)``.
+        group: The name of the action group of the F-curves.
+    """
+    n_frames = frames.shape[0]
+    indices = list(range(values.shape[1])) if indices is None else indices
+
+    coordinates = np.empty((n_frames, 2), dtype=np.float32)
+    coordinates[:, 0] = frames
+
+    for channel, index in enumerate(indices):
+        fcurve = action.fcurves.find(data_path, index=index)
+        if fcurve is None:
+            fcurve = action.fcurves.new(data_path, index=index, action_group=group or "")
+        else:
+            fcurve.keyframe_points.clear()
+
+        coordinates[:, 1] = values[:, channel]
+        fcurve.keyframe_points.add(n_frames)
+        fcurve.keyframe_points.foreach_set("co", coordinates.reshape(-1))
+        # recompute the handles of the new keyframes
+        fcurve.update()
+
+
 def load_replay(skeleton_tree: dict, armature: bpy_types.Object, data_path: str):
     # TODO: refactor the replay motion format to use the same format as the motion data
     data = np.load(data_path)
@@ -633,36 +701,40 @@ def load_replay(skeleton_tree: dict, armature: bpy_types.Object, data_path: str)
     root_quaternions = data["root_quaternions"]
     joint_positions = data["joint_positions"]
 
-
-    print(joint_positions.shape)
-
     n_frames = joint_positions.shape[0]
     n_dof = joint_positions.shape[-1]
 
     bpy.context.scene.frame_start = 0
     bpy.context.scene.frame_end = n_frames
 
-    for frame in range(n_frames):
-        bpy.context.scene.frame_set(frame)
-        bpy.context.view_layer.update()
-
-        root = armature.pose.bones.get("pelvis")
-        root.location = root_positions[frame]
-        # root.location[2] -= 0.6
-        root.keyframe_insert(data_path="location", frame=frame)
+    if armature.animation_data is None:
+        armature.animation_data_create()
+    action = armature.animation_data.action
+    if action is None:
+        action = D.actions.new(name=f"{armature.name}Action")
+        armature.animation_data.action = action
 
-        root.rotation_mode = "QUATERNION"
-        root.rotation_quaternion = root_quaternions[frame]
-        root.keyframe_insert(data_path="rotation_quaternion", frame=frame)
+    frames = np.arange(n_frames, dtype=np.float32)
 
-        for joint_idx, joint_name in enumerate(joint_order):
-            bone_name = joint_name.replace("_joint", "")
-            bone = armature.pose.bones.get(bone_name)
-            # ensure using Euler angles
-            bone.rotation_mode = "XYZ"
-            bone.rotation_euler[1] = joint_positions[frame, joint_idx]
+    root = armature.pose.bones.get("pelvis")
+    root.rotation_mode = "QUATERNION"
+    write_keyframes(action, root.path_from_id("location"), frames, root_positions, group=root.name)
+    write_keyframes(action, root.path_from_id("rotation_quaternion"), frames, root_quaternions, group=root.name)
 
-            # insert rotation_euler keyframe, for index 1 (Y-axis)
-            bone.keyframe_insert(data_path="rotation_euler", index=1, frame=frame)
+    for joint_idx, joint_name in enumerate(joint_order):
+        bone_name = joint_name.replace("_joint", "")
+        bone = armature.pose.bones.get(bone_name)
+        # ensure using Euler angles
+        bone.rotation_mode = "XYZ"
 
-        print(f"Processing: #{frame}/{n_frames} ({frame / n_frames * 100:.2f}%)")
+        # write rotation_euler keyframes, for index 1 (Y-axis)
+        write_keyframes(
+            action,
+            bone.path_from_id("rotation_euler"),
+            frames,
+            joint_positions[:, joint_idx : joint_idx + 1],
+            indices=[1],
+            group=bone.name,
+        )
+
+    print(f"Done loading {n_frames} frames for {n_dof} joints")
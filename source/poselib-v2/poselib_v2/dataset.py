@@ -0,0 +1,103 @@
+"""
+Manifest of a dataset of motion files.
+
+The manifest (``dataset_manifest.json`` in the dataset directory) records the frame rate, number of frames
+and skeleton of every motion file, read from the file headers without loading the frames. It is updated
+incrementally: only the motion files added or modified since the last update (by size and modification
+time) are read again. Dataset-level caches (e.g. :mod:`~poselib_v2.dataset_statistics`) are stored next to it.
+"""
+
+import contextlib
+import glob
+import json
+import os
+import tempfile
+
+try:
+    from .motion_io import read_motion_info
+except ImportError:
+    from motion_io import read_motion_info
+
+
+MANIFEST_FILENAME = "dataset_manifest.json"
+# version of the manifest entries, the entries of manifests written by other versions are read again
+MANIFEST_VERSION = 2
+
+
+def find_motion_files(dataset_dir: str) -> list[str]:
+    """Find the motion files of a dataset, as paths relative to the dataset directory."""
+    files = glob.glob(os.path.join(dataset_dir, "**", "*.npz"), recursive=True)
+    return sorted(os.path.relpath(file, dataset_dir) for file in files)
+
+
+def load_dataset_manifest(dataset_dir: str, update: bool = True) -> dict:
+    """Load the manifest of a dataset, creating or updating it if needed.
+
+    Args:
+        dataset_dir: The dataset directory.
+        update: Whether to update the manifest with the motion files added, modified or removed since it
+            was written. If False, the manifest must exist.
+
+    Returns:
+        The manifest: ``{"version", "motions": {path: {"num_frames", "fps", "duration", "dof_names", "body_names",
+        "size", "mtime_ns"}}}``, the motion paths being relative to the dataset directory.
+    """
+    manifest_file = os.path.join(dataset_dir, MANIFEST_FILENAME)
+    manifest = {"version": MANIFEST_VERSION, "motions": {}}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+    if not update:
+        assert os.path.isfile(manifest_file), f"No dataset manifest in {dataset_dir}"
+        return manifest
+    if manifest.get("version") != MANIFEST_VERSION:
+        # e.g. the durations of the decimated motions were computed from their number of frames before version 2
+        manifest = {"version": MANIFEST_VERSION, "motions": {}}
+
+    motions = {}
+    for path in find_motion_files(dataset_dir):
+        stat = os.stat(os.path.join(dataset_dir, path))
+        entry = manifest["motions"].get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            info = read_motion_info(os.path.join(dataset_dir, path))
+            entry = {
+                "num_frames": int(info["num_frames"]),
+                "fps": float(info["fps"]),
+                "duration": info["duration"],
+                "dof_names": info["dof_names"],
+                "body_names": info["body_names"],
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+        motions[path] = entry
+
+    if motions != manifest["motions"]:
+        manifest["motions"] = motions
+        # write atomically, so concurrent jobs never read a partially written manifest, through a temporary file
+        # unique to this process, as several processes (e.g. the ranks of a training) may update it at once
+        fd, temporary_file = tempfile.mkstemp(prefix=f"{MANIFEST_FILENAME}.", suffix=".tmp", dir=dataset_dir)
+        try:
+            if os.name == "posix":
+                # mkstemp creates the file readable by its owner only
+                os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(temporary_file, manifest_file)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary_file)
+            raise
+    return manifest
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-dir", type=str, required=True, help="Directory of motion files")
+    args, _ = parser.parse_known_args()
+
+    manifest = load_dataset_manifest(args.dataset_dir)
+    num_frames = sum(entry["num_frames"] for entry in manifest["motions"].values())
+    duration = sum(entry["duration"] for entry in manifest["motions"].values())
+    print(f"{len(manifest['motions'])} motions, {num_frames} frames, {duration / 3600:.2f} hours")
@@ -0,0 +1,294 @@
+"""
+Streaming per-channel statistics of the frame fields of a dataset of motions (e.g. to normalize observations).
+
+The motions are streamed chunk by chunk (see :class:`~poselib_v2.motion_io.MotionChunkReader`) on a process
+pool, so the memory used doesn't depend on the size of the dataset. A first pass computes the count, mean,
+variance, minimum and maximum of every channel (per DOF, body and axis), merging the statistics of the chunks
+with the parallel algorithm of Chan et al. A second pass accumulates per-channel histograms between the
+minimum and maximum, from which the percentiles are interpolated.
+
+The statistics are cached in the dataset directory, next to its manifest (see :mod:`~poselib_v2.dataset`),
+and recomputed when a motion file of the dataset is added, modified or removed.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .dataset import load_dataset_manifest
+    from .motion_io import FRAME_FIELDS, MotionChunkReader, read_motion_info
+except ImportError:
+    from dataset import load_dataset_manifest
+    from motion_io import FRAME_FIELDS, MotionChunkReader, read_motion_info
+
+
+STATISTICS_FILENAME = "dataset_statistics.stats"
+DEFAULT_PERCENTILES = (1.0, 5.0, 50.0, 95.0, 99.0)
+
+
+class RunningStatistics:
+    """
+    Count, mean, variance, minimum and maximum of streamed values, per channel.
+
+    The values are added in chunks of samples with :meth:`update`, and the statistics of separate streams
+    are combined with :meth:`merge`.
+    """
+
+    def __init__(self, shape: tuple[int, ...]) -> None:
+        """
+        Args:
+            shape: The shape of the channels (the shape of one sample).
+        """
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)  # sum of the squared differences to the mean
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+
+    @property
+    def variance(self) -> np.ndarray:
+        """The (population) variance of the values."""
+        return self.m2 / max(self.count, 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        """The (population) standard deviation of the values."""
+        return np.sqrt(self.variance)
+
+    def update(self, values: np.ndarray) -> "RunningStatistics":
+        """Add a chunk of values.
+
+        Args:
+            values: The values. Shape is (N, *shape).
+
+        Returns:
+            The statistics, updated in place.
+        """
+        if values.shape[0] == 0:
+            return self
+        values = values.astype(np.float64)
+        chunk = RunningStatistics(self.mean.shape)
+        chunk.count = values.shape[0]
+        chunk.mean = values.mean(axis=0)
+        chunk.m2 = ((values - chunk.mean) ** 2).sum(axis=0)
+        chunk.minimum = values.min(axis=0)
+        chunk.maximum = values.max(axis=0)
+        return self.merge(chunk)
+
+    def merge(self, other: "RunningStatistics") -> "RunningStatistics":
+        """Merge the statistics of other values (Chan et al.).
+
+        Args:
+            other: The statistics of the other values.
+
+        Raises:
+            ValueError: If the shapes of the channels differ.
+
+        Returns:
+            The statistics, updated in place.
+        """
+        if other.mean.shape != self.mean.shape:
+            msg = f"Can't merge statistics of shape {other.mean.shape} into statistics of shape {self.mean.shape}"
+            raise ValueError(msg)
+        count = self.count + other.count
+        if other.count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta * delta * (self.count * other.count / count)
+        self.count = count
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        return self
+
+
+def _histogram(values: np.ndarray, low: np.ndarray, high: np.ndarray, bins: int) -> np.ndarray:
+    """Per-channel histograms of (N, *shape) values, with ``bins`` bins between low and high (shape (*shape,))"""
+    width = np.where(high > low, high - low, 1.0)
+    index = np.clip(((values - low) / width * bins).astype(np.int64), 0, bins - 1).reshape(values.shape[0], -1)
+    # one bincount over all the channels, with offset bins per channel
+    index += np.arange(index.shape[1]) * bins
+    return np.bincount(index.ravel(), minlength=index.shape[1] * bins).reshape(*low.shape, bins)
+
+
+def _percentiles(
+    histogram: np.ndarray, low: np.ndarray, high: np.ndarray, percentiles: tuple[float, ...]
+) -> np.ndarray:
+    """Interpolate the percentiles of per-channel histograms (shape (*shape, bins)), as (P, *shape) values"""
+    bins = histogram.shape[-1]
+    cumulative = np.cumsum(histogram, axis=-1)
+    total = cumulative[..., -1:]
+    results = []
+    for percentile in percentiles:
+        rank = percentile / 100.0 * total
+        # first bin reaching the rank, and linear interpolation of the rank within it
+        index = np.minimum((cumulative < rank).sum(axis=-1, keepdims=True), bins - 1)
+        before = np.take_along_axis(cumulative, index, axis=-1) - np.take_along_axis(histogram, index, axis=-1)
+        inside = np.take_along_axis(histogram, index, axis=-1)
+        fraction = np.clip((rank - before) / np.maximum(inside, 1), 0.0, 1.0)
+        results.append((low + (index[..., 0] + fraction[..., 0]) / bins * (high - low)))
+    return np.clip(np.stack(results), low, high)
+
+
+def _file_moments(motion_file: str, chunk_size: int) -> dict[str, RunningStatistics]:
+    """Compute the moments of the frame fields of one motion file (worker process)"""
+    statistics = {}
+    for chunk in MotionChunkReader(motion_file, chunk_size):
+        for name in FRAME_FIELDS:
+            statistics.setdefault(name, RunningStatistics(chunk[name].shape[1:])).update(chunk[name])
+    return statistics
+
+
+def _file_histograms(motion_file: str, chunk_size: int, ranges: dict, bins: int) -> dict[str, np.ndarray]:
+    """Compute the histograms of the frame fields of one motion file (worker process)"""
+    histograms = {}
+    for chunk in MotionChunkReader(motion_file, chunk_size):
+        for name in FRAME_FIELDS:
+            histogram = _histogram(chunk[name], *ranges[name], bins)
+            histograms[name] = histograms[name] + histogram if name in histograms else histogram
+    return histograms
+
+
+def compute_statistics(
+    motion_files: list[str],
+    percentiles: tuple[float, ...] = DEFAULT_PERCENTILES,
+    bins: int = 2048,
+    chunk_size: int = 4096,
+    num_workers: int | None = None,
+) -> dict[str, dict[str, np.ndarray]]:
+    """Compute the per-channel statistics of the frame fields of motion files, in parallel over the files.
+
+    Each worker holds one chunk of frames at a time.
+
+    Args:
+        motion_files: The motion files. They must share the same skeleton.
+        percentiles: The percentiles to compute, between 0 and 100.
+        bins: Number of histogram bins per channel, between the minimum and maximum of the channel.
+        chunk_size: Number of frames per chunk.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+
+    Raises:
+        ValueError: If the motions don't share the same skeleton.
+
+    Returns:
+        For each frame field, its ``count`` (number of frames), ``mean``, ``std``, ``min``, ``max`` and
+        percentiles (e.g. ``p50``) per channel. Shapes are the shape of one frame of the field.
+    """
+    # the channels are merged by position, check the names from the file headers before reading the frames
+    skeleton = None
+    for motion_file in motion_files:
+        info = read_motion_info(motion_file)
+        if skeleton is None:
+            skeleton, first_file = (info["dof_names"], info["body_names"]), motion_file
+        elif (info["dof_names"], info["body_names"]) != skeleton:
+            msg = f"The skeleton of {motion_file} differs from the skeleton of {first_file}"
+            raise ValueError(msg)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        moments = {}
+        for file_moments in executor.map(_file_moments, motion_files, [chunk_size] * len(motion_files)):
+            for name, statistics in file_moments.items():
+                moments[name] = moments[name].merge(statistics) if name in moments else statistics
+
+        ranges = {name: (statistics.minimum, statistics.maximum) for name, statistics in moments.items()}
+        histograms = {}
+        arguments = [[chunk_size] * len(motion_files), [ranges] * len(motion_files), [bins] * len(motion_files)]
+        for file_histograms in executor.map(_file_histograms, motion_files, *arguments):
+            for name, histogram in file_histograms.items():
+                histograms[name] = histograms[name] + histogram if name in histograms else histogram
+
+    results = {}
+    for name, statistics in moments.items():
+        results[name] = {
+            "count": np.asarray(statistics.count),
+            "mean": statistics.mean,
+            "std": statistics.std,
+            "min": statistics.minimum,
+            "max": statistics.maximum,
+        }
+        values = _percentiles(histograms[name], statistics.minimum, statistics.maximum, percentiles)
+        for percentile, value in zip(percentiles, values):
+            results[name][f"p{percentile:g}"] = value
+    return results
+
+
+def load_dataset_statistics(
+    dataset_dir: str, recompute: bool = False, num_workers: int | None = None, **kwargs
+) -> dict[str, dict[str, np.ndarray]]:
+    """
+    Load the statistics of a dataset from its cache file, (re)computing them if the cache is missing or
+    out of date.
+
+    Args:
+        dataset_dir: The dataset directory.
+        recompute: Whether to recompute the statistics even if the cache is up to date.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+        kwargs: The statistics parameters (see :func:`compute_statistics`).
+
+    Returns:
+        The statistics (see :func:`compute_statistics`).
+    """
+    manifest = load_dataset_manifest(dataset_dir)
+    motions = {path: [entry["size"], entry["mtime_ns"]] for path, entry in manifest["motions"].items()}
+    key = json.dumps({"motions": motions, "parameters": kwargs}, sort_keys=True)
+    cache_file = os.path.join(dataset_dir, STATISTICS_FILENAME)
+    if not recompute and os.path.isfile(cache_file):
+        with np.load(cache_file) as data:
+            if str(data["key"]) == key:
+                results = {}
+                for entry in data.files:
+                    if entry != "key":
+                        name, statistic = entry.split("/")
+                        results.setdefault(name, {})[statistic] = data[entry]
+                return results
+
+    motion_files = [os.path.join(dataset_dir, path) for path in manifest["motions"]]
+    results = compute_statistics(motion_files, num_workers=num_workers, **kwargs)
+    arrays = {f"{name}/{statistic}": value for name, values in results.items() for statistic, value in values.items()}
+    # write atomically, so concurrent jobs never read a partially written cache, through a temporary file unique
+    # to this process, as several jobs may compute the statistics of the dataset at once
+    fd, temporary_file = tempfile.mkstemp(prefix=f"{STATISTICS_FILENAME}.", suffix=".tmp", dir=dataset_dir)
+    try:
+        if os.name == "posix":
+            # mkstemp creates the file readable by its owner only
+            os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, key=np.asarray(key), **arrays)
+        os.replace(temporary_file, cache_file)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_file)
+        raise
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-dir", type=str, required=True, help="Directory of motion files")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--recompute", action="store_true", default=False, help="Recompute up to date statistics")
+    parser.add_argument("--bins", type=int, default=2048, help="Number of histogram bins per channel")
+    parser.add_argument(
+        "--percentiles", type=float, nargs="+", default=list(DEFAULT_PERCENTILES), help="Percentiles to compute"
+    )
+    args, _ = parser.parse_known_args()
+
+    results = load_dataset_statistics(
+        args.dataset_dir,
+        recompute=args.recompute,
+        num_workers=args.workers,
+        percentiles=tuple(args.percentiles),
+        bins=args.bins,
+    )
+    for name, values in results.items():
+        print(f"{name}: {int(values['count'])} frames, shape {values['mean'].shape}")
+        for statistic, value in values.items():
+            if statistic != "count":
+                print(f"  |-- {statistic}: [{value.min():.4f}, {value.max():.4f}]")
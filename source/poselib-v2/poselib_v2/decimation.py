@@ -0,0 +1,199 @@
+"""
+Adaptive keyframe decimation of motions.
+
+Frames which can be reconstructed by interpolating (lerp / slerp) between their neighboring keyframes
+within a per-field error tolerance are removed. The times of the kept frames are stored in the
+``frame_times`` field of the decimated motion, which :class:`~poselib_v2.motion_loader.MotionLoader`
+samples with a non-uniform time indexing.
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .math_utils import quat_slerp
+    from .motion_io import FRAME_FIELDS, load_motion_data, save_motion_data
+except ImportError:
+    from math_utils import quat_slerp
+    from motion_io import FRAME_FIELDS, load_motion_data, save_motion_data
+
+
+# default error tolerance of each frame field: absolute joint error (rad, rad/s), distance between the
+# body positions and velocities (m, m/s, rad/s), and angle between the body rotations (rad).
+# A field with a tolerance of None is not checked.
+DEFAULT_TOLERANCES = {
+    "dof_positions": 0.01,
+    "dof_velocities": 0.2,
+    "body_positions": 0.005,
+    "body_rotations": 0.01,
+    "body_linear_velocities": 0.1,
+    "body_angular_velocities": 0.2,
+}
+
+
+def _interpolation_errors(
+    motion_data: dict, frame_times: np.ndarray, start: int, end: int, frames: np.ndarray
+) -> dict[str, float]:
+    """Maximum error of each frame field when reconstructing frames by interpolating between two keyframes.
+
+    Args:
+        motion_data: The motion data.
+        frame_times: The times of the frames.
+        start: The first keyframe.
+        end: The second keyframe.
+        frames: The frames to reconstruct.
+
+    Returns:
+        The maximum error of each field.
+    """
+    blend = (frame_times[frames] - frame_times[start]) / (frame_times[end] - frame_times[start])
+    errors = {}
+    for name in FRAME_FIELDS:
+        values = motion_data[name]
+        if name == "body_rotations":
+            reconstructed = quat_slerp(values[start][None], values[end][None], blend[:, None])
+            cos_half_angle = np.abs(np.sum(reconstructed * values[frames], axis=-1))
+            error = 2.0 * np.arccos(np.clip(cos_half_angle, 0.0, 1.0))
+        else:
+            shape = (-1,) + (1,) * (values.ndim - 1)
+            reconstructed = values[start] + blend.reshape(shape) * (values[end] - values[start])
+            error = np.abs(reconstructed - values[frames])
+            if name.startswith("body_"):
+                error = np.linalg.norm(error, axis=-1)
+        errors[name] = float(error.max()) if error.size else 0.0
+    return errors
+
+
+def decimate_motion(
+    motion_data: dict, tolerances: dict[str, float | None] | None = None, max_gap: int | None = None
+) -> tuple[dict, dict[str, float]]:
+    """Remove the frames reconstructable by interpolation between the kept keyframes.
+
+    The keyframes are selected greedily: from each keyframe, the next one is the farthest frame such that
+    every frame in between is reconstructed within the tolerances (searched by doubling the gap, then by
+    bisection). Every error check is vectorized over the frames in between.
+
+    Args:
+        motion_data: The motion data (see :func:`~poselib_v2.motion_io.load_motion_data`).
+        tolerances: Error tolerance of each frame field (see :data:`DEFAULT_TOLERANCES`), updating the defaults.
+        max_gap: Maximum number of frames between two keyframes.
+
+    Returns:
+        The decimated motion data, with the ``frame_times`` field, and the maximum reconstruction error of
+        each frame field over the whole motion (the error bound of the decimation).
+    """
+    tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+    num_frames = motion_data[FRAME_FIELDS[0]].shape[0]
+    fps = float(np.asarray(motion_data["fps"]).reshape(-1)[0])
+    frame_times = motion_data.get("frame_times", np.arange(num_frames) / fps)
+    max_gap = num_frames if max_gap is None else max_gap
+
+    def valid(start: int, end: int) -> bool:
+        errors = _interpolation_errors(motion_data, frame_times, start, end, np.arange(start + 1, end))
+        return all(tolerance is None or errors[name] <= tolerance for name, tolerance in tolerances.items())
+
+    keyframes = [0]
+    while keyframes[-1] < num_frames - 1:
+        start = keyframes[-1]
+        limit = min(max_gap, num_frames - 1 - start)
+        # find a valid gap and an invalid one by doubling the gap, then bisect between them
+        good, gap = 1, 2
+        while gap <= limit and valid(start, start + gap):
+            good, gap = gap, 2 * gap
+        bad = min(gap, limit + 1)
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if valid(start, start + middle):
+                good = middle
+            else:
+                bad = middle
+        keyframes.append(start + good)
+
+    keyframes = np.array(keyframes)
+    decimated = dict(motion_data)
+    for name in FRAME_FIELDS:
+        decimated[name] = motion_data[name][keyframes]
+    decimated["frame_times"] = frame_times[keyframes].astype(np.float64)
+
+    # error bound, over all the removed frames
+    error_bound = {name: 0.0 for name in FRAME_FIELDS}
+    for start, end in zip(keyframes[:-1], keyframes[1:]):
+        errors = _interpolation_errors(motion_data, frame_times, start, end, np.arange(start + 1, end))
+        error_bound = {name: max(error_bound[name], errors[name]) for name in FRAME_FIELDS}
+    return decimated, error_bound
+
+
+def _decimate_file(motion_file: str, output_file: str, kwargs: dict) -> tuple[str, int, int, dict[str, float]]:
+    """Decimate one motion file (worker process)"""
+    motion_data = load_motion_data(motion_file)
+    decimated, error_bound = decimate_motion(motion_data, **kwargs)
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    save_motion_data(output_file, decimated)
+    num_frames = motion_data[FRAME_FIELDS[0]].shape[0]
+    return output_file, num_frames, decimated[FRAME_FIELDS[0]].shape[0], error_bound
+
+
+def decimate_dataset(
+    motion_files: list[str], output_files: list[str], num_workers: int | None = None, **kwargs
+) -> dict[str, float]:
+    """Decimate motion files in parallel over the motions, and report the results.
+
+    Args:
+        motion_files: The motion files to decimate.
+        output_files: The decimated motion files to write, in the order of ``motion_files``.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+        kwargs: The decimation parameters (see :func:`decimate_motion`).
+
+    Returns:
+        The maximum reconstruction error of each frame field over all the motions.
+    """
+    error_bound = {name: 0.0 for name in FRAME_FIELDS}
+    total_frames, total_keyframes, input_size, output_size = 0, 0, 0, 0
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_decimate_file, a, b, kwargs) for a, b in zip(motion_files, output_files)]
+        for motion_file, future in zip(motion_files, futures):
+            output_file, num_frames, num_keyframes, errors = future.result()
+            print(f"Decimated {motion_file}: {num_frames} -> {num_keyframes} frames")
+            total_frames += num_frames
+            total_keyframes += num_keyframes
+            input_size += os.path.getsize(motion_file)
+            output_size += os.path.getsize(output_file)
+            error_bound = {name: max(error_bound[name], errors[name]) for name in FRAME_FIELDS}
+
+    print(f"Frames: {total_frames} -> {total_keyframes} ({total_keyframes / max(total_frames, 1) * 100:.1f}%)")
+    print(f"Size: {input_size / 2**20:.1f} MB -> {output_size / 2**20:.1f} MB")
+    print("Maximum reconstruction error:")
+    for name, error in error_bound.items():
+        print(f"  |-- {name}: {error:.5f}")
+    return error_bound
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Motion file to decimate")
+    parser.add_argument("--dataset-dir", type=str, default=None, help="Directory of motion files to decimate")
+    parser.add_argument("--output", type=str, required=True, help="Decimated motion file, or directory (dataset)")
+    parser.add_argument("--max-gap", type=int, default=None, help="Maximum number of frames between keyframes")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    for name, tolerance in DEFAULT_TOLERANCES.items():
+        option = "--" + name.replace("_", "-") + "-tolerance"
+        parser.add_argument(option, type=float, default=tolerance, help=f"Error tolerance of {name} (<0: unchecked)")
+    args, _ = parser.parse_known_args()
+
+    tolerances = {}
+    for name in DEFAULT_TOLERANCES:
+        tolerance = getattr(args, name + "_tolerance")
+        tolerances[name] = None if tolerance < 0 else tolerance
+    kwargs = {"tolerances": tolerances, "max_gap": args.max_gap}
+    if args.dataset_dir:
+        files = sorted(glob.glob(os.path.join(args.dataset_dir, "**", "*.npz"), recursive=True))
+        outputs = [os.path.join(args.output, os.path.relpath(file, args.dataset_dir)) for file in files]
+        decimate_dataset(files, outputs, num_workers=args.workers, **kwargs)
+    else:
+        assert args.file, "Either --file or --dataset-dir is required"
+        decimate_dataset([args.file], [args.output], num_workers=1, **kwargs)
@@ -0,0 +1,345 @@
+"""
+Tracking-error evaluation of simulation recordings against their reference motions.
+
+A recording is a ``.npz`` file with the ``fps``, the ``joint_order`` (joint names), and the ``root_positions``
+(shape (F, 3)), ``root_quaternions`` (wxyz, shape (F, 4)) and ``joint_positions`` (shape (F, D)) of every
+recorded frame. The states of several rollouts can be recorded at once in one file, with shapes (F, R, ...).
+Recordings may also store the states of other bodies, as ``body_names`` and ``body_positions`` /
+``body_rotations`` (shapes (F, [R,] B, 3) and (F, [R,] B, 4)).
+
+The recordings are converted to the standard motion layout (the recorded bodies and DOFs, with velocities
+derived by backward differences as when motions are built), streamed in chunks of frames, and compared
+with their reference motion sampled at the aligned times, for all the rollouts at once.
+"""
+
+import os
+import zipfile
+
+import numpy as np
+
+try:
+    from .dataset_statistics import RunningStatistics
+    from .math_utils import quat_conjugate, quat_mul, quat_to_rotvec
+    from .motion_io import FRAME_FIELDS, iter_npz_chunks, save_motion_data
+    from .motion_loader import MotionLoader
+except ImportError:
+    from dataset_statistics import RunningStatistics
+    from math_utils import quat_conjugate, quat_mul, quat_to_rotvec
+    from motion_io import FRAME_FIELDS, iter_npz_chunks, save_motion_data
+    from motion_loader import MotionLoader
+
+
+# per-frame fields of the recordings
+RECORDING_FIELDS = ("root_positions", "root_quaternions", "joint_positions")
+# tracking errors, per DOF for the DOF fields and per body for the body fields
+ERROR_FIELDS = FRAME_FIELDS
+
+
+def read_recording_info(recording_file: str, root_body: str = "pelvis") -> dict:
+    """
+    Read the frame rate, names, number of frames and number of rollouts of a recording, without loading
+    its frames.
+
+    Args:
+        recording_file: The recording file.
+        root_body: The name of the root body, whose states are ``root_positions`` and ``root_quaternions``.
+
+    Returns:
+        The ``fps``, ``joint_order``, ``body_names`` (the root body first), ``num_frames`` and ``num_rollouts``
+        (None if the recording is not batched) of the recording.
+    """
+    with np.load(recording_file) as data:
+        info = {
+            "fps": float(np.asarray(data["fps"]).reshape(-1)[0]),
+            "joint_order": data["joint_order"].tolist(),
+            "extra_bodies": data["body_names"].tolist() if "body_names" in data.files else [],
+        }
+    with zipfile.ZipFile(recording_file) as archive, archive.open("root_positions.npy") as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            shape = np.lib.format.read_array_header_1_0(f)[0]
+        else:
+            shape = np.lib.format.read_array_header_2_0(f)[0]
+    info["body_names"] = [root_body] + [name for name in info.pop("extra_bodies") if name != root_body]
+    info["num_frames"] = shape[0]
+    info["num_rollouts"] = shape[1] if len(shape) == 3 else None
+    return info
+
+
+def _recording_chunks(recording_file: str, root_body: str, chunk_size: int):
+    """Stream the positions and rotations of the bodies and DOFs of a recording, with shapes (C, R, ...)"""
+    info = read_recording_info(recording_file, root_body)
+    names = RECORDING_FIELDS
+    extra_bodies = []
+    with np.load(recording_file) as data:
+        if "body_names" in data.files:
+            names = names + ("body_positions", "body_rotations")
+            extra_bodies = [i for i, name in enumerate(data["body_names"].tolist()) if name != root_body]
+    for chunk in iter_npz_chunks(recording_file, names, chunk_size):
+        if info["num_rollouts"] is None:
+            chunk = {name: values[:, None] for name, values in chunk.items()}
+        body_positions = [chunk["root_positions"][:, :, None]]
+        body_rotations = [chunk["root_quaternions"][:, :, None]]
+        if extra_bodies:
+            body_positions.append(chunk["body_positions"][:, :, extra_bodies])
+            body_rotations.append(chunk["body_rotations"][:, :, extra_bodies])
+        yield {
+            "dof_positions": chunk["joint_positions"].astype(np.float32),
+            "body_positions": np.concatenate(body_positions, axis=2).astype(np.float32),
+            "body_rotations": np.concatenate(body_rotations, axis=2).astype(np.float32),
+        }
+
+
+def _add_velocities(frames: dict, previous: dict | None, fps: float) -> dict:
+    """Add the velocities of (C, R, ...) frames, by backward differences with the previous frames"""
+    if previous is None:
+        previous = {name: values[:1] for name, values in frames.items()}
+
+    def shifted(name: str) -> np.ndarray:
+        return np.concatenate([previous[name][-1:], frames[name][:-1]])
+
+    frames["dof_velocities"] = (frames["dof_positions"] - shifted("dof_positions")) * fps
+    frames["body_linear_velocities"] = (frames["body_positions"] - shifted("body_positions")) * fps
+    relative_rotations = quat_mul(frames["body_rotations"], quat_conjugate(shifted("body_rotations")))
+    frames["body_angular_velocities"] = (quat_to_rotvec(relative_rotations) * fps).astype(np.float32)
+    return frames
+
+
+def convert_recording(
+    recording_file: str, output_file: str, rollout: int = 0, root_body: str = "pelvis", chunk_size: int = 4096
+) -> None:
+    """Convert (one rollout of) a recording to a motion file in the standard layout.
+
+    Args:
+        recording_file: The recording file.
+        output_file: The motion file to write.
+        rollout: The rollout to convert, if the recording is batched.
+        root_body: The name of the root body.
+        chunk_size: Number of frames read at once.
+    """
+    info = read_recording_info(recording_file, root_body)
+    fields, previous = {name: [] for name in FRAME_FIELDS}, None
+    for frames in _recording_chunks(recording_file, root_body, chunk_size):
+        frames = {name: values[:, rollout : rollout + 1] for name, values in frames.items()}
+        frames = _add_velocities(frames, previous, info["fps"])
+        previous = frames
+        for name in FRAME_FIELDS:
+            fields[name].append(frames[name][:, 0])
+    motion_data = {name: np.concatenate(values) for name, values in fields.items()}
+    motion_data["fps"] = np.array(round(info["fps"]), dtype=np.int64)
+    motion_data["dof_names"] = np.asarray(info["joint_order"])
+    motion_data["body_names"] = np.asarray(info["body_names"])
+    save_motion_data(output_file, motion_data)
+
+
+def _match_names(names: list[str], reference_names: list[str]) -> tuple[list[int], list[int]]:
+    """Match names (ignoring a ``_joint`` suffix), as the indexes of the matched names in both lists"""
+
+    def key(name: str) -> str:
+        return name[: -len("_joint")] if name.endswith("_joint") else name
+
+    reference = {key(name): i for i, name in enumerate(reference_names)}
+    indexes = [(i, reference[key(name)]) for i, name in enumerate(names) if key(name) in reference]
+    return [i for i, _ in indexes], [j for _, j in indexes]
+
+
+class TrackingEvaluator:
+    """
+    Batched evaluation of the tracking errors of recorded rollouts with respect to a reference motion.
+
+    The errors are the absolute errors of the DOF positions and velocities, the distances between the body
+    positions and between the body velocities, and the angles between the body rotations, for the DOFs and
+    bodies both recorded and in the reference motion. The angular velocities of the reference are derived
+    from its sampled rotations as for the recordings, so motions storing Euler angle rates are evaluated
+    correctly.
+    """
+
+    def __init__(self, reference: MotionLoader, root_body: str = "pelvis", align_root: bool = True) -> None:
+        """
+        Args:
+            reference: The reference motion.
+            root_body: The name of the root body of the recordings.
+            align_root: Whether to translate the recorded rollouts in the XY plane so that their root starts
+                at the root of the reference motion (e.g. to remove the origins of parallel environments).
+        """
+        self.reference = reference
+        self.root_body = root_body
+        self.align_root = align_root
+
+    def align_start_times(
+        self,
+        recording_file: str,
+        start_times: np.ndarray,
+        max_offset: float = 1.0,
+        window: int = 60,
+    ) -> np.ndarray:
+        """Estimate the reference times of the first recorded frames, from the recorded DOF positions.
+
+        The start times are searched around the given ones, in steps of one recorded frame, by minimizing
+        the mean DOF position error over the first frames of each rollout.
+
+        Args:
+            recording_file: The recording file.
+            start_times: The estimated start times of the rollouts, in the reference motion. Shape is (R,).
+            max_offset: Maximum offset of the start times from the given ones, in seconds.
+            window: Number of first frames compared.
+
+        Returns:
+            The start times of the rollouts. Shape is (R,).
+        """
+        info = read_recording_info(recording_file, self.root_body)
+        dt = 1.0 / info["fps"]
+        recorded_dofs, reference_dofs = _match_names(info["joint_order"], self.reference.dof_names)
+        frames = next(_recording_chunks(recording_file, self.root_body, window))["dof_positions"][:, :, recorded_dofs]
+
+        num_steps = round(max_offset / dt)
+        offsets = np.arange(-num_steps, num_steps + 1) * dt
+        errors = np.empty((len(offsets), frames.shape[1]))
+        frame_times = np.arange(frames.shape[0])[:, None] * dt
+        for i, offset in enumerate(offsets):
+            times = np.maximum(start_times + offset, 0.0)[None] + frame_times
+            dof_positions = self.reference.sample(0, times=times.ravel())[0].cpu().numpy()
+            dof_positions = dof_positions.reshape(*times.shape, -1)[..., reference_dofs]
+            errors[i] = np.abs(frames - dof_positions).mean(axis=(0, 2))
+        return np.maximum(start_times + offsets[errors.argmin(axis=0)], 0.0)
+
+    def evaluate(
+        self,
+        recording_file: str,
+        start_times: float | np.ndarray = 0.0,
+        align: bool = False,
+        chunk_size: int = 1024,
+    ) -> dict:
+        """Evaluate the tracking errors of the rollouts of a recording, streaming it in chunks of frames.
+
+        The recorded frames after the end of the reference motion are compared with its last frame.
+
+        Args:
+            recording_file: The recording file.
+            start_times: The time of the reference motion at the first recorded frame of each rollout.
+                Shape is (R,), or a single time for all the rollouts.
+            align: Whether to refine the start times with :meth:`align_start_times`.
+            chunk_size: Number of frames (of all the rollouts) evaluated at once.
+
+        Returns:
+            The errors: for each field of :data:`ERROR_FIELDS`, the ``mean``, ``std`` and ``max`` error
+            over the frames, per rollout and per DOF or body (shape (R, D) or (R, B)). Also the matched
+            ``dof_names`` and ``body_names``, the ``start_times`` of the rollouts, and the ``num_frames``.
+        """
+        info = read_recording_info(recording_file, self.root_body)
+        num_rollouts = info["num_rollouts"] or 1
+        dt = 1.0 / info["fps"]
+        start_times = np.broadcast_to(np.asarray(start_times, dtype=np.float64), (num_rollouts,)).copy()
+        if align:
+            start_times = self.align_start_times(recording_file, start_times)
+        recorded_dofs, reference_dofs = _match_names(info["joint_order"], self.reference.dof_names)
+        recorded_bodies, reference_bodies = _match_names(info["body_names"], self.reference.body_names)
+        assert recorded_dofs or recorded_bodies, "The recording and the reference motion have no DOF or body in common"
+
+        statistics = {name: None for name in ERROR_FIELDS}
+        first_frame, previous, previous_rotations, root_offset = 0, None, None, None
+        for frames in _recording_chunks(recording_file, self.root_body, chunk_size):
+            frames = _add_velocities(frames, previous, info["fps"])
+            previous = frames
+            num_frames = frames["dof_positions"].shape[0]
+            times = start_times[None] + (first_frame + np.arange(num_frames))[:, None] * dt
+            reference = self.reference.sample(0, times=times.ravel())
+            reference = {
+                name: values.cpu().numpy().reshape(*times.shape, *values.shape[1:])
+                for name, values in zip(FRAME_FIELDS, reference)
+            }
+            # the reference angular velocities are derived like the recorded ones, by backward quaternion
+            # differences of the sampled rotations, whatever the convention of the stored velocities
+            rotations = reference["body_rotations"].astype(np.float64)
+            if previous_rotations is None:
+                previous_rotations = rotations[:1]
+            steps = quat_mul(rotations, quat_conjugate(np.concatenate([previous_rotations[-1:], rotations[:-1]])))
+            reference["body_angular_velocities"] = quat_to_rotvec(steps) * info["fps"]
+            previous_rotations = rotations
+
+            positions = frames["body_positions"][:, :, recorded_bodies]
+            if self.align_root:
+                if root_offset is None:
+                    root_offset = frames["body_positions"][0, :, 0] - reference["body_positions"][0, :, 0]
+                    root_offset[:, 2] = 0.0
+                positions = positions - root_offset[None, :, None]
+            relative_rotations = quat_mul(
+                frames["body_rotations"][:, :, recorded_bodies],
+                quat_conjugate(reference["body_rotations"][:, :, reference_bodies]),
+            )
+            errors = {
+                "dof_positions": np.abs(
+                    frames["dof_positions"][..., recorded_dofs] - reference["dof_positions"][..., reference_dofs]
+                ),
+                "dof_velocities": np.abs(
+                    frames["dof_velocities"][..., recorded_dofs] - reference["dof_velocities"][..., reference_dofs]
+                ),
+                "body_positions": np.linalg.norm(
+                    positions - reference["body_positions"][:, :, reference_bodies], axis=-1
+                ),
+                "body_rotations": np.linalg.norm(quat_to_rotvec(relative_rotations), axis=-1),
+                "body_linear_velocities": np.linalg.norm(
+                    frames["body_linear_velocities"][:, :, recorded_bodies]
+                    - reference["body_linear_velocities"][:, :, reference_bodies],
+                    axis=-1,
+                ),
+                "body_angular_velocities": np.linalg.norm(
+                    frames["body_angular_velocities"][:, :, recorded_bodies]
+                    - reference["body_angular_velocities"][:, :, reference_bodies],
+                    axis=-1,
+                ),
+            }
+            for name, values in errors.items():
+                # the first recorded frame has no velocity
+                if first_frame == 0 and name.endswith("velocities"):
+                    values = values[1:]
+                if statistics[name] is None:
+                    statistics[name] = RunningStatistics(values.shape[1:])
+                statistics[name].update(values)
+            first_frame += num_frames
+
+        results = {
+            name: {"mean": values.mean, "std": values.std, "max": values.maximum}
+            for name, values in statistics.items()
+        }
+        results["dof_names"] = [info["joint_order"][i] for i in recorded_dofs]
+        results["body_names"] = [info["body_names"][i] for i in recorded_bodies]
+        results["start_times"] = start_times
+        results["num_frames"] = first_frame
+        return results
+
+
+def summarize(results: dict) -> None:
+    """Print the tracking errors of :meth:`TrackingEvaluator.evaluate`: over all the rollouts, the spread
+    over the rollouts, and the worst DOF or body."""
+    print(f"{results['num_frames']} frames, {len(results['start_times'])} rollouts")
+    print(f"{'error':>24} {'mean':>10} {'rollout p90':>12} {'max':>10}   worst")
+    for name in ERROR_FIELDS:
+        mean = results[name]["mean"]
+        if mean.shape[-1] == 0:
+            continue
+        names = results["dof_names"] if name.startswith("dof_") else results["body_names"]
+        rollout_means = mean.mean(axis=-1)
+        worst = names[int(mean.mean(axis=0).argmax())]
+        print(
+            f"{name:>24} {mean.mean():>10.4f} {np.percentile(rollout_means, 90):>12.4f}"
+            f" {results[name]['max'].max():>10.4f}   {worst}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reference", type=str, required=True, help="Reference motion file")
+    parser.add_argument("--recordings", type=str, nargs="+", required=True, help="Recording files")
+    parser.add_argument("--start-time", type=float, default=0.0, help="Reference time of the first recorded frame")
+    parser.add_argument("--align", action="store_true", default=False, help="Refine the start times of the rollouts")
+    parser.add_argument("--root-body", type=str, default="pelvis", help="Root body of the recordings")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Number of frames evaluated at once")
+    parser.add_argument("--device", type=str, default="cpu", help="Torch device of the reference motion")
+    args, _ = parser.parse_known_args()
+
+    evaluator = TrackingEvaluator(MotionLoader(args.reference, args.device), root_body=args.root_body)
+    for recording_file in args.recordings:
+        print(f"{os.path.basename(recording_file)}:")
+        summarize(evaluator.evaluate(recording_file, args.start_time, align=args.align, chunk_size=args.chunk_size))
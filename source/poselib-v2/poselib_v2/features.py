@@ -0,0 +1,208 @@
+"""
+Derived per-frame features of motions, precomputed offline and stored in a sidecar file next to each motion.
+
+The sidecar file (``<motion>.features``) records the SHA-256 hash of the motion file and the extraction
+parameters it was computed from, so it is recomputed whenever the motion file or the parameters change.
+"""
+
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .math_utils import quat_to_matrix
+    from .motion_io import load_motion_data
+except ImportError:
+    from math_utils import quat_to_matrix
+    from motion_io import load_motion_data
+
+
+FEATURES_SUFFIX = ".features"
+# derived per-frame features stored in the sidecar files
+FEATURE_FIELDS = (
+    "root_heading",
+    "root_height",
+    "ground_height",
+    "contacts",
+    "root_local_positions",
+)
+
+
+def features_file(motion_file: str) -> str:
+    """Get the sidecar features file of a motion file."""
+    return os.path.splitext(motion_file)[0] + FEATURES_SUFFIX
+
+
+def hash_file(file: str) -> str:
+    """Compute the SHA-256 hash of a file, as an hexadecimal string."""
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sliding_minimum(values: np.ndarray, window: int) -> np.ndarray:
+    """Minimum of (F,) values over a centered window of frames, the edges being padded with the edge values"""
+    window = max(min(window, len(values)), 1)
+    padded = np.pad(values, (window // 2, window - 1 - window // 2), mode="edge")
+    return np.lib.stride_tricks.sliding_window_view(padded, window).min(axis=-1)
+
+
+def default_foot_bodies(body_names: list[str]) -> list[str]:
+    """Get the default foot bodies of a skeleton, the bodies whose name contains ``ankle`` or ``foot``."""
+    return [name for name in body_names if "ankle" in name or "foot" in name]
+
+
+def compute_features(
+    motion_data: dict,
+    foot_bodies: list[str] | None = None,
+    contact_height: float = 0.05,
+    contact_speed: float = 0.3,
+    ground_window: float = 1.0,
+) -> dict[str, np.ndarray]:
+    """
+    Compute the derived per-frame features of a whole motion, vectorized over the frames.
+
+    - ``root_heading``: yaw of the root (first) body, unwrapped over the frames. Shape is (F,).
+    - ``ground_height``: ground height under the motion, estimated as the lowest foot height over
+      a centered time window. Shape is (F,).
+    - ``root_height``: height of the root body above the ground. Shape is (F,).
+    - ``contacts``: whether each foot body touches the ground, i.e. is close to the ground and slow. Shape is (F, K).
+    - ``root_local_positions``: body positions relative to the root, in the root heading frame. Shape is (F, B, 3).
+
+    Args:
+        motion_data: The motion data (see :func:`~poselib_v2.motion_io.load_motion_data`).
+        foot_bodies: The bodies checked for ground contacts. Defaults to :func:`default_foot_bodies`.
+        contact_height: Maximum height above the ground of a foot in contact, in meters.
+        contact_speed: Maximum speed of a foot in contact, in meters per second.
+        ground_window: Time window of the ground height estimation, in seconds.
+
+    Raises:
+        ValueError: If there is no foot body, or if a foot body doesn't exist.
+
+    Returns:
+        The features, and the ``foot_bodies`` names (the order of the ``contacts`` columns).
+    """
+    body_names = np.asarray(motion_data["body_names"]).tolist()
+    if foot_bodies is None:
+        foot_bodies = default_foot_bodies(body_names)
+    if not foot_bodies or any(name not in body_names for name in foot_bodies):
+        msg = f"Invalid foot bodies {foot_bodies}, the bodies are: {body_names}"
+        raise ValueError(msg)
+    foot_indices = [body_names.index(name) for name in foot_bodies]
+    fps = float(np.asarray(motion_data["fps"]).reshape(-1)[0])
+
+    body_positions = motion_data["body_positions"]
+    root_positions = body_positions[:, 0]
+
+    # heading of the root, from the rotated X axis of its rotation
+    x_axis = quat_to_matrix(motion_data["body_rotations"][:, 0])[..., 0]
+    root_heading = np.unwrap(np.arctan2(x_axis[:, 1], x_axis[:, 0]))
+
+    # ground under the lowest foot, assuming a foot touches it at least once per window
+    foot_heights = body_positions[:, foot_indices, 2]
+    ground_height = _sliding_minimum(foot_heights.min(axis=1), int(round(ground_window * fps)))
+
+    foot_speeds = np.linalg.norm(motion_data["body_linear_velocities"][:, foot_indices], axis=-1)
+    contacts = (foot_heights - ground_height[:, None] < contact_height) & (foot_speeds < contact_speed)
+
+    # positions relative to the root, rotated by the opposite of the heading
+    cos, sin = np.cos(root_heading)[:, None], np.sin(root_heading)[:, None]
+    relative = body_positions - root_positions[:, None]
+    x, y, z = relative[..., 0], relative[..., 1], relative[..., 2]
+    root_local_positions = np.stack([cos * x + sin * y, cos * y - sin * x, z], axis=-1)
+
+    return {
+        "root_heading": root_heading.astype(np.float32),
+        "root_height": (root_positions[:, 2] - ground_height).astype(np.float32),
+        "ground_height": ground_height.astype(np.float32),
+        "contacts": contacts,
+        "root_local_positions": root_local_positions.astype(np.float32),
+        "foot_bodies": np.asarray(foot_bodies),
+    }
+
+
+def load_features(motion_file: str, recompute: bool = False, **kwargs) -> dict[str, np.ndarray]:
+    """
+    Load the derived features of a motion from its sidecar file, (re)computing the sidecar file if
+    it is missing or out of date.
+
+    Args:
+        motion_file: The motion file.
+        recompute: Whether to recompute the features even if the sidecar file is up to date.
+        kwargs: The feature extraction parameters (see :func:`compute_features`).
+
+    Returns:
+        The features (see :func:`compute_features`).
+    """
+    key = json.dumps({"motion_hash": hash_file(motion_file), "parameters": kwargs}, sort_keys=True)
+    sidecar_file = features_file(motion_file)
+    if not recompute and os.path.isfile(sidecar_file):
+        with np.load(sidecar_file) as data:
+            if str(data["key"]) == key:
+                return {name: data[name] for name in data.files if name != "key"}
+
+    features = compute_features(load_motion_data(motion_file), **kwargs)
+    # write atomically, so concurrent jobs never read a partially written sidecar file, through a temporary file
+    # unique to this process, as several jobs may compute the features of the same motion at once
+    fd, temporary_file = tempfile.mkstemp(
+        prefix=f"{os.path.basename(sidecar_file)}.", suffix=".tmp", dir=os.path.dirname(sidecar_file) or "."
+    )
+    try:
+        if os.name == "posix":
+            # mkstemp creates the file readable by its owner only
+            os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, key=np.asarray(key), **features)
+        os.replace(temporary_file, sidecar_file)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_file)
+        raise
+    return features
+
+
+def _update_features(motion_file: str, recompute: bool, kwargs: dict) -> str:
+    """Update the sidecar file of one motion (worker process)"""
+    load_features(motion_file, recompute=recompute, **kwargs)
+    return motion_file
+
+
+def update_dataset_features(
+    motion_files: list[str], recompute: bool = False, num_workers: int | None = None, **kwargs
+) -> None:
+    """
+    Compute the missing or out of date sidecar files of a dataset of motions, in parallel over the motions.
+
+    Args:
+        motion_files: The motion files.
+        recompute: Whether to recompute the features even if the sidecar files are up to date.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+        kwargs: The feature extraction parameters (see :func:`compute_features`).
+    """
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_update_features, file, recompute, kwargs) for file in motion_files]
+        for future in futures:
+            print(f"Features updated: {future.result()}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-dir", type=str, required=True, help="Directory of motion files")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--recompute", action="store_true", default=False, help="Recompute up to date features")
+    parser.add_argument("--foot-bodies", type=str, nargs="*", default=None, help="Bodies checked for contacts")
+    args, _ = parser.parse_known_args()
+
+    files = sorted(glob.glob(os.path.join(args.dataset_dir, "**", "*.npz"), recursive=True))
+    kwargs = {"foot_bodies": args.foot_bodies} if args.foot_bodies else {}
+    update_dataset_features(files, recompute=args.recompute, num_workers=args.workers, **kwargs)
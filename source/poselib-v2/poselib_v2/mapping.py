@@ -1,100 +1,351 @@
+import re
+from typing import Callable, Iterable
 
+import numpy as np
 
+
+# Each mapping entry maps a target body name to ``(source_bone_name, selector)`` or
+# ``(source_bone_name, selector, offset)``, where the selector picks the point along the source bone:
+#   - "head" or "tail": the head or tail of the bone
+#   - a float: interpolation factor along the bone, between 0 (head) and 1 (tail)
+#   - a callable taking the pose bone (legacy), e.g. ``lambda b: b.head``
+# and the optional offset is a fixed (x, y, z) translation added to the selected point.
+#
 # only thing need to be cautious is that the first entry must be the root.
 
 
+class MappingPlan:
+    """
+    Compiled form of a mapping table.
+
+    The plan stores, for each target body, the index of its source bone together with the interpolation
+    factor along the bone and a fixed offset, so that the body positions of all frames can be extracted
+    with a single gather over a head / tail buffer.
+    """
+
+    def __init__(
+        self,
+        body_names: list[str],
+        bone_names: list[str],
+        bone_indices: np.ndarray,
+        blends: np.ndarray,
+        offsets: np.ndarray,
+    ) -> None:
+        """
+        Args:
+            body_names: Target body names, of length B.
+            bone_names: Source bone names, in the order of the head / tail buffer.
+            bone_indices: Index of the source bone of each body. Shape is (B,).
+            blends: Interpolation factor along the source bone of each body,
+                between 0 (head) and 1 (tail). Shape is (B,).
+            offsets: Fixed offset added to the position of each body. Shape is (B, 3).
+        """
+        self.body_names = body_names
+        self.bone_names = bone_names
+        self.bone_indices = bone_indices
+        self.blends = blends
+        self.offsets = offsets
+
+    @property
+    def num_bodies(self) -> int:
+        """Number of target bodies."""
+        return len(self.body_names)
+
+    @property
+    def num_bones(self) -> int:
+        """Number of source bones in the head / tail buffer."""
+        return len(self.bone_names)
+
+    @property
+    def used_bone_indices(self) -> np.ndarray:
+        """Sorted indices of the source bones referenced by at least one body."""
+        return np.unique(self.bone_indices)
+
+    def used_bones_plan(self) -> "MappingPlan":
+        """
+        Get the same plan over a head / tail buffer of the used source bones only
+        (see :attr:`used_bone_indices`), so that per-frame buffers don't hold the unmapped bones.
+        """
+        used = self.used_bone_indices
+        bone_names = [self.bone_names[idx] for idx in used]
+        bone_indices = np.searchsorted(used, self.bone_indices)
+        return MappingPlan(self.body_names, bone_names, bone_indices, self.blends, self.offsets)
+
+    def gather(self, values: np.ndarray) -> np.ndarray:
+        """
+        Gather per-bone values for each target body.
+
+        Args:
+            values: Per-bone values. Shape is (F, num_bones, ...).
+
+        Returns:
+            Per-body values. Shape is (F, B, ...).
+        """
+        return values[:, self.bone_indices]
+
+    def gather_positions(self, head_tail: np.ndarray) -> np.ndarray:
+        """
+        Compute the body positions from the head and tail positions of the source bones.
+
+        Args:
+            head_tail: Head and tail positions of the source bones. Shape is (F, num_bones, 2, 3).
+
+        Returns:
+            Body positions. Shape is (F, B, 3).
+        """
+        selected = self.gather(head_tail)
+        head = selected[:, :, 0]
+        tail = selected[:, :, 1]
+        return head + self.blends[:, None] * (tail - head) + self.offsets
+
+
+class _ProbeBone:
+    """Stand-in pose bone used to evaluate legacy mapping functions."""
+
+    def __init__(self, head: np.ndarray, tail: np.ndarray) -> None:
+        self.head = head
+        self.tail = tail
+
+
+def _probe_mapping_function(function: Callable) -> tuple[float, np.ndarray]:
+    """
+    Express a legacy mapping function as an interpolation factor along the bone plus a fixed offset.
+
+    Args:
+        function: The mapping function taking a pose bone.
+
+    Returns:
+        The interpolation factor and the offset of shape (3,).
+
+    Raises:
+        ValueError: If the function is not an affine combination of the bone head and tail.
+    """
+    zeros = np.zeros(3)
+    ones = np.ones(3)
+    offset = np.asarray(function(_ProbeBone(zeros, zeros)), dtype=np.float64)
+    blend = np.asarray(function(_ProbeBone(zeros, ones)), dtype=np.float64) - offset
+    head = np.asarray(function(_ProbeBone(ones, zeros)), dtype=np.float64) - offset
+    if not (np.allclose(blend, blend[0]) and np.allclose(head + blend, 1.0)):
+        msg = f"Mapping function {function} is not an interpolation between the bone head and tail."
+        raise ValueError(msg)
+    return float(blend[0]), offset
+
+
+def compile_mapping(mapping: dict[str, tuple], bone_names: Iterable[str]) -> MappingPlan:
+    """
+    Compile a mapping table into a :class:`MappingPlan`.
+
+    Args:
+        mapping: The mapping from target body names to their source bone entries.
+        bone_names: Source bone names, in the order of the head / tail buffer
+            (typically the pose bones of the source armature).
+
+    Returns:
+        The compiled mapping plan.
+
+    Raises:
+        ValueError: If a source bone doesn't exist, or if an entry selector is invalid.
+    """
+    bone_names = list(bone_names)
+    bone_lookup = {name: idx for idx, name in enumerate(bone_names)}
+
+    missing = sorted({entry[0] for entry in mapping.values() if entry[0] not in bone_lookup})
+    if missing:
+        msg = f"Cannot find source bones {missing} in the armature."
+        raise ValueError(msg)
+
+    n_body = len(mapping)
+    bone_indices = np.zeros(n_body, dtype=np.int64)
+    blends = np.zeros(n_body, dtype=np.float32)
+    offsets = np.zeros((n_body, 3), dtype=np.float32)
+
+    for idx, (body_name, entry) in enumerate(mapping.items()):
+        source_bone_name, selector, *extra = entry
+        bone_indices[idx] = bone_lookup[source_bone_name]
+
+        if callable(selector):
+            blends[idx], offsets[idx] = _probe_mapping_function(selector)
+        elif selector == "head":
+            blends[idx] = 0.0
+        elif selector == "tail":
+            blends[idx] = 1.0
+        elif isinstance(selector, (int, float)):
+            blends[idx] = selector
+        else:
+            msg = f"Invalid selector {selector!r} for body {body_name}."
+            raise ValueError(msg)
+
+        if extra:
+            offsets[idx] += np.asarray(extra[0], dtype=np.float32)
+
+    return MappingPlan(list(mapping.keys()), bone_names, bone_indices, blends, offsets)
+
+
 class UnitreeG1Mapping:
     actorcore = {
-        "pelvis"                    : ("CC_Base_Pelvis",        lambda b: b.head),  # 0
-        "left_shoulder_roll_link"   : ("CC_Base_L_Clavicle",    lambda b: b.tail),  # 1
-        "left_elbow_link"           : ("CC_Base_L_Forearm",     lambda b: b.head),  # 2
-        "left_wrist_pitch_link"     : ("CC_Base_L_Hand",        lambda b: b.head),  # 3
-        "left_rubber_hand"          : ("CC_Base_L_Hand",        lambda b: b.tail),  # 4
-        "right_shoulder_roll_link"  : ("CC_Base_R_Clavicle",    lambda b: b.tail),  # 5
-        "right_elbow_link"          : ("CC_Base_R_Forearm",     lambda b: b.head),  # 6
-        "right_wrist_pitch_link"    : ("CC_Base_R_Hand",        lambda b: b.head),  # 7
-        "right_rubber_hand"         : ("CC_Base_R_Hand",        lambda b: b.tail),  # 8
-        "left_hip_roll_link"        : ("CC_Base_L_Thigh",       lambda b: b.head),  # 9
-        "left_knee_link"            : ("CC_Base_L_Calf",        lambda b: b.head),  # 10
-        "left_ankle_roll_link"      : ("CC_Base_L_Foot",        lambda b: b.head),  # 11
-        "right_hip_roll_link"       : ("CC_Base_R_Thigh",       lambda b: b.head),  # 12
-        "right_knee_link"           : ("CC_Base_R_Calf",        lambda b: b.head),  # 13
-        "right_ankle_roll_link"     : ("CC_Base_R_Foot",        lambda b: b.head),  # 14
-        "torso_link"                : ("CC_Base_Spine02",       lambda b: b.head),  # 15
-        "head_link"                 : ("CC_Base_Head",          lambda b: b.tail),  # 16
+        "pelvis"                    : ("CC_Base_Pelvis",        "head"),  # 0
+        "left_shoulder_roll_link"   : ("CC_Base_L_Clavicle",    "tail"),  # 1
+        "left_elbow_link"           : ("CC_Base_L_Forearm",     "head"),  # 2
+        "left_wrist_pitch_link"     : ("CC_Base_L_Hand",        "head"),  # 3
+        "left_rubber_hand"          : ("CC_Base_L_Hand",        "tail"),  # 4
+        "right_shoulder_roll_link"  : ("CC_Base_R_Clavicle",    "tail"),  # 5
+        "right_elbow_link"          : ("CC_Base_R_Forearm",     "head"),  # 6
+        "right_wrist_pitch_link"    : ("CC_Base_R_Hand",        "head"),  # 7
+        "right_rubber_hand"         : ("CC_Base_R_Hand",        "tail"),  # 8
+        "left_hip_roll_link"        : ("CC_Base_L_Thigh",       "head"),  # 9
+        "left_knee_link"            : ("CC_Base_L_Calf",        "head"),  # 10
+        "left_ankle_roll_link"      : ("CC_Base_L_Foot",        "head"),  # 11
+        "right_hip_roll_link"       : ("CC_Base_R_Thigh",       "head"),  # 12
+        "right_knee_link"           : ("CC_Base_R_Calf",        "head"),  # 13
+        "right_ankle_roll_link"     : ("CC_Base_R_Foot",        "head"),  # 14
+        "torso_link"                : ("CC_Base_Spine02",       "head"),  # 15
+        "head_link"                 : ("CC_Base_Head",          "tail"),  # 16
     }
     meshcapade = {
-        "pelvis"                    : ("pelvis",        lambda b: b.head),
-        "left_shoulder_roll_link"   : ("upperarm_l",    lambda b: b.head),
-        "left_elbow_link"           : ("lowerarm_l",    lambda b: b.head),
-        "left_wrist_pitch_link"     : ("hand_l",        lambda b: b.head),
-        "left_rubber_hand"          : ("hand_l",        lambda b: b.tail),
-        "right_shoulder_roll_link"  : ("upperarm_r",    lambda b: b.head),
-        "right_elbow_link"          : ("lowerarm_r",    lambda b: b.head),
-        "right_wrist_pitch_link"    : ("hand_r",        lambda b: b.head),
-        "right_rubber_hand"         : ("hand_r",        lambda b: b.tail),
-        "torso_link"                : ("torso",         lambda b: b.head),
-        "head_link"                 : ("head",          lambda b: b.head),
-        "left_hip_roll_link"        : ("thigh_l",       lambda b: b.head),
-        "left_knee_link"            : ("calf_l",        lambda b: b.head),
-        "left_ankle_pitch_link"     : ("foot_l",        lambda b: b.head),
-        "left_ankle_roll_link"      : ("ball_l",        lambda b: b.head),
-        "right_hip_roll_link"       : ("thigh_r",       lambda b: b.head),
-        "right_knee_link"           : ("calf_r",        lambda b: b.head),
-        "right_ankle_pitch_link"    : ("foot_r",        lambda b: b.head),
-        "right_ankle_roll_link"     : ("ball_r",        lambda b: b.head),
+        "pelvis"                    : ("pelvis",        "head"),
+        "left_shoulder_roll_link"   : ("upperarm_l",    "head"),
+        "left_elbow_link"           : ("lowerarm_l",    "head"),
+        "left_wrist_pitch_link"     : ("hand_l",        "head"),
+        "left_rubber_hand"          : ("hand_l",        "tail"),
+        "right_shoulder_roll_link"  : ("upperarm_r",    "head"),
+        "right_elbow_link"          : ("lowerarm_r",    "head"),
+        "right_wrist_pitch_link"    : ("hand_r",        "head"),
+        "right_rubber_hand"         : ("hand_r",        "tail"),
+        "torso_link"                : ("torso",         "head"),
+        "head_link"                 : ("head",          "head"),
+        "left_hip_roll_link"        : ("thigh_l",       "head"),
+        "left_knee_link"            : ("calf_l",        "head"),
+        "left_ankle_pitch_link"     : ("foot_l",        "head"),
+        "left_ankle_roll_link"      : ("ball_l",        "head"),
+        "right_hip_roll_link"       : ("thigh_r",       "head"),
+        "right_knee_link"           : ("calf_r",        "head"),
+        "right_ankle_pitch_link"    : ("foot_r",        "head"),
+        "right_ankle_roll_link"     : ("ball_r",        "head"),
     }
     mmd_yyb = {
-        "pelvis"                    : ("腰",        lambda b: b.head),  # 0
-        "left_shoulder_roll_link"   : ("腕.L",      lambda b: b.head),  # 1
-        "left_elbow_link"           : ("腕.L",      lambda b: b.tail),  # 2
-        "left_rubber_hand"          : ("ひじ.L",    lambda b: b.tail),  # 3
-        "right_shoulder_roll_link"  : ("腕.R",      lambda b: b.head),  # 4
-        "right_elbow_link"          : ("腕.R",      lambda b: b.tail),  # 5
-        "right_rubber_hand"         : ("ひじ.R",    lambda b: b.tail),  # 6
-        "torso_link"                : ("上半身",    lambda b: b.head),  # 7
-        "left_hip_roll_link"        : ("足.L",      lambda b: b.head),  # 8
-        "left_knee_link"            : ("足.L",      lambda b: b.tail),  # 9
-        "left_ankle_roll_link"      : ("ひざ.L",    lambda b: b.tail),  # 10
-        "right_hip_roll_link"       : ("足.R",      lambda b: b.head),  # 11
-        "right_knee_link"           : ("足.R",      lambda b: b.tail),  # 12
-        "right_ankle_roll_link"     : ("ひざ.R",    lambda b: b.tail),  # 13
-        "head_link"                 : ("頭",        lambda b: b.head),  # 14
+        "pelvis"                    : ("腰",        "head"),  # 0
+        "left_shoulder_roll_link"   : ("腕.L",      "head"),  # 1
+        "left_elbow_link"           : ("腕.L",      "tail"),  # 2
+        "left_rubber_hand"          : ("ひじ.L",    "tail"),  # 3
+        "right_shoulder_roll_link"  : ("腕.R",      "head"),  # 4
+        "right_elbow_link"          : ("腕.R",      "tail"),  # 5
+        "right_rubber_hand"         : ("ひじ.R",    "tail"),  # 6
+        "torso_link"                : ("上半身",    "head"),  # 7
+        "left_hip_roll_link"        : ("足.L",      "head"),  # 8
+        "left_knee_link"            : ("足.L",      "tail"),  # 9
+        "left_ankle_roll_link"      : ("ひざ.L",    "tail"),  # 10
+        "right_hip_roll_link"       : ("足.R",      "head"),  # 11
+        "right_knee_link"           : ("足.R",      "tail"),  # 12
+        "right_ankle_roll_link"     : ("ひざ.R",    "tail"),  # 13
+        "head_link"                 : ("頭",        "head"),  # 14
     }
 
 
 class AirDraftMapping:
     mixamo = {
-        "pelvis"            : ("mixamorig:Hips",            lambda b: b.head),
-        "left_shoulder"     : ("mixamorig:LeftArm",         lambda b: b.head),
-        "left_elbow"        : ("mixamorig:LeftForeArm",     lambda b: b.head),
-        "left_hand"         : ("mixamorig:LeftHand",        lambda b: b.head),
-        "right_shoulder"    : ("mixamorig:RightArm",        lambda b: b.head),
-        "right_elbow"       : ("mixamorig:RightForeArm",    lambda b: b.head),
-        "right_hand"        : ("mixamorig:RightHand",       lambda b: b.head),
-        "left_hip"          : ("mixamorig:LeftUpLeg",       lambda b: b.head),
-        "left_knee"         : ("mixamorig:LeftLeg",         lambda b: b.head),
-        "left_foot"         : ("mixamorig:LeftToeBase",     lambda b: b.head),
-        "right_hip"         : ("mixamorig:RightUpLeg",      lambda b: b.head),
-        "right_knee"        : ("mixamorig:RightLeg",        lambda b: b.head),
-        "right_foot"        : ("mixamorig:RightToeBase",    lambda b: b.head),
-        "chest"             : ("mixamorig:Spine1",          lambda b: b.head),
-        "head"              : ("mixamorig:Head",            lambda b: b.head),
+        "pelvis"            : ("mixamorig:Hips",            "head"),
+        "left_shoulder"     : ("mixamorig:LeftArm",         "head"),
+        "left_elbow"        : ("mixamorig:LeftForeArm",     "head"),
+        "left_hand"         : ("mixamorig:LeftHand",        "head"),
+        "right_shoulder"    : ("mixamorig:RightArm",        "head"),
+        "right_elbow"       : ("mixamorig:RightForeArm",    "head"),
+        "right_hand"        : ("mixamorig:RightHand",       "head"),
+        "left_hip"          : ("mixamorig:LeftUpLeg",       "head"),
+        "left_knee"         : ("mixamorig:LeftLeg",         "head"),
+        "left_foot"         : ("mixamorig:LeftToeBase",     "head"),
+        "right_hip"         : ("mixamorig:RightUpLeg",      "head"),
+        "right_knee"        : ("mixamorig:RightLeg",        "head"),
+        "right_foot"        : ("mixamorig:RightToeBase",    "head"),
+        "chest"             : ("mixamorig:Spine1",          "head"),
+        "head"              : ("mixamorig:Head",            "head"),
     }
     mmd_yyb = {
-        "pelvis"            : ("腰",        lambda b: b.head),
-        "left_shoulder"     : ("腕.L",      lambda b: b.head),
-        "left_elbow"        : ("腕.L",      lambda b: b.tail),
-        "left_hand"         : ("ひじ.L",    lambda b: b.tail),
-        "right_shoulder"    : ("腕.R",      lambda b: b.head),
-        "right_elbow"       : ("腕.R",      lambda b: b.tail),
-        "right_hand"        : ("ひじ.R",    lambda b: b.tail),
-        "left_hip"          : ("足.L",      lambda b: b.head),
-        "left_knee"         : ("足.L",      lambda b: b.tail),
-        "left_foot"         : ("ひざ.L",    lambda b: b.tail),
-        "right_hip"         : ("足.R",      lambda b: b.head),
-        "right_knee"        : ("足.R",      lambda b: b.tail),
-        "right_foot"        : ("ひざ.R",    lambda b: b.tail),
-        "chest"             : ("上半身",    lambda b: b.head),
-        "head"              : ("頭",        lambda b: b.head),
+        "pelvis"            : ("腰",        "head"),
+        "left_shoulder"     : ("腕.L",      "head"),
+        "left_elbow"        : ("腕.L",      "tail"),
+        "left_hand"         : ("ひじ.L",    "tail"),
+        "right_shoulder"    : ("腕.R",      "head"),
+        "right_elbow"       : ("腕.R",      "tail"),
+        "right_hand"        : ("ひじ.R",    "tail"),
+        "left_hip"          : ("足.L",      "head"),
+        "left_knee"         : ("足.L",      "tail"),
+        "left_foot"         : ("ひざ.L",    "tail"),
+        "right_hip"         : ("足.R",      "head"),
+        "right_knee"        : ("足.R",      "tail"),
+        "right_foot"        : ("ひざ.R",    "tail"),
+        "chest"             : ("上半身",    "head"),
+        "head"              : ("頭",        "head"),
     }
+
+
+def get_mapping(name: str) -> dict[str, tuple]:
+    """
+    Get a mapping table by name.
+
+    Args:
+        name: The mapping name, as ``<MappingClass>.<table>``, e.g. ``UnitreeG1Mapping.mmd_yyb``.
+
+    Raises:
+        ValueError: If the mapping doesn't exist.
+
+    Returns:
+        The mapping table.
+    """
+    class_name, _, table_name = name.partition(".")
+    mapping = getattr(globals().get(class_name), table_name, None) if table_name else None
+    if not isinstance(mapping, dict):
+        msg = f"Invalid mapping name: {name}"
+        raise ValueError(msg)
+    return mapping
+
+
+def _mirror_name(name: str) -> str:
+    """Swap the left / right side of a body or joint name (e.g. ``left_knee_link`` -> ``right_knee_link``)."""
+    return re.sub(
+        r"left|right|Left|Right",
+        lambda match: {"left": "right", "right": "left", "Left": "Right", "Right": "Left"}[match.group(0)],
+        name,
+    )
+
+
+def mirror_indices(names: list[str]) -> list[int]:
+    """
+    Get the index of the mirrored counterpart of each body or joint name.
+
+    Names are paired by swapping their ``left`` / ``right`` part, as in the target names of the mapping tables.
+    Names without a side (e.g. ``pelvis``) are their own counterpart.
+
+    Args:
+        names: The body or joint names.
+
+    Raises:
+        ValueError: If the counterpart of a name doesn't exist.
+
+    Returns:
+        The counterpart index of each name.
+    """
+    lookup = {name: idx for idx, name in enumerate(names)}
+    indices = []
+    for name in names:
+        mirrored = _mirror_name(name)
+        if mirrored not in lookup:
+            msg = f"The mirrored counterpart of {name} ({mirrored}) doesn't exist."
+            raise ValueError(msg)
+        indices.append(lookup[mirrored])
+    return indices
+
+
+def mirror_dof_signs(dof_names: list[str]) -> np.ndarray:
+    """
+    Get the sign of each joint position under left / right mirroring.
+
+    Mirroring across the sagittal (XZ) plane flips the rotations about the X (roll) and Z (yaw) axes,
+    while the rotations about the Y (pitch) axis are kept.
+
+    Args:
+        dof_names: The joint names.
+
+    Returns:
+        The sign (-1 or 1) of each joint. Shape is (D,).
+    """
+    return np.array([-1.0 if re.search(r"roll|yaw", name) else 1.0 for name in dof_names], dtype=np.float32)
@@ -0,0 +1,192 @@
+import numpy as np
+
+
+def quat_mul(q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    """Multiply two quaternions together.
+
+    Args:
+        q1: The first quaternion in (w, x, y, z). Shape is (..., 4).
+        q2: The second quaternion in (w, x, y, z). Shape is (..., 4).
+
+    Returns:
+        The product of the two quaternions in (w, x, y, z). Shape is (..., 4).
+
+    Raises:
+        ValueError: Input shapes of ``q1`` and ``q2`` are not matching.
+    """
+    # check input is correct
+    if q1.shape != q2.shape:
+        msg = f"Expected input quaternion shape mismatch: {q1.shape} != {q2.shape}."
+        raise ValueError(msg)
+    # reshape to (N, 4) for multiplication
+    shape = q1.shape
+    q1 = q1.reshape(-1, 4)
+    q2 = q2.reshape(-1, 4)
+    # extract components from quaternions
+    w1, x1, y1, z1 = q1[:, 0], q1[:, 1], q1[:, 2], q1[:, 3]
+    w2, x2, y2, z2 = q2[:, 0], q2[:, 1], q2[:, 2], q2[:, 3]
+    # perform multiplication
+    ww = (z1 + x1) * (x2 + y2)
+    yy = (w1 - y1) * (w2 + z2)
+    zz = (w1 + y1) * (w2 - z2)
+    xx = ww + yy + zz
+    qq = 0.5 * (xx + (z1 - x1) * (x2 - y2))
+    w = qq - ww + (z1 - y1) * (y2 - z2)
+    x = qq - xx + (x1 + w1) * (x2 + w2)
+    y = qq - yy + (w1 - x1) * (y2 + z2)
+    z = qq - zz + (z1 + y1) * (w2 - x2)
+
+    return np.stack([w, x, y, z], axis=-1).reshape(shape)
+
+
+def quat_conjugate(q: np.ndarray) -> np.ndarray:
+    """Conjugate (inverse, for unit quaternions) of quaternions in (w, x, y, z). Shape is (..., 4)."""
+    return q * np.array([1.0, -1.0, -1.0, -1.0], dtype=q.dtype)
+
+
+def quat_to_rotvec(q: np.ndarray) -> np.ndarray:
+    """Convert quaternions to rotation vectors (axis times angle), taking the shortest rotation.
+
+    Args:
+        q: The quaternions in (w, x, y, z). Shape is (..., 4).
+
+    Returns:
+        The rotation vectors, with angles in [0, pi]. Shape is (..., 3).
+    """
+    q = np.where(q[..., :1] < 0, -q, q)
+    sin_half = np.linalg.norm(q[..., 1:], axis=-1, keepdims=True)
+    angle = 2.0 * np.arctan2(sin_half, q[..., :1])
+    # angle / sin(angle / 2) tends to 2 for small angles
+    scale = np.where(sin_half > 1e-8, angle / np.maximum(sin_half, 1e-8), 2.0)
+    return scale * q[..., 1:]
+
+
+def rotvec_to_quat(rotvec: np.ndarray) -> np.ndarray:
+    """Convert rotation vectors (axis times angle) to quaternions.
+
+    Args:
+        rotvec: The rotation vectors. Shape is (..., 3).
+
+    Returns:
+        The quaternions in (w, x, y, z). Shape is (..., 4).
+    """
+    angle = np.linalg.norm(rotvec, axis=-1, keepdims=True)
+    # sin(angle / 2) / angle tends to 1 / 2 for small angles
+    scale = np.where(angle > 1e-8, np.sin(0.5 * angle) / np.maximum(angle, 1e-8), 0.5)
+    return np.concatenate([np.cos(0.5 * angle), scale * rotvec], axis=-1)
+
+
+def quat_slerp(q0: np.ndarray, q1: np.ndarray, blend: np.ndarray) -> np.ndarray:
+    """Spherical linear interpolation between quaternions, along the shortest path.
+
+    Args:
+        q0: The first quaternions in (w, x, y, z). Shape is (..., 4).
+        q1: The second quaternions in (w, x, y, z). Shape is (..., 4).
+        blend: Interpolation coefficient between 0 (q0) and 1 (q1). Shape is (...,) broadcastable with the
+            quaternions without their last dimension.
+
+    Returns:
+        The interpolated quaternions in (w, x, y, z). Shape is (..., 4).
+    """
+    cos_half_theta = np.sum(q0 * q1, axis=-1, keepdims=True)
+    q1 = np.where(cos_half_theta < 0, -q1, q1)
+    cos_half_theta = np.clip(np.abs(cos_half_theta), 0.0, 1.0)
+    half_theta = np.arccos(cos_half_theta)
+    sin_half_theta = np.sqrt(1.0 - cos_half_theta * cos_half_theta)
+    blend = np.asarray(blend)[..., None]
+    # fall back to linear interpolation for close rotations
+    close = sin_half_theta < 1e-3
+    safe_sin = np.where(close, 1.0, sin_half_theta)
+    ratio_0 = np.where(close, 1.0 - blend, np.sin((1.0 - blend) * half_theta) / safe_sin)
+    ratio_1 = np.where(close, blend, np.sin(blend * half_theta) / safe_sin)
+    q = ratio_0 * q0 + ratio_1 * q1
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def quat_to_matrix(q: np.ndarray) -> np.ndarray:
+    """Convert quaternions to rotation matrices.
+
+    Args:
+        q: The quaternions in (w, x, y, z). Shape is (..., 4).
+
+    Returns:
+        The rotation matrices. Shape is (..., 3, 3).
+    """
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=-1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=-1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=-2)
+
+
+def matrix_to_quat(matrices: np.ndarray) -> np.ndarray:
+    """Convert rotation matrices to quaternions.
+
+    The rotation part of the matrices is normalized first, so matrices with scale are accepted.
+    The returned quaternions have a non-negative real part.
+
+    Args:
+        matrices: The rotation (or transformation) matrices. Shape is (..., 3, 3) or (..., 4, 4).
+
+    Returns:
+        The quaternions in (w, x, y, z). Shape is (..., 4).
+    """
+    m = _normalized_rotation(matrices)
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+    # candidate quaternions scaled by 4 * (w, x, y, z) respectively, pick the numerically largest one
+    candidates = np.stack([
+        np.stack([1.0 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01], axis=-1),
+        np.stack([m21 - m12, 1.0 + m00 - m11 - m22, m01 + m10, m02 + m20], axis=-1),
+        np.stack([m02 - m20, m01 + m10, 1.0 - m00 + m11 - m22, m12 + m21], axis=-1),
+        np.stack([m10 - m01, m02 + m20, m12 + m21, 1.0 - m00 - m11 + m22], axis=-1),
+    ], axis=-2)
+    diagonal = np.stack([m00 + m11 + m22, m00, m11, m22], axis=-1)
+    best = np.argmax(diagonal, axis=-1)
+    q = np.take_along_axis(candidates, best[..., None, None], axis=-2)[..., 0, :]
+    q /= np.linalg.norm(q, axis=-1, keepdims=True)
+
+    # ensure canonical representation
+    return np.where(q[..., :1] < 0, -q, q)
+
+
+def matrix_to_euler_xyz(matrices: np.ndarray) -> np.ndarray:
+    """Convert rotation matrices to XYZ Euler angles.
+
+    Follows the Blender ``Matrix.to_euler()`` convention: of the two equivalent solutions,
+    the one with the smallest sum of absolute angles is returned.
+
+    Args:
+        matrices: The rotation (or transformation) matrices. Shape is (..., 3, 3) or (..., 4, 4).
+
+    Returns:
+        The Euler angles (x, y, z) in radians. Shape is (..., 3).
+    """
+    m = _normalized_rotation(matrices)
+    cy = np.hypot(m[..., 0, 0], m[..., 1, 0])
+    singular = cy <= 16.0 * np.finfo(np.float32).eps
+
+    euler_1 = np.stack([
+        np.where(singular, np.arctan2(-m[..., 1, 2], m[..., 1, 1]), np.arctan2(m[..., 2, 1], m[..., 2, 2])),
+        np.arctan2(-m[..., 2, 0], cy),
+        np.where(singular, 0.0, np.arctan2(m[..., 1, 0], m[..., 0, 0])),
+    ], axis=-1)
+    euler_2 = np.stack([
+        np.arctan2(-m[..., 2, 1], -m[..., 2, 2]),
+        np.arctan2(-m[..., 2, 0], -cy),
+        np.arctan2(-m[..., 1, 0], -m[..., 0, 0]),
+    ], axis=-1)
+    euler_2 = np.where(singular[..., None], euler_1, euler_2)
+
+    use_second = np.sum(np.abs(euler_2), axis=-1) < np.sum(np.abs(euler_1), axis=-1)
+    return np.where(use_second[..., None], euler_2, euler_1)
+
+
+def _normalized_rotation(matrices: np.ndarray) -> np.ndarray:
+    """Extract the 3x3 part of the matrices and normalize its columns to remove scale."""
+    m = np.asarray(matrices, dtype=np.float64)[..., :3, :3]
+    return m / np.linalg.norm(m, axis=-2, keepdims=True)
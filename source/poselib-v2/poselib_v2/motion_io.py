@@ -0,0 +1,465 @@
+import glob
+import json
+import lzma
+import os
+import shutil
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+import numpy as np
+
+
+# motion fields with one entry per frame, see docs/Motion-File-Format.md
+FRAME_FIELDS = (
+    "dof_positions",
+    "dof_velocities",
+    "body_positions",
+    "body_rotations",
+    "body_linear_velocities",
+    "body_angular_velocities",
+)
+# motion fields describing the whole motion
+METADATA_FIELDS = ("fps", "dof_names", "body_names")
+# optional motion fields, e.g. the times of the frames of decimated motions (see decimation.py)
+OPTIONAL_FIELDS = ("frame_times",)
+
+# compression codecs of the compressed motion format, as (compress, decompress) functions
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+# name of the header entry identifying the compressed motion format
+COMPRESSED_HEADER = "header.json"
+
+
+def save_motion_data(
+    output_file: str,
+    motion_data: dict,
+    codec: str | None = None,
+    delta: bool = False,
+    chunk_frames: int = 1024,
+    num_workers: int | None = None,
+) -> None:
+    """
+    Save motion data to a motion file.
+
+    Without ``codec``, the motion is saved as an uncompressed NumPy ``.npz`` file. Otherwise, each frame field
+    is split into chunks of frames which are compressed independently on a thread pool, so both the compression
+    and the decompression run in parallel.
+
+    Compressed files are zip archives like ``.npz`` files, but their frame fields are not ``.npy`` entries:
+    they can only be read with :func:`load_motion_data`, not with ``np.load``.
+
+    Args:
+        output_file: The path to the output file.
+        motion_data: The motion data to save.
+        codec: The compression codec, one of :data:`CODECS` (``zlib`` or ``lzma``), or None to not compress.
+        delta: Whether to delta encode consecutive frames before compression. The encoding is done on the
+            bit patterns of the values, so it is lossless.
+        chunk_frames: Number of frames per compressed chunk.
+        num_workers: Number of compression threads. Defaults to the number of CPUs.
+    """
+    if codec is None:
+        fields = METADATA_FIELDS + FRAME_FIELDS + tuple(name for name in OPTIONAL_FIELDS if name in motion_data)
+        np.savez(output_file, **{name: motion_data[name] for name in fields})
+        return
+
+    assert codec in CODECS, f"Invalid codec {codec}, expected one of {list(CODECS)}"
+    compress, _ = CODECS[codec]
+
+    header = {"codec": codec, "delta": delta, "fields": {}}
+    tasks = []
+    for name in FRAME_FIELDS:
+        values = np.ascontiguousarray(motion_data[name], dtype=np.float32)
+        chunk_starts = list(range(0, values.shape[0], chunk_frames)) or [0]
+        header["fields"][name] = {
+            "shape": list(values.shape),
+            "dtype": values.dtype.str,
+            "chunks": [[start, min(start + chunk_frames, values.shape[0])] for start in chunk_starts],
+        }
+        for start, end in header["fields"][name]["chunks"]:
+            tasks.append((f"{name}/{start:09d}", values[start:end]))
+
+    def encode(values: np.ndarray) -> bytes:
+        if delta:
+            values = _delta_encode(values)
+        return compress(values.tobytes())
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        blobs = executor.map(encode, [values for _, values in tasks])
+
+        temporary_file = output_file + ".tmp"
+        with zipfile.ZipFile(temporary_file, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            archive.writestr(COMPRESSED_HEADER, json.dumps(header))
+            for name in METADATA_FIELDS + tuple(name for name in OPTIONAL_FIELDS if name in motion_data):
+                with archive.open(f"{name}.npy", "w") as f:
+                    np.lib.format.write_array(f, np.asarray(motion_data[name]), allow_pickle=False)
+            # write the chunks in order as they get compressed
+            for (entry, _), blob in zip(tasks, blobs):
+                archive.writestr(entry, blob)
+    os.replace(temporary_file, output_file)
+
+
+def load_motion_data(motion_file: str, num_workers: int | None = None) -> dict[str, np.ndarray]:
+    """
+    Load motion data from a motion file, either an uncompressed ``.npz`` file or a compressed motion file
+    written by :func:`save_motion_data`.
+
+    Args:
+        motion_file: The path to the motion file.
+        num_workers: Number of decompression threads. Defaults to the number of CPUs.
+
+    Returns:
+        The motion data.
+    """
+    with zipfile.ZipFile(motion_file) as archive:
+        if COMPRESSED_HEADER not in archive.namelist():
+            with np.load(motion_file) as data:
+                return {name: data[name] for name in data.files}
+
+        header = json.loads(archive.read(COMPRESSED_HEADER))
+        motion_data = {}
+        for name in METADATA_FIELDS + OPTIONAL_FIELDS:
+            if f"{name}.npy" in archive.namelist():
+                with archive.open(f"{name}.npy") as f:
+                    motion_data[name] = np.lib.format.read_array(f, allow_pickle=False)
+        # the compressed chunks are small, read them all before decompressing in parallel
+        tasks = []
+        for name, field in header["fields"].items():
+            motion_data[name] = np.empty(field["shape"], dtype=np.dtype(field["dtype"]))
+            for start, end in field["chunks"]:
+                tasks.append((motion_data[name][start:end], archive.read(f"{name}/{start:09d}")))
+
+    _, decompress = CODECS[header["codec"]]
+
+    def decode(task: tuple[np.ndarray, bytes]) -> None:
+        output, blob = task
+        values = np.frombuffer(decompress(blob), dtype=output.dtype).reshape(output.shape)
+        output[:] = _delta_decode(values) if header["delta"] else values
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(decode, tasks))
+    return motion_data
+
+
+def read_motion_info(motion_file: str) -> dict:
+    """
+    Read the frame rate, names, number of frames and duration of a motion file, without loading its frames.
+
+    Args:
+        motion_file: The path to the motion file, uncompressed or compressed.
+
+    Returns:
+        The ``fps``, ``dof_names``, ``body_names``, ``num_frames`` and ``duration`` (in seconds) of the motion.
+        The duration is the time of the last frame: for motions with non-uniform frames (e.g. decimated
+        motions), the last entry of their ``frame_times``.
+    """
+    with zipfile.ZipFile(motion_file) as archive:
+        info = {}
+        for name in METADATA_FIELDS:
+            with archive.open(f"{name}.npy") as f:
+                info[name] = np.lib.format.read_array(f, allow_pickle=False)
+        frame_times = None
+        if "frame_times.npy" in archive.namelist():
+            with archive.open("frame_times.npy") as f:
+                frame_times = np.lib.format.read_array(f, allow_pickle=False)
+        if COMPRESSED_HEADER in archive.namelist():
+            header = json.loads(archive.read(COMPRESSED_HEADER))
+            info["num_frames"] = header["fields"][FRAME_FIELDS[0]]["shape"][0]
+        else:
+            with archive.open(f"{FRAME_FIELDS[0]}.npy") as f:
+                info["num_frames"] = _read_npy_header(f)[0][0]
+    info["fps"] = info["fps"].reshape(-1)[0]
+    if frame_times is not None:
+        info["duration"] = float(frame_times[-1])
+    else:
+        info["duration"] = (int(info["num_frames"]) - 1) / float(info["fps"])
+    info["dof_names"] = info["dof_names"].tolist()
+    info["body_names"] = info["body_names"].tolist()
+    return info
+
+
+def _delta_encode(values: np.ndarray) -> np.ndarray:
+    """Delta encode consecutive frames, on the bit patterns of the 32-bit values (wrapping on overflow)."""
+    bits = values.view(np.uint32)
+    encoded = bits.copy()
+    encoded[1:] -= bits[:-1]
+    return encoded
+
+
+def _delta_decode(encoded: np.ndarray) -> np.ndarray:
+    """Revert :func:`_delta_encode`."""
+    return np.cumsum(encoded.view(np.uint32), axis=0, dtype=np.uint32).view(np.float32)
+
+
+class MotionWriter:
+    """
+    Append-only motion writer flushing fixed-size frame chunks to disk.
+
+    The frames are written as chunk files into a ``<output_file>.chunks`` directory as soon as a chunk is full,
+    so only one chunk is held in memory, and the frames written before a crash are kept on disk.
+    :meth:`finalize` then assembles the chunks into a motion file in the standard layout.
+    """
+
+    def __init__(
+        self,
+        output_file: str,
+        fps: np.ndarray,
+        dof_names: np.ndarray,
+        body_names: np.ndarray,
+        chunk_size: int = 1024,
+    ) -> None:
+        """
+        Args:
+            output_file: The path of the final motion file.
+            fps: The frame rate of the motion.
+            dof_names: The joint names.
+            body_names: The body names.
+            chunk_size: Number of frames per chunk.
+        """
+        self.output_file = output_file
+        self.chunk_dir = output_file + ".chunks"
+        self.chunk_size = chunk_size
+        self.num_frames = 0
+
+        self._num_chunks = 0
+        self._pending: dict[str, list[np.ndarray]] = {name: [] for name in FRAME_FIELDS}
+        self._num_pending = 0
+
+        # start from an empty chunk directory
+        shutil.rmtree(self.chunk_dir, ignore_errors=True)
+        os.makedirs(self.chunk_dir)
+        np.savez(
+            os.path.join(self.chunk_dir, "metadata.npz"),
+            fps=np.asarray(fps, dtype=np.int64).reshape(1),
+            dof_names=np.asarray(dof_names),
+            body_names=np.asarray(body_names),
+        )
+
+    def append(self, frames: dict[str, np.ndarray]) -> None:
+        """Append frames to the motion.
+
+        Args:
+            frames: The values of every frame field for the new frames. Shapes are (N, ...).
+        """
+        num_frames = frames[FRAME_FIELDS[0]].shape[0]
+        for name in FRAME_FIELDS:
+            assert frames[name].shape[0] == num_frames, f"Field {name} has a mismatching number of frames"
+            self._pending[name].append(np.asarray(frames[name], dtype=np.float32))
+        self._num_pending += num_frames
+        self.num_frames += num_frames
+
+        while self._num_pending >= self.chunk_size:
+            self._flush(self.chunk_size)
+
+    def flush(self) -> None:
+        """Write all the pending frames to disk, as a (possibly partial) chunk."""
+        if self._num_pending > 0:
+            self._flush(self._num_pending)
+
+    def finalize(self, keep_chunks: bool = False) -> str:
+        """Flush the pending frames and assemble the chunks into the final motion file.
+
+        Args:
+            keep_chunks: Whether to keep the chunk directory.
+
+        Returns:
+            The path of the final motion file.
+        """
+        self.flush()
+        finalize_motion_chunks(self.chunk_dir, self.output_file)
+        if not keep_chunks:
+            shutil.rmtree(self.chunk_dir)
+        print(f"Results saved to {self.output_file}")
+        return self.output_file
+
+    def _flush(self, num_frames: int) -> None:
+        """Write the first ``num_frames`` pending frames as one chunk file."""
+        chunk = {}
+        for name in FRAME_FIELDS:
+            pending = np.concatenate(self._pending[name])
+            chunk[name] = pending[:num_frames]
+            self._pending[name] = [pending[num_frames:]]
+        self._num_pending -= num_frames
+
+        # write atomically, so an interrupted write never leaves a truncated chunk
+        chunk_file = os.path.join(self.chunk_dir, f"chunk_{self._num_chunks:06d}.npz")
+        np.savez(chunk_file + ".tmp.npz", **chunk)
+        os.replace(chunk_file + ".tmp.npz", chunk_file)
+        self._num_chunks += 1
+
+
+def _chunk_files(chunk_dir: str) -> list[str]:
+    """Get the chunk files of a chunk directory, in frame order."""
+    return sorted(glob.glob(os.path.join(chunk_dir, "chunk_*[0-9].npz")))
+
+
+def finalize_motion_chunks(chunk_dir: str, output_file: str) -> None:
+    """
+    Assemble the chunks written by a :class:`MotionWriter` into a motion file in the standard layout.
+
+    The fields are streamed into the output file chunk by chunk, without loading the whole motion in memory.
+    This can also be used to recover the frames written before a crash.
+
+    Args:
+        chunk_dir: The chunk directory.
+        output_file: The path of the motion file to write.
+    """
+    chunk_files = _chunk_files(chunk_dir)
+    assert chunk_files, f"No chunk found in {chunk_dir}"
+
+    # collect the shapes from the chunk headers
+    num_frames = 0
+    for chunk_file in chunk_files:
+        shapes = _read_npz_shapes(chunk_file)
+        num_frames += shapes[FRAME_FIELDS[0]][0]
+
+    temporary_file = output_file + ".tmp.npz"
+    with zipfile.ZipFile(temporary_file, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        with np.load(os.path.join(chunk_dir, "metadata.npz")) as metadata:
+            for name in METADATA_FIELDS:
+                with archive.open(f"{name}.npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array(f, metadata[name], allow_pickle=False)
+
+        for name in FRAME_FIELDS:
+            header = {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                "fortran_order": False,
+                "shape": (num_frames, *shapes[name][1:]),
+            }
+            with archive.open(f"{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array_header_2_0(f, header)
+                for chunk_file in chunk_files:
+                    with np.load(chunk_file) as chunk:
+                        f.write(np.ascontiguousarray(chunk[name], dtype=np.float32).tobytes())
+    os.replace(temporary_file, output_file)
+
+
+class MotionChunkReader:
+    """
+    Stream the frames of a motion back in chunks.
+
+    Motion files in the standard layout, compressed motion files (see :func:`save_motion_data`), and chunk
+    directories written by :class:`MotionWriter` (e.g. the unfinalized output of an interrupted capture)
+    can be read.
+    """
+
+    def __init__(self, motion_file: str, chunk_size: int = 1024) -> None:
+        """
+        Args:
+            motion_file: The motion file, or the chunk directory, to read.
+            chunk_size: Number of frames per chunk. Ignored for compressed motion files and chunk directories,
+                which use their own chunks.
+
+        Raises:
+            AssertionError: If the specified motion file doesn't exist.
+        """
+        assert os.path.exists(motion_file), f"Invalid file path: {motion_file}"
+        self.motion_file = motion_file
+        self.chunk_size = chunk_size
+        self._is_chunk_dir = os.path.isdir(motion_file)
+
+        metadata_file = os.path.join(motion_file, "metadata.npz") if self._is_chunk_dir else motion_file
+        with np.load(metadata_file) as metadata:
+            self.fps = metadata["fps"]
+            self.dof_names = metadata["dof_names"].tolist()
+            self.body_names = metadata["body_names"].tolist()
+
+        self._header = None
+        if not self._is_chunk_dir:
+            with zipfile.ZipFile(motion_file) as archive:
+                if COMPRESSED_HEADER in archive.namelist():
+                    self._header = json.loads(archive.read(COMPRESSED_HEADER))
+        if self._header is not None:
+            self.num_frames = self._header["fields"][FRAME_FIELDS[0]]["shape"][0]
+        else:
+            chunk_files = _chunk_files(motion_file) if self._is_chunk_dir else [motion_file]
+            self.num_frames = sum(_read_npz_shapes(chunk_file)[FRAME_FIELDS[0]][0] for chunk_file in chunk_files)
+
+    def __iter__(self) -> Iterator[dict[str, np.ndarray]]:
+        """Iterate over the chunks.
+
+        Yields:
+            The values of every frame field for the frames of the chunk. Shapes are (N, ...).
+        """
+        if self._is_chunk_dir:
+            for chunk_file in _chunk_files(self.motion_file):
+                with np.load(chunk_file) as chunk:
+                    yield {name: chunk[name] for name in FRAME_FIELDS}
+            return
+
+        if self._header is not None:
+            _, decompress = CODECS[self._header["codec"]]
+            fields = self._header["fields"]
+            with zipfile.ZipFile(self.motion_file) as archive:
+                # the fields are compressed in chunks of the same frames, decompressed one chunk at a time
+                for start, end in fields[FRAME_FIELDS[0]]["chunks"]:
+                    chunk = {}
+                    for name in FRAME_FIELDS:
+                        dtype = np.dtype(fields[name]["dtype"])
+                        values = np.frombuffer(decompress(archive.read(f"{name}/{start:09d}")), dtype=dtype)
+                        values = values.reshape(end - start, *fields[name]["shape"][1:])
+                        chunk[name] = _delta_decode(values) if self._header["delta"] else values
+                    yield chunk
+            return
+
+        yield from iter_npz_chunks(self.motion_file, FRAME_FIELDS, self.chunk_size)
+
+
+def iter_npz_chunks(npz_file: str, names: tuple[str, ...], chunk_size: int) -> Iterator[dict[str, np.ndarray]]:
+    """
+    Stream arrays of an uncompressed ``.npz`` file in chunks along their first dimension, without loading
+    the whole arrays.
+
+    Args:
+        npz_file: The ``.npz`` file.
+        names: The arrays to read. They must have the same first dimension.
+        chunk_size: Number of entries (e.g. frames) per chunk.
+
+    Yields:
+        The values of the arrays for the entries of the chunk. Shapes are (N, ...).
+    """
+    with zipfile.ZipFile(npz_file) as archive:
+        streams = {name: archive.open(f"{name}.npy") for name in names}
+        try:
+            headers = {name: _read_npy_header(stream) for name, stream in streams.items()}
+            length = headers[names[0]][0][0]
+            for start in range(0, length, chunk_size):
+                num_entries = min(chunk_size, length - start)
+                chunk = {}
+                for name, stream in streams.items():
+                    shape, dtype = headers[name]
+                    chunk_shape = (num_entries, *shape[1:])
+                    buffer = stream.read(int(np.prod(chunk_shape)) * dtype.itemsize)
+                    chunk[name] = np.frombuffer(buffer, dtype=dtype).reshape(chunk_shape)
+                yield chunk
+        finally:
+            for stream in streams.values():
+                stream.close()
+
+
+def _read_npz_shapes(npz_file: str) -> dict[str, tuple[int, ...]]:
+    """Read the shapes of the frame fields of a ``.npz`` file, without loading the arrays."""
+    with zipfile.ZipFile(npz_file) as archive:
+        shapes = {}
+        for name in FRAME_FIELDS:
+            with archive.open(f"{name}.npy") as f:
+                shapes[name] = _read_npy_header(f)[0]
+        return shapes
+
+
+def _read_npy_header(f) -> tuple[tuple[int, ...], np.dtype]:
+    """Read the header of a ``.npy`` stream, leaving the stream at the start of the array data.
+
+    Returns:
+        The array shape and dtype.
+    """
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    assert not fortran_order, "Fortran ordered motion fields are not supported"
+    return shape, dtype
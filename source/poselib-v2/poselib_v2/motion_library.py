@@ -0,0 +1,261 @@
+"""
+Library of the motions of a dataset, sharded across the ranks of a data-parallel training.
+
+Each rank (process) loads only its shard of the motion files, so the memory and the loading time per rank
+shrink with the world size. The shards are balanced by number of frames, read from the dataset manifest
+(see :mod:`~poselib_v2.dataset`) without loading the motions, with a deterministic longest-processing-time
+assignment: all the ranks compute the same shards independently, and restarting with another world size
+reassigns the clips deterministically.
+
+The sampling weights of the clips are defined over the whole dataset, so they are the same on every rank:
+a rank samples its clips with their global weights, renormalized over its shard.
+
+Clips with different skeletons (e.g. converted with different mappings of
+:class:`~poselib_v2.mapping.UnitreeG1Mapping`) are reconciled at load time to a canonical skeleton (see
+:meth:`~poselib_v2.motion_loader.MotionLoader.remap_skeleton`), so they are sampled together without any
+remapping per sample. The DOFs and bodies missing from a clip are reported by masks. The loaded features are
+remapped too, with the contacts of the same foot bodies in every clip.
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+
+try:
+    from .augmentation import MotionAugmentation
+    from .dataset import load_dataset_manifest
+    from .features import default_foot_bodies
+    from .motion_loader import MotionLoader
+except ImportError:
+    from augmentation import MotionAugmentation
+    from dataset import load_dataset_manifest
+    from features import default_foot_bodies
+    from motion_loader import MotionLoader
+
+
+def assign_shards(num_frames: list[int], world_size: int) -> list[int]:
+    """Assign clips to shards, balancing the number of frames of the shards.
+
+    The clips are assigned from the longest to the shortest, each one to the shard with the fewest frames
+    (the first one on ties), so the largest shard exceeds the average by at most the longest clip.
+
+    Args:
+        num_frames: The number of frames of each clip.
+        world_size: The number of shards.
+
+    Returns:
+        The shard of each clip.
+    """
+    shards = [0] * len(num_frames)
+    totals = np.zeros(world_size, dtype=np.int64)
+    # stable sort, so clips of the same length are assigned in their order
+    for clip in sorted(range(len(num_frames)), key=lambda clip: -num_frames[clip]):
+        shard = int(totals.argmin())
+        shards[clip] = shard
+        totals[shard] += num_frames[clip]
+    return shards
+
+
+def distributed_rank() -> tuple[int, int]:
+    """Get the rank and world size of the process, from the ``RANK`` and ``WORLD_SIZE`` environment variables
+    (set by ``torchrun``), or 0 and 1 if they are not set."""
+    return int(os.environ.get("RANK", 0)), int(os.environ.get("WORLD_SIZE", 1))
+
+
+class MotionLibrary:
+    """
+    Motions of (a shard of) a dataset, sampled in batches of clips and times.
+    """
+
+    def __init__(
+        self,
+        dataset_dir: str,
+        device: torch.device,
+        rank: Optional[int] = None,
+        world_size: Optional[int] = None,
+        weights: Optional[dict[str, float]] = None,
+        dof_names: Optional[list[str]] = None,
+        body_names: Optional[list[str]] = None,
+        **kwargs,
+    ) -> None:
+        """Load the shard of the dataset assigned to a rank.
+
+        Args:
+            dataset_dir: The dataset directory.
+            device: The device to which to load the data.
+            rank: The rank of the process. Defaults to the ``RANK`` environment variable, or 0.
+            world_size: The number of ranks. Defaults to the ``WORLD_SIZE`` environment variable, or 1.
+            weights: The sampling weights of the clips, by path relative to the dataset directory
+                (the clips not listed are not sampled). Defaults to the clip durations, i.e. the frames of
+                the dataset are sampled uniformly.
+            dof_names: The DOF names of the canonical skeleton. Defaults to the DOF names of all the clips of
+                the dataset, in order of first appearance.
+            body_names: The body names of the canonical skeleton. Defaults to the body names of all the clips of
+                the dataset, in order of first appearance.
+            kwargs: The other arguments of :class:`~poselib_v2.motion_loader.MotionLoader`.
+
+        Raises:
+            ValueError: If the rank is out of the world size.
+        """
+        default_rank, default_world_size = distributed_rank()
+        self.rank = default_rank if rank is None else rank
+        self.world_size = default_world_size if world_size is None else world_size
+        if not 0 <= self.rank < self.world_size:
+            msg = f"Invalid rank {self.rank} for a world size of {self.world_size}"
+            raise ValueError(msg)
+
+        manifest = load_dataset_manifest(dataset_dir)["motions"]
+        paths = sorted(manifest)
+        if weights is None:
+            global_weights = np.array([manifest[path]["duration"] for path in paths])
+        else:
+            global_weights = np.array([weights.get(path, 0.0) for path in paths], dtype=np.float64)
+        global_weights = global_weights / global_weights.sum()
+        # canonical skeleton, from the manifest so it is the same on every rank
+        if dof_names is None:
+            dof_names = list(dict.fromkeys(name for path in paths for name in manifest[path]["dof_names"]))
+        if body_names is None:
+            body_names = list(dict.fromkeys(name for path in paths for name in manifest[path]["body_names"]))
+        self._dof_names, self._body_names = list(dof_names), list(body_names)
+        shards = assign_shards([manifest[path]["num_frames"] for path in paths], self.world_size)
+
+        # clips of the shard, as indexes of the clips of the dataset
+        self.clip_ids = np.array([clip for clip, shard in enumerate(shards) if shard == self.rank], dtype=np.int64)
+        self.motion_files = [paths[clip] for clip in self.clip_ids]
+        self.num_dataset_clips = len(paths)
+        self.global_weights = global_weights[self.clip_ids]
+        # probability mass of the shard in the dataset, e.g. to weight the losses or the environments of the ranks
+        self.shard_weight = float(self.global_weights.sum())
+        self._probabilities = self.global_weights / self.shard_weight if self.shard_weight > 0 else None
+
+        # load the files of the shard in the background, concurrently
+        handles = [
+            MotionLoader.load_async(os.path.join(dataset_dir, path), device, **kwargs) for path in self.motion_files
+        ]
+        self.motions = [handle.result() for handle in handles]
+        # foot bodies of the contact features, the same on every rank
+        self.foot_bodies = None
+        if kwargs.get("features"):
+            self.foot_bodies = (kwargs.get("feature_kwargs") or {}).get("foot_bodies")
+            if self.foot_bodies is None:
+                self.foot_bodies = default_foot_bodies(self._body_names)
+        # masks of the DOFs and bodies of the canonical skeleton present in each clip
+        masks = [motion.remap_skeleton(self._dof_names, self._body_names, self.foot_bodies) for motion in self.motions]
+        self.dof_masks = torch.zeros((self.num_clips, self.num_dofs), dtype=torch.bool, device=device)
+        self.body_masks = torch.zeros((self.num_clips, self.num_bodies), dtype=torch.bool, device=device)
+        for clip, (dof_mask, body_mask) in enumerate(masks):
+            self.dof_masks[clip], self.body_masks[clip] = dof_mask, body_mask
+        self.durations = np.array([motion.duration for motion in self.motions])
+        self.num_frames = sum(motion.num_frames for motion in self.motions)
+
+    @property
+    def num_clips(self) -> int:
+        """Number of clips of the shard."""
+        return len(self.motions)
+
+    @property
+    def dof_names(self) -> list[str]:
+        """Canonical skeleton DOF names."""
+        return self._dof_names
+
+    @property
+    def body_names(self) -> list[str]:
+        """Canonical skeleton rigid body names."""
+        return self._body_names
+
+    @property
+    def num_dofs(self) -> int:
+        """Number of canonical skeleton's DOFs."""
+        return len(self._dof_names)
+
+    @property
+    def num_bodies(self) -> int:
+        """Number of canonical skeleton's rigid bodies."""
+        return len(self._body_names)
+
+    def sample_clips(self, num_samples: int) -> np.ndarray:
+        """Sample random clips of the shard, with their sampling weights.
+
+        Args:
+            num_samples: Number of clips to sample.
+
+        Raises:
+            AssertionError: If the shard has no clip to sample.
+
+        Returns:
+            The clip indexes, in the shard.
+        """
+        assert self._probabilities is not None, f"The shard of rank {self.rank} has no clip to sample"
+        return np.random.choice(self.num_clips, size=num_samples, p=self._probabilities)
+
+    def sample_times(self, clip_indexes: np.ndarray) -> np.ndarray:
+        """Sample random times of clips uniformly.
+
+        Args:
+            clip_indexes: The clip indexes, in the shard.
+
+        Returns:
+            Time samples, between 0 and the clip durations.
+        """
+        return self.durations[clip_indexes] * np.random.uniform(low=0.0, high=1.0, size=len(clip_indexes))
+
+    def sample_masks(self, clip_indexes: np.ndarray) -> tuple[torch.Tensor, torch.Tensor]:
+        """Get the masks of the DOFs and bodies present in the clips of samples.
+
+        Args:
+            clip_indexes: The clip of each sample, as indexes in the shard.
+
+        Returns:
+            The DOF masks (with shape (N, num_dofs)) and body masks (with shape (N, num_bodies)).
+        """
+        clip_indexes = torch.as_tensor(clip_indexes, dtype=torch.long, device=self.dof_masks.device)
+        return self.dof_masks[clip_indexes], self.body_masks[clip_indexes]
+
+    def sample(
+        self,
+        clip_indexes: np.ndarray,
+        times: Optional[np.ndarray] = None,
+        augmentation: Optional[MotionAugmentation] = None,
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Sample clips (see :meth:`MotionLoader.sample`).
+
+        The samples are grouped by clip, and each clip is sampled once for all its samples.
+
+        Args:
+            clip_indexes: The clip of each sample, as indexes in the shard (see :meth:`sample_clips`).
+            times: Clip times used for sampling. If not defined, the clips are random sampled uniformly in time.
+            augmentation: Per-sample augmentation applied to the sampled data.
+
+        Returns:
+            The sampled DOF positions, DOF velocities, body positions, body rotations, body linear velocities
+            and body angular velocities (see :meth:`MotionLoader.sample`).
+        """
+        clip_indexes = np.asarray(clip_indexes)
+        if times is None:
+            times = self.sample_times(clip_indexes)
+        elif augmentation is not None and augmentation.time_scale is not None:
+            times = times * augmentation.time_scale.cpu().numpy()
+
+        # samples sorted by clip, and the range of the samples of each sampled clip
+        order = np.argsort(clip_indexes, kind="stable")
+        clips, starts = np.unique(clip_indexes[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        if len(clips) == 1:
+            samples = self.motions[clips[0]].sample(0, times=times)
+        else:
+            samples = None
+            for clip, start, end in zip(clips, starts, ends):
+                selected = order[start:end]
+                clip_samples = self.motions[clip].sample(0, times=times[selected])
+                if samples is None:
+                    samples = tuple(values.new_empty((len(order), *values.shape[1:])) for values in clip_samples)
+                selected = torch.as_tensor(selected, device=clip_samples[0].device)
+                for values, clip_values in zip(samples, clip_samples):
+                    values[selected] = clip_values
+
+        if augmentation is None:
+            return samples
+        mirroring = self.motions[0]._get_mirroring() if augmentation.mirror is not None else {}
+        return augmentation.apply(*samples, **mirroring)
@@ -3,10 +3,26 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import asyncio
 import numpy as np
 import os
 import torch
-from typing import Optional
+import warnings
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Generator, Optional
+
+try:
+    from .augmentation import MotionAugmentation
+    from .features import FEATURE_FIELDS, load_features
+    from .mapping import mirror_dof_signs, mirror_indices
+    from .motion_io import load_motion_data
+    from .shared_motion import SharedMotionData
+except ImportError:
+    from augmentation import MotionAugmentation
+    from features import FEATURE_FIELDS, load_features
+    from mapping import mirror_dof_signs, mirror_indices
+    from motion_io import load_motion_data
+    from shared_motion import SharedMotionData
 
 
 class MotionLoader:
@@ -14,38 +30,180 @@ class MotionLoader:
     Helper class to load and sample motion data from NumPy-file format.
     """
 
-    def __init__(self, motion_file: str, device: torch.device) -> None:
+    def __init__(
+        self,
+        motion_file: str,
+        device: torch.device,
+        num_workers: int | None = None,
+        features: bool = False,
+        feature_kwargs: Optional[dict] = None,
+        derive_velocities: bool = False,
+        interpolation: str = "linear",
+    ) -> None:
         """Load a motion file and initialize the internal variables.
 
         Args:
             motion_file: Motion file path to load.
             device: The device to which to load the data.
+            num_workers: Number of threads used to decompress compressed motion files.
+                Defaults to the number of CPUs.
+            features: Whether to load the derived features of the motion (see :mod:`~poselib_v2.features`),
+                which can then be sampled with :meth:`sample_features`. The features are read from the sidecar
+                file of the motion, and only computed if it is missing or out of date.
+            feature_kwargs: The feature extraction parameters (see :func:`~poselib_v2.features.compute_features`).
+            derive_velocities: Whether to drop the stored velocities, and compute the velocities of the sampled
+                frames from their neighboring frames instead (see :meth:`_derive_velocities`). This halves
+                the memory used by the motion, for a few extra operations per sample.
+            interpolation: The interpolation of the positions and rotations between frames, ``linear``
+                (lerp / slerp) or ``hermite`` (cubic Hermite spline using the stored velocities as tangents,
+                see :meth:`_hermite`), which tracks fast motions stored at a lower frame rate.
 
         Raises:
             AssertionError: If the specified motion file doesn't exist.
         """
         assert os.path.isfile(motion_file), f"Invalid file path: {motion_file}"
-        data = np.load(motion_file)
+        data = load_motion_data(motion_file, num_workers=num_workers)
+        self._set_data(data, device, derive_velocities, interpolation)
 
-        self.device = device
-        self._dof_names = data["dof_names"].tolist()
-        self._body_names = data["body_names"].tolist()
-
-        self.dof_positions = torch.tensor(data["dof_positions"], dtype=torch.float32, device=self.device)
-        self.dof_velocities = torch.tensor(data["dof_velocities"], dtype=torch.float32, device=self.device)
-        self.body_positions = torch.tensor(data["body_positions"], dtype=torch.float32, device=self.device)
-        self.body_rotations = torch.tensor(data["body_rotations"], dtype=torch.float32, device=self.device)
-        self.body_linear_velocities = torch.tensor(
-            data["body_linear_velocities"], dtype=torch.float32, device=self.device
-        )
-        self.body_angular_velocities = torch.tensor(
-            data["body_angular_velocities"], dtype=torch.float32, device=self.device
-        )
+        if features:
+            sidecar = load_features(motion_file, **(feature_kwargs or {}))
+            self.foot_bodies = sidecar["foot_bodies"].tolist()
+            self.features = {name: torch.tensor(sidecar[name], device=self.device) for name in FEATURE_FIELDS}
+        print(f"Motion loaded ({motion_file}): duration: {self.duration} sec, frames: {self.num_frames}")
+
+    @classmethod
+    def load_async(
+        cls, motion_file: str, device: torch.device, executor: Optional[Executor] = None, **kwargs
+    ) -> "MotionLoaderHandle":
+        """Load a motion file in the background, without blocking the caller.
+
+        The file is decoded on a background thread (the decompression and the tensor conversions release
+        the GIL), while the caller goes on with its initialization (e.g. building the simulator).
+
+        Args:
+            motion_file: Motion file path to load.
+            device: The device to which to load the data.
+            executor: The executor loading the motion. Defaults to a thread pool shared by the loaders.
+            kwargs: The other arguments of :meth:`__init__`.
+
+        Returns:
+            The handle of the motion loader. Its attributes are the attributes of the loader, waiting for
+            the loading to complete on first access. The loader can also be waited for explicitly, with
+            ``handle.result()`` or ``await handle``.
+        """
+        executor = _loading_executor() if executor is None else executor
+        return MotionLoaderHandle(executor.submit(cls, motion_file, device, **kwargs))
+
+    @classmethod
+    def from_data(
+        cls, motion_data: dict, device: torch.device, derive_velocities: bool = False, interpolation: str = "linear"
+    ) -> "MotionLoader":
+        """Create a motion loader from motion data already in memory.
 
-        self.dt = 1.0 / data["fps"]
+        On CPU, the tensors share the memory of the float32 arrays of the motion data, without copying them.
+
+        Args:
+            motion_data: The motion data (see :func:`~poselib_v2.motion_io.load_motion_data`).
+            device: The device to which to load the data.
+            derive_velocities: Whether to compute the velocities at sample time (see :meth:`__init__`).
+            interpolation: The interpolation between frames (see :meth:`__init__`).
+
+        Returns:
+            The motion loader.
+        """
+        loader = cls.__new__(cls)
+        loader._set_data(motion_data, device, derive_velocities, interpolation)
+        return loader
+
+    @classmethod
+    def from_shared(
+        cls,
+        shared: SharedMotionData | str,
+        device: torch.device,
+        derive_velocities: bool = False,
+        interpolation: str = "linear",
+    ) -> "MotionLoader":
+        """Create a motion loader from shared motion data (see :class:`~poselib_v2.shared_motion.SharedMotionData`).
+
+        On CPU, the tensors map the shared memory directly: the motion data is not copied, and the memory used
+        does not grow with the number of processes. The tensors are read-only, and must not be modified in place.
+
+        Args:
+            shared: The shared motion data, or the name of its shared memory block to attach to.
+                The loader closes the handles it attached itself, see :meth:`close`.
+            device: The device to which to load the data.
+            derive_velocities: Whether to compute the velocities at sample time (see :meth:`__init__`).
+            interpolation: The interpolation between frames (see :meth:`__init__`).
+
+        Returns:
+            The motion loader.
+        """
+        attached = isinstance(shared, str)
+        if attached:
+            shared = SharedMotionData.attach(shared)
+        loader = cls.__new__(cls)
+        # tensors created from the (read-only) shared arrays, writing into them is not supported
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+            loader._set_data(shared.arrays, device, derive_velocities, interpolation)
+        loader._shared = shared if attached else None
+        return loader
+
+    def close(self) -> None:
+        """Close the shared motion data attached by :meth:`from_shared`, if any."""
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def _set_data(
+        self, data: dict, device: torch.device, derive_velocities: bool = False, interpolation: str = "linear"
+    ) -> None:
+        """Initialize the internal variables from motion data.
+
+        Args:
+            data: The motion data.
+            device: The device to which to load the data.
+            derive_velocities: Whether to drop the stored velocities (they are computed at sample time).
+            interpolation: The interpolation between frames, ``linear`` or ``hermite``.
+        """
+        assert interpolation in ("linear", "hermite"), f"Invalid interpolation: {interpolation}"
+        assert not (
+            derive_velocities and interpolation == "hermite"
+        ), "Hermite interpolation requires the stored velocities"
+        self.device = device
+        self.derive_velocities = derive_velocities
+        self.interpolation = interpolation
+        self._dof_names = np.asarray(data["dof_names"]).tolist()
+        self._body_names = np.asarray(data["body_names"]).tolist()
+
+        self.dof_positions = torch.as_tensor(data["dof_positions"], dtype=torch.float32, device=self.device)
+        self.body_positions = torch.as_tensor(data["body_positions"], dtype=torch.float32, device=self.device)
+        self.body_rotations = torch.as_tensor(data["body_rotations"], dtype=torch.float32, device=self.device)
+        if derive_velocities:
+            self.dof_velocities = None
+            self.body_linear_velocities = None
+            self.body_angular_velocities = None
+        else:
+            self.dof_velocities = torch.as_tensor(data["dof_velocities"], dtype=torch.float32, device=self.device)
+            self.body_linear_velocities = torch.as_tensor(
+                data["body_linear_velocities"], dtype=torch.float32, device=self.device
+            )
+            self.body_angular_velocities = torch.as_tensor(
+                data["body_angular_velocities"], dtype=torch.float32, device=self.device
+            )
+
+        self.dt = 1.0 / float(np.asarray(data["fps"]).reshape(-1)[0])
         self.num_frames = self.dof_positions.shape[0]
         self.duration = self.dt * (self.num_frames - 1)
-        print(f"Motion loaded ({motion_file}): duration: {self.duration} sec, frames: {self.num_frames}")
+        # non-uniform frames (e.g. decimated motion, see :mod:`~poselib_v2.decimation`)
+        self.frame_times = None
+        if "frame_times" in data:
+            assert not derive_velocities, "Velocities can't be derived from non-uniform frames"
+            self.frame_times = torch.as_tensor(data["frame_times"], dtype=torch.float64, device=self.device)
+            self.duration = float(data["frame_times"][-1])
+        self._mirroring = None  # left/right pairing, resolved on the first mirrored sample
+        self._shared = None
+        self.features = {}
 
     @property
     def dof_names(self) -> list[str]:
@@ -158,10 +316,86 @@ class MotionLoader:
         new_q = torch.where(torch.abs(cos_half_theta) >= 1, q0, new_q)
         return new_q
 
+    def _hermite(
+        self,
+        values: torch.Tensor,
+        tangents: torch.Tensor,
+        *,
+        blend: torch.Tensor,
+        start: np.ndarray,
+        end: np.ndarray,
+        duration: torch.Tensor | float,
+    ) -> torch.Tensor:
+        """Cubic Hermite interpolation between frames, using the velocities as tangents.
+
+        Args:
+            values: The values of the frames. Shape is (F, X) or (F, M, X).
+            tangents: The time derivatives of the values (velocities). Shape is (F, X) or (F, M, X).
+            blend: Interpolation coefficient between 0 (first frame) and 1 (second frame).
+            start: Indexes of the first frames.
+            end: Indexes of the second frames.
+            duration: Time between the first and second frames, in seconds.
+
+        Returns:
+            Interpolated values. Shape is (N, X) or (N, M, X).
+        """
+        weights = self._hermite_weights(blend, duration, values.ndim)
+        first = weights[0] * values[start] + weights[1] * tangents[start]
+        return first + weights[2] * values[end] + weights[3] * tangents[end]
+
+    def _hermite_rotations(
+        self, *, blend: torch.Tensor, start: np.ndarray, end: np.ndarray, duration: torch.Tensor | float
+    ) -> torch.Tensor:
+        """Cubic Hermite interpolation between frame rotations, in the tangent space of the first rotation.
+
+        The rotation from the first frame is interpolated as a rotation vector, from zero to the relative
+        rotation between the frames, with the angular velocities (world frame) as tangents.
+
+        Args:
+            blend: Interpolation coefficient between 0 (first frame) and 1 (second frame).
+            start: Indexes of the first frames.
+            end: Indexes of the second frames.
+            duration: Time between the first and second frames, in seconds.
+
+        Returns:
+            Interpolated body rotations (wxyz). Shape is (N, M, 4).
+        """
+        q0 = self.body_rotations[start]
+        weights = self._hermite_weights(blend, duration, q0.ndim)
+        rotvec = (
+            weights[1] * self.body_angular_velocities[start]
+            + weights[2] * _quat_to_rotvec(_quat_mul(self.body_rotations[end], _quat_conjugate(q0)))
+            + weights[3] * self.body_angular_velocities[end]
+        )
+        return _quat_mul(_rotvec_to_quat(rotvec), q0)
+
+    @staticmethod
+    def _hermite_weights(
+        blend: torch.Tensor, duration: torch.Tensor | float, ndim: int
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Weights of the first value, first tangent, second value and second tangent of cubic Hermite splines"""
+        if isinstance(duration, torch.Tensor):
+            duration = duration.to(blend.dtype)
+        for _ in range(ndim - 1):
+            blend = blend.unsqueeze(-1)
+            if isinstance(duration, torch.Tensor):
+                duration = duration.unsqueeze(-1)
+        blend_2 = blend * blend
+        blend_3 = blend_2 * blend
+        return (
+            2.0 * blend_3 - 3.0 * blend_2 + 1.0,
+            (blend_3 - 2.0 * blend_2 + blend) * duration,
+            3.0 * blend_2 - 2.0 * blend_3,
+            (blend_3 - blend_2) * duration,
+        )
+
     def _compute_frame_blend(self, times: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
         """Compute the indexes of the first and second values, as well as the blending time
         to interpolate between them and the given times.
 
+        With non-uniform frames (:attr:`frame_times`), the frames surrounding each time are searched
+        in the frame times on the device, and tensors are returned.
+
         Args:
             times: Times, between 0 and motion duration, to sample motion values.
                 Specified times will be clipped to fall within the range of the motion duration.
@@ -169,8 +403,15 @@ class MotionLoader:
         Returns:
             First value indexes, Second value indexes, and blending time between 0 (first value) and 1 (second value).
         """
+        if self.frame_times is not None:
+            times = torch.as_tensor(times, dtype=torch.float64, device=self.device).clamp(0.0, self.duration)
+            index_1 = torch.searchsorted(self.frame_times, times, right=True).clamp(1, self.num_frames - 1)
+            index_0 = index_1 - 1
+            time_0, time_1 = self.frame_times[index_0], self.frame_times[index_1]
+            blend = ((times - time_0) / (time_1 - time_0)).clamp(0.0, 1.0)
+            return index_0, index_1, blend
         phase = np.clip(times / self.duration, 0.0, 1.0)
-        index_0 = (phase * (self.num_frames - 1)).round(decimals=0).astype(int)
+        index_0 = np.floor(phase * (self.num_frames - 1)).astype(int)
         index_1 = np.minimum(index_0 + 1, self.num_frames - 1)
         blend = ((times - index_0 * self.dt) / self.dt).round(decimals=5)
         return index_0, index_1, blend
@@ -196,7 +437,11 @@ class MotionLoader:
         return duration * np.random.uniform(low=0.0, high=1.0, size=num_samples)
 
     def sample(
-        self, num_samples: int, times: Optional[np.ndarray] = None, duration: float | None = None
+        self,
+        num_samples: int,
+        times: Optional[np.ndarray] = None,
+        duration: float | None = None,
+        augmentation: Optional[MotionAugmentation] = None,
     ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         """Sample motion data.
 
@@ -207,25 +452,139 @@ class MotionLoader:
             duration: Maximum motion duration to sample.
                 If not defined, samples will be within the range of the motion duration.
                 If ``times`` is defined, this parameter is ignored.
+            augmentation: Per-sample augmentation applied to the sampled data. If the augmentation has
+                a time scale, the given ``times`` are times of the time-scaled motion.
 
         Returns:
             Sampled motion DOF positions (with shape (N, num_dofs)), DOF velocities (with shape (N, num_dofs)),
             body positions (with shape (N, num_bodies, 3)), body rotations (with shape (N, num_bodies, 4), as wxyz quaternion),
             body linear velocities (with shape (N, num_bodies, 3)) and body angular velocities (with shape (N, num_bodies, 3)).
         """
-        times = self.sample_times(num_samples, duration) if times is None else times
+        if times is None:
+            times = self.sample_times(num_samples, duration)
+        elif augmentation is not None and augmentation.time_scale is not None:
+            times = times * augmentation.time_scale.cpu().numpy()
         index_0, index_1, blend = self._compute_frame_blend(times)
-        blend = torch.tensor(blend, dtype=torch.float32, device=self.device)
+        blend = torch.as_tensor(blend, dtype=torch.float32, device=self.device)
+
+        if self.derive_velocities:
+            dof_velocities, body_linear_velocities, body_angular_velocities = self._derive_velocities(
+                index_0, index_1, blend
+            )
+        else:
+            dof_velocities = self._interpolate(self.dof_velocities, blend=blend, start=index_0, end=index_1)
+            body_linear_velocities = self._interpolate(
+                self.body_linear_velocities, blend=blend, start=index_0, end=index_1
+            )
+            body_angular_velocities = self._interpolate(
+                self.body_angular_velocities, blend=blend, start=index_0, end=index_1
+            )
+        if self.interpolation == "hermite":
+            duration = self.dt if self.frame_times is None else self.frame_times[index_1] - self.frame_times[index_0]
+            frames = {"blend": blend, "start": index_0, "end": index_1, "duration": duration}
+            dof_positions = self._hermite(self.dof_positions, self.dof_velocities, **frames)
+            body_positions = self._hermite(self.body_positions, self.body_linear_velocities, **frames)
+            body_rotations = self._hermite_rotations(**frames)
+        else:
+            dof_positions = self._interpolate(self.dof_positions, blend=blend, start=index_0, end=index_1)
+            body_positions = self._interpolate(self.body_positions, blend=blend, start=index_0, end=index_1)
+            body_rotations = self._slerp(self.body_rotations, blend=blend, start=index_0, end=index_1)
+        samples = (
+            dof_positions,
+            dof_velocities,
+            body_positions,
+            body_rotations,
+            body_linear_velocities,
+            body_angular_velocities,
+        )
+        if augmentation is None:
+            return samples
+        mirroring = self._get_mirroring() if augmentation.mirror is not None else {}
+        return augmentation.apply(*samples, **mirroring)
+
+    def _derive_velocities(
+        self, index_0: np.ndarray, index_1: np.ndarray, blend: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Compute the velocities of sampled frames from the neighboring frames.
+
+        The velocity of each of the two frames interpolated is computed by backward difference with its
+        previous frame (the first frame of the motion has zero velocity), as done when the motion is built.
+        The angular velocities are computed from the relative rotations between the frames.
+
+        Args:
+            index_0: First frame indexes.
+            index_1: Second frame indexes.
+            blend: Interpolation coefficient between 0 (first frame) and 1 (second frame).
+
+        Returns:
+            The interpolated DOF velocities, body linear velocities and body angular velocities.
+        """
+        indexes = np.concatenate([index_0, index_1])
+        previous = np.maximum(indexes - 1, 0)
+        num_samples = len(index_0)
+
+        dof_velocities = (self.dof_positions[indexes] - self.dof_positions[previous]) / self.dt
+        body_linear_velocities = (self.body_positions[indexes] - self.body_positions[previous]) / self.dt
+        # rotation vector of q * q_previous^-1
+        relative = _quat_mul(self.body_rotations[indexes], _quat_conjugate(self.body_rotations[previous]))
+        body_angular_velocities = _quat_to_rotvec(relative) / self.dt
 
         return (
-            self._interpolate(self.dof_positions, blend=blend, start=index_0, end=index_1),
-            self._interpolate(self.dof_velocities, blend=blend, start=index_0, end=index_1),
-            self._interpolate(self.body_positions, blend=blend, start=index_0, end=index_1),
-            self._slerp(self.body_rotations, blend=blend, start=index_0, end=index_1),
-            self._interpolate(self.body_linear_velocities, blend=blend, start=index_0, end=index_1),
-            self._interpolate(self.body_angular_velocities, blend=blend, start=index_0, end=index_1),
+            self._interpolate(dof_velocities[:num_samples], b=dof_velocities[num_samples:], blend=blend),
+            self._interpolate(
+                body_linear_velocities[:num_samples], b=body_linear_velocities[num_samples:], blend=blend
+            ),
+            self._interpolate(
+                body_angular_velocities[:num_samples], b=body_angular_velocities[num_samples:], blend=blend
+            ),
         )
 
+    def sample_features(self, times: np.ndarray, names: Optional[list[str]] = None) -> dict[str, torch.Tensor]:
+        """Sample the derived features of the motion.
+
+        Continuous features are linearly interpolated, and the ``contacts`` are taken from the nearest frame.
+
+        Args:
+            times: Motion time used for sampling.
+            names: The features to sample. Defaults to all the loaded features.
+
+        Raises:
+            AssertionError: If the features were not loaded.
+
+        Returns:
+            The sampled features, with shape (N, ...).
+        """
+        assert self.features, "The features were not loaded, use MotionLoader(..., features=True)"
+        index_0, index_1, blend = self._compute_frame_blend(times)
+        samples = {}
+        for name in self.features if names is None else names:
+            values = self.features[name]
+            if values.dtype == torch.bool:
+                nearest = blend < 0.5
+                if isinstance(nearest, torch.Tensor):
+                    samples[name] = values[torch.where(nearest, index_0, index_1)]
+                else:
+                    samples[name] = values[np.where(nearest, index_0, index_1)]
+            else:
+                blend_tensor = torch.as_tensor(blend, dtype=values.dtype, device=self.device)
+                samples[name] = self._interpolate(values, blend=blend_tensor, start=index_0, end=index_1)
+        return samples
+
+    def _get_mirroring(self) -> dict[str, torch.Tensor]:
+        """Get the left/right pairing of the bodies and DOFs used to mirror samples.
+
+        Raises:
+            ValueError: If a body or DOF has no mirrored counterpart.
+        """
+        if self._mirroring is None:
+            self._mirroring = {
+                "body_mirror_indices": torch.tensor(mirror_indices(self._body_names), dtype=torch.long),
+                "dof_mirror_indices": torch.tensor(mirror_indices(self._dof_names), dtype=torch.long),
+                "dof_mirror_signs": torch.tensor(mirror_dof_signs(self._dof_names)),
+            }
+            self._mirroring = {key: value.to(self.device) for key, value in self._mirroring.items()}
+        return self._mirroring
+
     def get_dof_index(self, dof_names: list[str]) -> list[int]:
         """Get skeleton DOFs indexes by DOFs names.
 
@@ -262,6 +621,159 @@ class MotionLoader:
             indexes.append(self._body_names.index(name))
         return indexes
 
+    def remap_skeleton(
+        self, dof_names: list[str], body_names: list[str], foot_bodies: Optional[list[str]] = None
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """Reorder the DOFs and bodies of the motion to the ones of another skeleton, in place.
+
+        The motion fields are gathered once with precomputed index tensors, so the motion is then sampled
+        directly in the given skeleton. The DOFs and bodies missing from the motion are filled with zeros
+        (identity rotations), and the ones not in the given skeleton are dropped. If the skeletons already
+        match, the motion is not copied.
+
+        The loaded features are remapped as well: the per-body ``root_local_positions`` like the body fields,
+        and the ``contacts`` to the given foot bodies (no contact for the foot bodies missing from the motion).
+        The root features stay the ones of the root body of the motion.
+
+        Args:
+            dof_names: The DOF names of the skeleton.
+            body_names: The body names of the skeleton.
+            foot_bodies: The foot bodies of the ``contacts`` features. Defaults to the foot bodies of the motion
+                which are in the skeleton.
+
+        Returns:
+            The masks of the DOFs and bodies of the skeleton present in the motion.
+        """
+        dof_indexes = [self._dof_names.index(name) if name in self._dof_names else -1 for name in dof_names]
+        body_indexes = [self._body_names.index(name) if name in self._body_names else -1 for name in body_names]
+        dof_mask = torch.tensor([index >= 0 for index in dof_indexes], dtype=torch.bool, device=self.device)
+        body_mask = torch.tensor([index >= 0 for index in body_indexes], dtype=torch.bool, device=self.device)
+
+        def gather(values: Optional[torch.Tensor], indexes: list[int], mask: torch.Tensor, fill: float | list[float]):
+            if values is None:
+                return None
+            index = torch.tensor(indexes, dtype=torch.long, device=self.device).clamp(min=0)
+            gathered = values.index_select(1, index)
+            if not mask.all():
+                fill = torch.tensor(fill, dtype=values.dtype, device=self.device)
+                gathered[:, ~mask] = fill
+            return gathered
+
+        if list(dof_names) != self._dof_names:
+            self.dof_positions = gather(self.dof_positions, dof_indexes, dof_mask, 0.0)
+            self.dof_velocities = gather(self.dof_velocities, dof_indexes, dof_mask, 0.0)
+            self._dof_names = list(dof_names)
+            self._mirroring = None
+        if list(body_names) != self._body_names:
+            self.body_positions = gather(self.body_positions, body_indexes, body_mask, [0.0, 0.0, 0.0])
+            self.body_rotations = gather(self.body_rotations, body_indexes, body_mask, [1.0, 0.0, 0.0, 0.0])
+            self.body_linear_velocities = gather(self.body_linear_velocities, body_indexes, body_mask, [0.0] * 3)
+            self.body_angular_velocities = gather(self.body_angular_velocities, body_indexes, body_mask, [0.0] * 3)
+            if self.features:
+                self.features["root_local_positions"] = gather(
+                    self.features["root_local_positions"], body_indexes, body_mask, [0.0] * 3
+                )
+            self._body_names = list(body_names)
+            self._mirroring = None
+        if self.features:
+            if foot_bodies is None:
+                foot_bodies = [name for name in self.foot_bodies if name in body_names]
+            if list(foot_bodies) != self.foot_bodies:
+                foot_indexes = [
+                    self.foot_bodies.index(name) if name in self.foot_bodies else -1 for name in foot_bodies
+                ]
+                foot_mask = torch.tensor([index >= 0 for index in foot_indexes], dtype=torch.bool, device=self.device)
+                self.features["contacts"] = gather(self.features["contacts"], foot_indexes, foot_mask, False)
+                self.foot_bodies = list(foot_bodies)
+        return dof_mask, body_mask
+
+
+class MotionLoaderHandle:
+    """
+    Handle of a motion loader loading in the background (see :meth:`MotionLoader.load_async`).
+
+    Accessing an attribute of the loader (e.g. ``handle.sample(...)`` or ``handle.duration``) waits for the
+    loading to complete, and raises the loading error if it failed.
+    """
+
+    def __init__(self, future: Future) -> None:
+        self.future = future
+
+    def done(self) -> bool:
+        """Whether the loading is complete."""
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> MotionLoader:
+        """Wait for the loading to complete.
+
+        Args:
+            timeout: Maximum time to wait, in seconds. Defaults to no limit.
+
+        Raises:
+            TimeoutError: If the loading is not complete after ``timeout`` seconds.
+
+        Returns:
+            The motion loader.
+        """
+        return self.future.result(timeout)
+
+    def __await__(self) -> Generator[Any, None, MotionLoader]:
+        return asyncio.wrap_future(self.future).__await__()
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for the attributes not defined by the handle itself
+        if name == "future":
+            raise AttributeError(name)
+        return getattr(self.result(), name)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _loading_executor() -> ThreadPoolExecutor:
+    """Get the thread pool shared by the motion loaders loading in the background"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(thread_name_prefix="motion_loading")
+    return _executor
+
+
+def _quat_mul(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
+    """Product of (wxyz) quaternions"""
+    aw, ax, ay, az = a.unbind(-1)
+    bw, bx, by, bz = b.unbind(-1)
+    return torch.stack(
+        [
+            aw * bw - ax * bx - ay * by - az * bz,
+            aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+        ],
+        dim=-1,
+    )
+
+
+def _quat_conjugate(q: torch.Tensor) -> torch.Tensor:
+    """Conjugate (inverse rotation) of (wxyz) unit quaternions"""
+    return q * q.new_tensor([1.0, -1.0, -1.0, -1.0])
+
+
+def _quat_to_rotvec(q: torch.Tensor) -> torch.Tensor:
+    """Rotation vectors of (wxyz) unit quaternions, along the shortest path"""
+    q = torch.where(q[..., :1] < 0, -q, q)
+    sin_half = torch.linalg.norm(q[..., 1:], dim=-1, keepdim=True)
+    angle = 2.0 * torch.atan2(sin_half, q[..., :1])
+    scale = torch.where(sin_half > 1e-8, angle / sin_half.clamp_min(1e-8), torch.full_like(angle, 2.0))
+    return scale * q[..., 1:]
+
+
+def _rotvec_to_quat(rotvec: torch.Tensor) -> torch.Tensor:
+    """(wxyz) unit quaternions of rotation vectors"""
+    angle = torch.linalg.norm(rotvec, dim=-1, keepdim=True)
+    # sin(angle / 2) / angle, with its limit for small angles
+    scale = torch.where(angle > 1e-8, torch.sin(0.5 * angle) / angle.clamp_min(1e-8), torch.full_like(angle, 0.5))
+    return torch.cat([torch.cos(0.5 * angle), scale * rotvec], dim=-1)
+
 
 if __name__ == "__main__":
     import argparse
@@ -0,0 +1,236 @@
+"""
+Headless (offscreen) rendering of motions.
+
+Frames are rendered with the Agg backend on a process pool, so reviewing a dataset of motions
+can be run as a batch job on a CPU node.
+"""
+
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+try:
+    from .motion_io import read_motion_info
+    from .motion_viewer import MotionViewer
+except ImportError:
+    from motion_io import read_motion_info
+    from motion_viewer import MotionViewer
+
+
+def _create_offscreen_viewer(motion_file: str, viewer_kwargs: dict, figsize: tuple[float, float]) -> MotionViewer:
+    """Create a motion viewer drawing into an offscreen Agg figure"""
+    viewer = MotionViewer(motion_file, **viewer_kwargs)
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    viewer.create_figure(figure)
+    return viewer
+
+
+def _render_image(viewer: MotionViewer, frame: int) -> np.ndarray:
+    """Render a motion frame into an RGB image"""
+    viewer.draw_frame(frame)
+    canvas = viewer._figure.canvas
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+
+def _render_frame_range(
+    motion_file: str,
+    output_dir: str,
+    start: int,
+    end: int,
+    viewer_kwargs: dict,
+    figsize: tuple[float, float],
+) -> list[str]:
+    """Render a range of frames to PNG files (worker process)"""
+    viewer = _create_offscreen_viewer(motion_file, viewer_kwargs, figsize)
+    files = []
+    for frame in range(start, end):
+        file = os.path.join(output_dir, f"frame_{frame:06d}.png")
+        Image.fromarray(_render_image(viewer, frame)).save(file)
+        files.append(file)
+    return files
+
+
+def render_frames(
+    motion_file: str,
+    output_dir: str,
+    start: int = 0,
+    end: int | None = None,
+    num_workers: int | None = None,
+    figsize: tuple[float, float] = (6.4, 4.8),
+    **viewer_kwargs,
+) -> list[str]:
+    """Render the frames of a motion to PNG files.
+
+    The frame range is split into contiguous segments rendered in parallel by a process pool.
+
+    Args:
+        motion_file: Motion file path to render.
+        output_dir: Directory of the rendered frames (``frame_<index>.png``).
+        start: First frame to render.
+        end: Frame after the last one to render. If not defined, frames are rendered until the end of the motion.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+        figsize: Figure size, in inches.
+        viewer_kwargs: Additional :class:`MotionViewer` arguments (e.g. ``render_scene``, ``show_frames``).
+
+    Returns:
+        The rendered files, in frame order.
+    """
+    num_workers = num_workers or os.cpu_count()
+    if end is None:
+        end = read_motion_info(motion_file)["num_frames"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    bounds = np.linspace(start, end, num=min(num_workers, max(end - start, 1)) + 1).round().astype(int)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(_render_frame_range, motion_file, output_dir, a, b, viewer_kwargs, figsize)
+            for a, b in zip(bounds[:-1], bounds[1:])
+            if b > a
+        ]
+        return [file for future in futures for file in future.result()]
+
+
+def render_animation(
+    motion_file: str,
+    output_file: str,
+    num_workers: int | None = None,
+    figsize: tuple[float, float] = (6.4, 4.8),
+    **viewer_kwargs,
+) -> None:
+    """Render a motion to an animation file.
+
+    The frames are rendered in parallel (see :func:`render_frames`), then assembled into a GIF with Pillow,
+    or into any other format (e.g. MP4) with ``ffmpeg``.
+
+    Args:
+        motion_file: Motion file path to render.
+        output_file: The animation file (``.gif``, or any format supported by ``ffmpeg``).
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+        figsize: Figure size, in inches.
+        viewer_kwargs: Additional :class:`MotionViewer` arguments (e.g. ``render_scene``, ``show_frames``).
+
+    Raises:
+        RuntimeError: If ``ffmpeg`` is needed and cannot be found.
+    """
+    fps = float(read_motion_info(motion_file)["fps"])
+    use_gif = output_file.lower().endswith(".gif")
+    if not use_gif and shutil.which("ffmpeg") is None:
+        msg = f"ffmpeg is required to write {output_file}, use a .gif output instead."
+        raise RuntimeError(msg)
+
+    with tempfile.TemporaryDirectory() as frame_dir:
+        files = render_frames(motion_file, frame_dir, num_workers=num_workers, figsize=figsize, **viewer_kwargs)
+        if use_gif:
+            images = [Image.open(file) for file in files]
+            images[0].save(
+                output_file, save_all=True, append_images=images[1:], duration=1000 / fps, loop=0, optimize=False
+            )
+        else:
+            command = ["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps)]
+            command += ["-i", os.path.join(frame_dir, "frame_%06d.png"), "-pix_fmt", "yuv420p", output_file]
+            subprocess.run(command, check=True)
+    print(f"Animation saved to {output_file}")
+
+
+def _render_contact_sheet(
+    motion_file: str,
+    output_file: str,
+    num_thumbnails: int,
+    columns: int,
+    viewer_kwargs: dict,
+    thumbnail_size: tuple[float, float],
+) -> str:
+    """Render the contact sheet of one motion (worker process)"""
+    viewer = _create_offscreen_viewer(motion_file, viewer_kwargs, thumbnail_size)
+    frames = np.linspace(0, viewer._num_frames - 1, num=num_thumbnails).round().astype(int)
+    thumbnails = [_render_image(viewer, frame) for frame in frames]
+
+    # tile the thumbnails, padding the last row with white
+    rows = -(-len(thumbnails) // columns)
+    thumbnails += [np.full_like(thumbnails[0], 255)] * (rows * columns - len(thumbnails))
+    sheet = np.concatenate(
+        [np.concatenate(thumbnails[row * columns : (row + 1) * columns], axis=1) for row in range(rows)], axis=0
+    )
+    Image.fromarray(sheet).save(output_file)
+    return output_file
+
+
+def render_contact_sheets(
+    motion_files: list[str],
+    output_dir: str,
+    num_thumbnails: int = 8,
+    columns: int = 4,
+    num_workers: int | None = None,
+    thumbnail_size: tuple[float, float] = (3.2, 2.4),
+    **viewer_kwargs,
+) -> list[str]:
+    """Render a tiled thumbnail contact sheet for each motion, in parallel over the motions.
+
+    Args:
+        motion_files: Motion file paths to render.
+        output_dir: Directory of the contact sheets (``<motion name>.png``).
+        num_thumbnails: Number of thumbnails per motion, evenly spaced in time.
+        columns: Number of thumbnails per row.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+        thumbnail_size: Thumbnail size, in inches.
+        viewer_kwargs: Additional :class:`MotionViewer` arguments (e.g. ``render_scene``, ``show_frames``).
+
+    Returns:
+        The contact sheet files, in the order of the motion files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                _render_contact_sheet,
+                motion_file,
+                os.path.join(output_dir, os.path.splitext(os.path.basename(motion_file))[0] + ".png"),
+                num_thumbnails,
+                columns,
+                viewer_kwargs,
+                thumbnail_size,
+            )
+            for motion_file in motion_files
+        ]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Motion file to render")
+    parser.add_argument("--dataset-dir", type=str, default=None, help="Directory of motion files (contact sheets)")
+    parser.add_argument("--output", type=str, required=True, help="Frame directory, animation file or sheet directory")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--thumbnails", type=int, default=8, help="Number of thumbnails per contact sheet")
+    parser.add_argument("--columns", type=int, default=4, help="Number of thumbnails per contact sheet row")
+    parser.add_argument("--render-scene", action="store_true", default=False, help="Render the whole scene")
+    parser.add_argument("--show-velocity", action="store_true", default=False, help="Show velocity vectors")
+    parser.add_argument("--show-frames", type=str, nargs="*", default=[], help="Bodies whose frames are shown")
+    args, _ = parser.parse_known_args()
+
+    kwargs = {"render_scene": args.render_scene, "show_velocity": args.show_velocity, "show_frames": args.show_frames}
+    if args.dataset_dir:
+        files = sorted(glob.glob(os.path.join(args.dataset_dir, "**", "*.npz"), recursive=True))
+        sheets = render_contact_sheets(
+            files, args.output, num_thumbnails=args.thumbnails, columns=args.columns, num_workers=args.workers, **kwargs
+        )
+        print(f"Rendered {len(sheets)} contact sheets to {args.output}")
+    else:
+        assert args.file, "Either --file or --dataset-dir is required"
+        if os.path.splitext(args.output)[1]:
+            render_animation(args.file, args.output, num_workers=args.workers, **kwargs)
+        else:
+            files = render_frames(args.file, args.output, num_workers=args.workers, **kwargs)
+            print(f"Rendered {len(files)} frames to {args.output}")
@@ -3,6 +3,8 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import time
+
 import matplotlib
 import matplotlib.animation
 import matplotlib.pyplot as plt
@@ -10,13 +12,41 @@ import numpy as np
 import torch
 
 import mpl_toolkits.mplot3d  # noqa: F401
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 
 try:
+    from .math_utils import quat_to_matrix
     from .motion_loader import MotionLoader
 except ImportError:
+    from math_utils import quat_to_matrix
     from motion_loader import MotionLoader
 
 
+def _arrow_segments(origins: np.ndarray, vectors: np.ndarray, head_ratio: float) -> np.ndarray:
+    """Compute the line segments of 3D arrows (shaft and two head strokes), like ``Axes3D.quiver`` does.
+
+    Args:
+        origins: Arrow tails. Shape is (N, 3).
+        vectors: Arrow vectors. Shape is (N, 3).
+        head_ratio: Length of the arrow head relative to the arrow length.
+
+    Returns:
+        The segments of the arrows. Shape is (3 * N, 2, 3).
+    """
+    tips = origins + vectors
+    # the head strokes lie in the plane of the arrow and of a horizontal direction perpendicular to it
+    normals = np.cross(vectors, [0.0, 0.0, 1.0])
+    norms = np.linalg.norm(normals, axis=-1, keepdims=True)
+    normals = np.where(norms > 1e-9, normals / np.maximum(norms, 1e-9), [1.0, 0.0, 0.0])
+    back = -head_ratio * np.cos(np.radians(15)) * vectors
+    side = head_ratio * np.sin(np.radians(15)) * np.linalg.norm(vectors, axis=-1, keepdims=True) * normals
+    return np.concatenate([
+        np.stack([origins, tips], axis=1),
+        np.stack([tips, tips + back + side], axis=1),
+        np.stack([tips, tips + back - side], axis=1),
+    ])
+
+
 class MotionViewer:
     """
     Helper class to visualize motion data from NumPy-file format.
@@ -29,6 +59,8 @@ class MotionViewer:
         show_velocity: bool = False,
         show_frames: list[str] = [],
         device: torch.device | str = "cpu",
+        realtime: bool = False,
+        playback_speed: float = 1.0,
     ) -> None:
         """Load a motion file and initialize the internal variables.
 
@@ -37,6 +69,10 @@ class MotionViewer:
             device: The device to which to load the data.
             render_scene: Whether the scene (space occupied by the skeleton during movement)
                 is rendered instead of a reduced view of the skeleton.
+            realtime: Whether the playback is synchronized with the wall clock. The pose is interpolated
+                at the current motion time, and frames are skipped when drawing falls behind.
+                Otherwise, every stored frame is shown, one per drawing callback.
+            playback_speed: Initial playback speed of the real-time playback.
 
         Raises:
             AssertionError: If the specified motion file doesn't exist.
@@ -45,7 +81,6 @@ class MotionViewer:
         self._figure_axes = None
         self._render_scene = render_scene
         self._show_velocity = show_velocity
-        self._show_frames = show_frames
 
         # drawing parameters
         self._velocity_scale = 0.2  # Scale factor for velocity arrows
@@ -54,133 +89,228 @@ class MotionViewer:
         # load motions
         self._motion_loader = MotionLoader(motion_file=motion_file, device=device)
 
+        # resolve the bodies whose frames are shown once
+        self._show_frame_indices = np.array(self._motion_loader.get_body_index(show_frames), dtype=int)
         self._num_frames = self._motion_loader.num_frames
         self._current_frame = 0
         self._body_positions = self._motion_loader.body_positions.cpu().numpy()
         self._body_linear_velocities = self._motion_loader.body_linear_velocities.cpu().numpy()
         self._body_rotations = self._motion_loader.body_rotations.cpu().numpy()
 
+        # the scene limits do not depend on the frame, compute them once
+        minimum = np.min(self._body_positions.reshape(-1, 3), axis=0)
+        maximum = np.max(self._body_positions.reshape(-1, 3), axis=0)
+        self._scene_center = 0.5 * (maximum + minimum)
+        self._scene_diff = 0.75 * (maximum - minimum)
+
+        # persistent artists, created in show()
+        self._skeleton_artist = None
+        self._ground_artist = None
+        self._title_artist = None
+        self._stats_artist = None
+        self._frame_artists = []
+        self._velocity_artist = None
+        self._overlay_artists = []
+
+        # real-time playback state
+        self._realtime = realtime
+        self._playback_speed = playback_speed
+        self._playback_time = 0.0
+        self._paused = False
+        self._last_wall_time = None
+        self._frame_clock = 0.0  # number of stored frames played, used to count the dropped frames
+        self._dropped_frames = 0
+        self._achieved_fps = 0.0
+
         print("\nBody")
         for i, name in enumerate(self._motion_loader.body_names):
             minimum = np.min(self._body_positions[:, i], axis=0).round(decimals=2)
             maximum = np.max(self._body_positions[:, i], axis=0).round(decimals=2)
             print(f"  |-- [{name}] minimum position: {minimum}, maximum position: {maximum}")
 
-    def _quaternion_to_rotation_matrix(self, q):
-        """Convert quaternion (w, x, y, z) to rotation matrix"""
-        w, x, y, z = q
-        return np.array([
-            [1 - 2*y*y - 2*z*z, 2*(x*y - w*z), 2*(x*z + w*y)],
-            [2*(x*y + w*z), 1 - 2*x*x - 2*z*z, 2*(y*z - w*x)],
-            [2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*x*x - 2*y*y]
-        ])
-
-    def _drawing_callback(self, frame: int) -> None:
-        """Drawing callback called each frame"""
-        # get current motion frame
-        # get data
+    def _create_artists(self) -> None:
+        """Create the persistent artists, which are then updated in place every frame"""
         vertices = self._body_positions[self._current_frame]
-        velocities = self._body_linear_velocities[self._current_frame]
-        rotations = self._body_rotations[self._current_frame]
-        # draw skeleton state
-        self._figure_axes.clear()
-
-        # Draw keypoints as dots
-        self._figure_axes.scatter(*vertices.T, color="black", depthshade=False)
-
-        # Draw coordinate frames for specified bodies
-        for name in self._show_frames:
-            idx = self._motion_loader.body_names.index(name)
-            frame_pos = vertices[idx]
-            quat = rotations[idx]  # (w, x, y, z)
-
-            # Convert quaternion to rotation matrix
-            R = self._quaternion_to_rotation_matrix(quat)
-
-            # Define unit vectors for X, Y, Z axes
-            x_axis = np.array([1, 0, 0])
-            y_axis = np.array([0, 1, 0])
-            z_axis = np.array([0, 0, 1])
-
-            # Rotate the axes using the rotation matrix
-            x_rotated = R @ x_axis
-            y_rotated = R @ y_axis
-            z_rotated = R @ z_axis
-
-            # Scale the rotated axes
-            x_rotated *= self._frame_length
-            y_rotated *= self._frame_length
-            z_rotated *= self._frame_length
-
-            # Draw X-axis (red)
-            self._figure_axes.quiver(
-                frame_pos[0], frame_pos[1], frame_pos[2],
-                x_rotated[0], x_rotated[1], x_rotated[2],
-                color='red', arrow_length_ratio=0.2)
-            # Draw Y-axis (green)
-            self._figure_axes.quiver(
-                frame_pos[0], frame_pos[1], frame_pos[2],
-                y_rotated[0], y_rotated[1], y_rotated[2],
-                color='green', arrow_length_ratio=0.2)
-            # Draw Z-axis (blue)
-            self._figure_axes.quiver(
-                frame_pos[0], frame_pos[1], frame_pos[2],
-                z_rotated[0], z_rotated[1], z_rotated[2],
-                color='blue', arrow_length_ratio=0.2)
-
-        # Draw velocity vectors for all points
-        for i, (pos, vel) in enumerate(zip(vertices, velocities)):
-            # Only draw velocity if it's not zero
-            if np.linalg.norm(vel) > 1e-6:
-                self._figure_axes.quiver(
-                    pos[0], pos[1], pos[2],
-                    vel[0] * self._velocity_scale, vel[1] * self._velocity_scale, vel[2] * self._velocity_scale,
-                    color="orange", alpha=0.7, arrow_length_ratio=0.3
-                )
-
-        # adjust exes according to motion view
-        # - scene
+        # keypoints as dots
+        self._skeleton_artist = self._figure_axes.scatter(*vertices.T, color="black", depthshade=False)
+        # ground plane
+        x, y = np.meshgrid([-1.0, 1.0], [-1.0, 1.0])
+        self._ground_artist = self._figure_axes.plot_surface(x, y, np.zeros_like(x), color="green", alpha=0.2)
+        # metadata
+        self._figure_axes.set_xlabel("X")
+        self._figure_axes.set_ylabel("Y")
+        self._figure_axes.set_zlabel("Z")
+        self._title_artist = self._figure_axes.set_title("")
+        self._stats_artist = self._figure_axes.text2D(
+            0.0, 0.0, "", transform=self._figure_axes.transAxes, fontsize="small", family="monospace"
+        )
+        # overlays, one line collection per category
+        self._overlay_artists = []
+        if len(self._show_frame_indices):
+            self._frame_artists = [Line3DCollection([], colors=color) for color in ["red", "green", "blue"]]
+            self._overlay_artists += self._frame_artists
+        if self._show_velocity:
+            self._velocity_artist = Line3DCollection([], colors="orange", alpha=0.7)
+            self._overlay_artists.append(self._velocity_artist)
+        for artist in self._overlay_artists:
+            self._figure_axes.add_collection3d(artist, autolim=False)
+
+        # the view of the scene is fixed
         if self._render_scene:
-            # compute axes limits
-            minimum = np.min(self._body_positions.reshape(-1, 3), axis=0)
-            maximum = np.max(self._body_positions.reshape(-1, 3), axis=0)
-            center = 0.5 * (maximum + minimum)
-            diff = 0.75 * (maximum - minimum)
+            self._set_view(self._scene_center, self._scene_diff)
+
+    def _set_view(self, center: np.ndarray, diff: np.ndarray) -> None:
+        """Set the axes limits and move the ground plane accordingly"""
+        self._figure_axes.set_xlim((center[0] - diff[0], center[0] + diff[0]))
+        self._figure_axes.set_ylim((center[1] - diff[1], center[1] + diff[1]))
+        self._figure_axes.set_zlim((center[2] - diff[2], center[2] + diff[2]))
+        self._figure_axes.set_box_aspect(aspect=diff / diff[0])
+        x0, x1 = center[0] - diff[0], center[0] + diff[0]
+        y0, y1 = center[1] - diff[1], center[1] + diff[1]
+        self._ground_artist.set_verts([[(x0, y0, 0.0), (x1, y0, 0.0), (x1, y1, 0.0), (x0, y1, 0.0)]])
+
+    def _draw_overlays(self, vertices: np.ndarray, velocities: np.ndarray, rotations: np.ndarray) -> None:
+        """Update the body coordinate frames and velocity vectors of the current frame"""
+        # coordinate frames of the specified bodies: the rotation matrix columns are the rotated X, Y, Z axes
+        if len(self._show_frame_indices):
+            axes = quat_to_matrix(rotations[self._show_frame_indices]) * self._frame_length
+            origins = vertices[self._show_frame_indices]
+            for axis, artist in enumerate(self._frame_artists):
+                artist.set_segments(_arrow_segments(origins, axes[:, :, axis], head_ratio=0.2))
+
+        # velocity vectors of all the bodies which are moving
+        if self._show_velocity:
+            moving = np.linalg.norm(velocities, axis=-1) > 1e-6
+            self._velocity_artist.set_segments(
+                _arrow_segments(vertices[moving], velocities[moving] * self._velocity_scale, head_ratio=0.3)
+            )
+
+    def _draw_pose(
+        self, vertices: np.ndarray, velocities: np.ndarray, rotations: np.ndarray
+    ) -> list[matplotlib.artist.Artist]:
+        """Update the artists to show a skeleton pose"""
+        # update skeleton state
+        self._skeleton_artist._offsets3d = tuple(vertices.T)
+        self._draw_overlays(vertices, velocities, rotations)
+
+        # adjust exes according to motion view (the scene view is fixed)
         # - skeleton
-        else:
+        if not self._render_scene:
             # compute axes limits
             minimum = np.min(vertices, axis=0)
             maximum = np.max(vertices, axis=0)
             center = 0.5 * (maximum + minimum)
             diff = np.array([0.75 * np.max(maximum - minimum).item()] * 3)
-        # scale view
-        self._figure_axes.set_xlim((center[0] - diff[0], center[0] + diff[0]))
-        self._figure_axes.set_ylim((center[1] - diff[1], center[1] + diff[1]))
-        self._figure_axes.set_zlim((center[2] - diff[2], center[2] + diff[2]))
-        self._figure_axes.set_box_aspect(aspect=diff / diff[0])
-        # plot ground plane
-        x, y = np.meshgrid([center[0] - diff[0], center[0] + diff[0]], [center[1] - diff[1], center[1] + diff[1]])
-        self._figure_axes.plot_surface(x, y, np.zeros_like(x), color="green", alpha=0.2)
+            self._set_view(center, diff)
+        return [self._skeleton_artist, self._title_artist, self._stats_artist, *self._overlay_artists]
+
+    def _drawing_callback(self, frame: int) -> list[matplotlib.artist.Artist]:
+        """Drawing callback called each frame"""
+        # get current motion frame
+        # get data
+        vertices = self._body_positions[self._current_frame]
+        velocities = self._body_linear_velocities[self._current_frame]
+        rotations = self._body_rotations[self._current_frame]
+        artists = self._draw_pose(vertices, velocities, rotations)
+
         # print metadata
-        self._figure_axes.set_xlabel("X")
-        self._figure_axes.set_ylabel("Y")
-        self._figure_axes.set_zlabel("Z")
-        self._figure_axes.set_title(f"frame: {self._current_frame}/{self._num_frames}")
+        self._title_artist.set_text(f"frame: {self._current_frame}/{self._num_frames}")
         # increase frame counter
         self._current_frame += 1
         if self._current_frame >= self._num_frames:
             self._current_frame = 0
+        return artists
+
+    def _realtime_callback(self, frame: int) -> list[matplotlib.artist.Artist]:
+        """Drawing callback of the real-time playback, showing the pose at the current motion time"""
+        now = time.perf_counter()
+        elapsed = 0.0 if self._last_wall_time is None else now - self._last_wall_time
+        self._last_wall_time = now
+        if elapsed > 0.0:
+            self._achieved_fps = 0.9 * self._achieved_fps + 0.1 / elapsed if self._achieved_fps else 1.0 / elapsed
+
+        # advance the motion time with the wall clock
+        if not self._paused:
+            self._playback_time = (self._playback_time + elapsed * self._playback_speed) % self._motion_loader.duration
+            # every stored frame passed since the last drawing, but the shown one, is dropped
+            previous_frame_clock = self._frame_clock
+            self._frame_clock += elapsed * abs(self._playback_speed) / self._motion_loader.dt
+            self._dropped_frames += max(int(self._frame_clock) - int(previous_frame_clock) - 1, 0)
+
+        # sample the (interpolated) pose
+        _, _, body_positions, body_rotations, body_linear_velocities, _ = self._motion_loader.sample(
+            num_samples=1, times=np.array([self._playback_time])
+        )
+        artists = self._draw_pose(
+            body_positions[0].cpu().numpy(),
+            body_linear_velocities[0].cpu().numpy(),
+            body_rotations[0].cpu().numpy(),
+        )
+
+        # print metadata
+        state = "paused" if self._paused else f"{self._playback_speed:g}x"
+        self._title_artist.set_text(f"time: {self._playback_time:.2f}/{self._motion_loader.duration:.2f} s ({state})")
+        self._stats_artist.set_text(
+            f"fps: {self._achieved_fps:5.1f}/{1.0 / self._motion_loader.dt:.0f}, dropped frames: {self._dropped_frames}"
+            "\n[space] pause, [left/right] scrub, [up/down] speed"
+        )
+        return artists
+
+    def _on_key_press(self, event: matplotlib.backend_bases.KeyEvent) -> None:
+        """Handle the playback controls of the real-time playback"""
+        # scrub by one second, or by one frame when paused
+        step = self._motion_loader.dt if self._paused else 1.0
+        if event.key == " ":
+            self._paused = not self._paused
+        elif event.key == "right":
+            self._playback_time = min(self._playback_time + step, self._motion_loader.duration)
+        elif event.key == "left":
+            self._playback_time = max(self._playback_time - step, 0.0)
+        elif event.key == "up":
+            self._playback_speed *= 2.0
+        elif event.key == "down":
+            self._playback_speed /= 2.0
+
+    def create_figure(self, figure: matplotlib.figure.Figure | None = None) -> matplotlib.figure.Figure:
+        """Create the 3D figure and its persistent artists.
+
+        Args:
+            figure: The figure to draw into. If not defined, a new pyplot figure is created.
+
+        Returns:
+            The figure.
+        """
+        self._figure = plt.figure() if figure is None else figure
+        self._figure_axes = self._figure.add_subplot(projection="3d")
+        self._create_artists()
+        return self._figure
+
+    def draw_frame(self, frame: int) -> list[matplotlib.artist.Artist]:
+        """Update the figure to show a given motion frame.
+
+        Args:
+            frame: The motion frame index.
+
+        Returns:
+            The updated artists.
+        """
+        self._current_frame = frame
+        return self._drawing_callback(frame)
 
     def show(self) -> None:
         """Show motion"""
         # create a 3D figure
-        self._figure = plt.figure()
-        self._figure_axes = self._figure.add_subplot(projection="3d")
+        self.create_figure()
+        if self._realtime:
+            self._figure.canvas.mpl_connect("key_press_event", self._on_key_press)
         # matplotlib animation (the instance must live as long as the animation will run)
+        # blitting only redraws the artists, it requires a fixed view
         self._animation = matplotlib.animation.FuncAnimation(
             fig=self._figure,
-            func=self._drawing_callback,
-            frames=self._num_frames,
+            func=self._realtime_callback if self._realtime else self._drawing_callback,
+            frames=None if self._realtime else self._num_frames,
             interval=1000 * self._motion_loader.dt,
+            blit=self._render_scene and self._figure.canvas.supports_blit,
+            cache_frame_data=False,
         )
         plt.show()
@@ -0,0 +1,173 @@
+"""
+Root-relative observation features of sampled motion data (e.g. for AMP discriminators or tracking rewards).
+
+The world-frame body states are expressed in the heading frame of the root body (the frame rotated by
+the yaw of the root and centered on it), and written into one flat observation tensor per sample.
+"""
+
+from typing import Optional
+
+import torch
+
+
+OBSERVATION_FEATURES = (
+    "root_height",
+    "dof_positions",
+    "dof_velocities",
+    "body_positions",
+    "body_rotations",
+    "body_linear_velocities",
+    "body_angular_velocities",
+)
+
+
+class ObservationBuilder:
+    """
+    Batched builder of root-relative observations.
+
+    The observation of a sample is the concatenation of the selected features, in the following order:
+
+    - ``root_height``: height of the root body (1 value).
+    - ``dof_positions`` and ``dof_velocities``: the DOF states (D values each).
+    - ``body_positions``: body positions relative to the root, in the root heading frame (3 values per body).
+    - ``body_rotations``: body rotations in the root heading frame, as the tangent (X axis) and normal (Z axis)
+      vectors of the rotation matrix (6 values per body).
+    - ``body_linear_velocities`` and ``body_angular_velocities``: body velocities in the root heading frame
+      (3 values per body each).
+    """
+
+    def __init__(
+        self,
+        body_names: list[str],
+        num_dofs: int,
+        bodies: Optional[list[str]] = None,
+        root_body: Optional[str] = None,
+        features: tuple[str, ...] = OBSERVATION_FEATURES,
+    ) -> None:
+        """
+        Args:
+            body_names: The body names of the motion data.
+            num_dofs: The number of DOFs of the motion data.
+            bodies: The bodies whose states are observed. Defaults to all the bodies.
+            root_body: The body defining the heading frame. Defaults to the first body.
+            features: The features of the observation, from :data:`OBSERVATION_FEATURES`.
+
+        Raises:
+            ValueError: If a body or a feature doesn't exist.
+        """
+        bodies = body_names if bodies is None else bodies
+        root_body = body_names[0] if root_body is None else root_body
+        for name in [*bodies, root_body]:
+            if name not in body_names:
+                msg = f"The body {name} doesn't exist: {body_names}"
+                raise ValueError(msg)
+        for feature in features:
+            if feature not in OBSERVATION_FEATURES:
+                msg = f"Invalid observation feature {feature}, expected one of {OBSERVATION_FEATURES}"
+                raise ValueError(msg)
+
+        self.body_indices = [body_names.index(name) for name in bodies]
+        self.root_index = body_names.index(root_body)
+        self.num_dofs = num_dofs
+
+        # feature sizes, kept in the canonical order
+        sizes = {
+            "root_height": 1,
+            "dof_positions": num_dofs,
+            "dof_velocities": num_dofs,
+            "body_positions": 3 * len(bodies),
+            "body_rotations": 6 * len(bodies),
+            "body_linear_velocities": 3 * len(bodies),
+            "body_angular_velocities": 3 * len(bodies),
+        }
+        self.slices: dict[str, slice] = {}
+        start = 0
+        for feature in OBSERVATION_FEATURES:
+            if feature in features:
+                self.slices[feature] = slice(start, start + sizes[feature])
+                start += sizes[feature]
+        self.observation_dim = start
+
+    def allocate(self, num_samples: int, device: torch.device | str = "cpu") -> torch.Tensor:
+        """Allocate an observation buffer, to be filled by :meth:`build`.
+
+        Args:
+            num_samples: Number of samples.
+            device: The device of the buffer.
+
+        Returns:
+            The buffer. Shape is (N, observation_dim).
+        """
+        return torch.empty(num_samples, self.observation_dim, dtype=torch.float32, device=device)
+
+    def build(
+        self,
+        dof_positions: torch.Tensor,
+        dof_velocities: torch.Tensor,
+        body_positions: torch.Tensor,
+        body_rotations: torch.Tensor,
+        body_linear_velocities: torch.Tensor,
+        body_angular_velocities: torch.Tensor,
+        out: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Build the observations of sampled motion data (e.g. ``builder.build(*motion.sample(N))``).
+
+        Args:
+            dof_positions: DOF positions. Shape is (N, num_dofs).
+            dof_velocities: DOF velocities. Shape is (N, num_dofs).
+            body_positions: Body positions. Shape is (N, num_bodies, 3).
+            body_rotations: Body rotations, as wxyz quaternions. Shape is (N, num_bodies, 4).
+            body_linear_velocities: Body linear velocities. Shape is (N, num_bodies, 3).
+            body_angular_velocities: Body angular velocities. Shape is (N, num_bodies, 3).
+            out: Preallocated observation buffer (see :meth:`allocate`). If not defined, a new one is allocated.
+
+        Returns:
+            The observations. Shape is (N, observation_dim).
+        """
+        num_samples = body_positions.shape[0]
+        if out is None:
+            out = self.allocate(num_samples, body_positions.device)
+        slices = self.slices
+
+        # heading (yaw) of the root, from the rotated X axis of its rotation
+        w, x, y, z = body_rotations[:, self.root_index].unbind(-1)
+        heading_x = 1.0 - 2.0 * (y * y + z * z)
+        heading_y = 2.0 * (x * y + w * z)
+        norm = torch.sqrt(heading_x * heading_x + heading_y * heading_y).clamp_min(1e-9)
+        # rotation by the opposite of the heading
+        cos = (heading_x / norm).unsqueeze(-1)
+        sin = (heading_y / norm).unsqueeze(-1)
+
+        if "root_height" in slices:
+            out[:, slices["root_height"]] = body_positions[:, self.root_index, 2:3]
+        if "dof_positions" in slices:
+            out[:, slices["dof_positions"]] = dof_positions
+        if "dof_velocities" in slices:
+            out[:, slices["dof_velocities"]] = dof_velocities
+
+        if "body_positions" in slices:
+            positions = body_positions[:, self.body_indices] - body_positions[:, self.root_index : self.root_index + 1]
+            _unheading(positions, cos, sin, out[:, slices["body_positions"]].unflatten(-1, (-1, 3)))
+        if "body_rotations" in slices:
+            w, x, y, z = body_rotations[:, self.body_indices].unbind(-1)
+            tangent_normal = out[:, slices["body_rotations"]].unflatten(-1, (-1, 6))
+            # first (tangent) and last (normal) columns of the rotation matrices
+            tangent = torch.stack([1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y + w * z), 2.0 * (x * z - w * y)], dim=-1)
+            normal = torch.stack([2.0 * (x * z + w * y), 2.0 * (y * z - w * x), 1.0 - 2.0 * (x * x + y * y)], dim=-1)
+            _unheading(tangent, cos, sin, tangent_normal[..., :3])
+            _unheading(normal, cos, sin, tangent_normal[..., 3:])
+        if "body_linear_velocities" in slices:
+            velocities = body_linear_velocities[:, self.body_indices]
+            _unheading(velocities, cos, sin, out[:, slices["body_linear_velocities"]].unflatten(-1, (-1, 3)))
+        if "body_angular_velocities" in slices:
+            velocities = body_angular_velocities[:, self.body_indices]
+            _unheading(velocities, cos, sin, out[:, slices["body_angular_velocities"]].unflatten(-1, (-1, 3)))
+        return out
+
+
+def _unheading(vectors: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor, out: torch.Tensor) -> None:
+    """Rotate vectors of shape (N, M, 3) by the opposite of the (N, 1) heading angles, into ``out``"""
+    x, y, z = vectors.unbind(-1)
+    out[..., 0] = cos * x + sin * y
+    out[..., 1] = cos * y - sin * x
+    out[..., 2] = z
@@ -0,0 +1,388 @@
+"""
+Nearest-neighbor index of the poses of a dataset of motions (e.g. to find transition points between clips,
+or to initialize environments near a given state).
+
+Each frame of the motions is described by root-relative features (see
+:class:`~poselib_v2.observations.ObservationBuilder`), normalized per dimension over the dataset.
+Queries are answered in batches, by chunked matrix products against the indexed frames. Optionally, the
+frames are clustered by k-means, and each query only searches the frames of its nearest clusters
+(approximate, sublinear search).
+"""
+
+import contextlib
+import glob
+import json
+import os
+import tempfile
+from typing import Optional
+
+import numpy as np
+import torch
+
+try:
+    from .motion_io import load_motion_data
+    from .observations import ObservationBuilder
+except ImportError:
+    from motion_io import load_motion_data
+    from observations import ObservationBuilder
+
+
+# default pose features of the index, see :data:`~poselib_v2.observations.OBSERVATION_FEATURES`
+POSE_FEATURES = ("body_positions", "body_rotations", "body_linear_velocities")
+
+
+class PoseIndex:
+    """
+    Nearest-neighbor index of the frames of motions.
+
+    Use :meth:`build` to index motion files, :meth:`encode` to compute the features of query poses
+    (e.g. ``index.encode(*motion.sample(N))``), and :meth:`search` to find their nearest indexed frames.
+    """
+
+    def __init__(
+        self,
+        builder: ObservationBuilder,
+        config: dict,
+        features: torch.Tensor,
+        clip_indices: torch.Tensor,
+        times: torch.Tensor,
+        mean: torch.Tensor,
+        std: torch.Tensor,
+        centroids: Optional[torch.Tensor] = None,
+        cluster_offsets: Optional[torch.Tensor] = None,
+    ) -> None:
+        """Use :meth:`build` or :meth:`load` instead."""
+        self.builder = builder
+        self.config = config
+        self.motion_files: list[str] = config["motion_files"]
+        self.features = features
+        self.clip_indices = clip_indices
+        self.times = times
+        self.mean = mean
+        self.std = std
+        self.centroids = centroids
+        self.cluster_offsets = cluster_offsets
+        self.device = features.device
+        # squared norms of the indexed features, for the distances computed by matrix products
+        self._norms = (features * features).sum(dim=-1)
+
+    @property
+    def num_frames(self) -> int:
+        """Number of indexed frames."""
+        return self.features.shape[0]
+
+    @property
+    def num_clusters(self) -> int:
+        """Number of clusters of the indexed frames (0 if the frames are not clustered)."""
+        return 0 if self.centroids is None else self.centroids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        motion_files: list[str],
+        bodies: Optional[list[str]] = None,
+        root_body: Optional[str] = None,
+        features: tuple[str, ...] = POSE_FEATURES,
+        num_clusters: int = 0,
+        device: torch.device | str = "cpu",
+        chunk_frames: int = 65536,
+        seed: int = 0,
+    ) -> "PoseIndex":
+        """Index the frames of motion files.
+
+        Args:
+            motion_files: The motion files. They must share the same skeleton.
+            bodies: The bodies whose states are indexed. Defaults to all the bodies.
+            root_body: The body defining the heading frame. Defaults to the first body.
+            features: The pose features, from :data:`~poselib_v2.observations.OBSERVATION_FEATURES`.
+            num_clusters: Number of k-means clusters of the frames, for the approximate search.
+                If 0, the frames are not clustered.
+            device: The device of the index.
+            chunk_frames: Number of frames whose features are computed at once.
+            seed: The seed of the k-means initialization.
+
+        Raises:
+            ValueError: If the motions don't share the same skeleton, or if a body or a feature doesn't exist.
+
+        Returns:
+            The index.
+        """
+        builder, skeleton = None, None
+        chunks, clip_indices, times = [], [], []
+        for clip_index, motion_file in enumerate(motion_files):
+            motion_data = load_motion_data(motion_file)
+            names = (np.asarray(motion_data["body_names"]).tolist(), np.asarray(motion_data["dof_names"]).tolist())
+            if builder is None:
+                skeleton = names
+                builder = ObservationBuilder(skeleton[0], len(skeleton[1]), bodies, root_body, features)
+            elif names != skeleton:
+                msg = f"The skeleton of {motion_file} differs from the skeleton of {motion_files[0]}"
+                raise ValueError(msg)
+
+            num_frames = motion_data["dof_positions"].shape[0]
+            fps = float(np.asarray(motion_data["fps"]).reshape(-1)[0])
+            frame_times = motion_data["frame_times"] if "frame_times" in motion_data else np.arange(num_frames) / fps
+            for start in range(0, num_frames, chunk_frames):
+                frames = slice(start, start + chunk_frames)
+                chunk = [
+                    torch.as_tensor(motion_data[name][frames], dtype=torch.float32, device=device)
+                    for name in (
+                        "dof_positions",
+                        "dof_velocities",
+                        "body_positions",
+                        "body_rotations",
+                        "body_linear_velocities",
+                        "body_angular_velocities",
+                    )
+                ]
+                chunks.append(builder.build(*chunk))
+            clip_indices.append(torch.full((num_frames,), clip_index, dtype=torch.int32))
+            times.append(torch.as_tensor(frame_times, dtype=torch.float32))
+
+        values = torch.cat(chunks)
+        del chunks
+        mean = values.mean(dim=0)
+        std = values.std(dim=0).clamp_min(1e-6)
+        values.sub_(mean).div_(std)
+        clip_indices = torch.cat(clip_indices).to(device)
+        times = torch.cat(times).to(device)
+
+        config = {
+            "motion_files": list(motion_files),
+            "body_names": skeleton[0],
+            "dof_names": skeleton[1],
+            "bodies": bodies,
+            "root_body": root_body,
+            "features": list(builder.slices),
+        }
+        centroids, cluster_offsets = None, None
+        if num_clusters > 0:
+            generator = torch.Generator(device=values.device).manual_seed(seed)
+            centroids, assignments = _kmeans(values, num_clusters, generator=generator)
+            # store the frames of each cluster contiguously
+            order = torch.argsort(assignments, stable=True)
+            values, clip_indices, times = values[order], clip_indices[order], times[order]
+            counts = torch.bincount(assignments, minlength=centroids.shape[0])
+            cluster_offsets = torch.cat([counts.new_zeros(1), torch.cumsum(counts, dim=0)])
+        return cls(builder, config, values, clip_indices, times, mean, std, centroids, cluster_offsets)
+
+    def encode(
+        self,
+        dof_positions: torch.Tensor,
+        dof_velocities: torch.Tensor,
+        body_positions: torch.Tensor,
+        body_rotations: torch.Tensor,
+        body_linear_velocities: torch.Tensor,
+        body_angular_velocities: torch.Tensor,
+    ) -> torch.Tensor:
+        """Compute the normalized features of poses (e.g. ``index.encode(*motion.sample(N))``).
+
+        Args:
+            dof_positions: DOF positions. Shape is (N, num_dofs).
+            dof_velocities: DOF velocities. Shape is (N, num_dofs).
+            body_positions: Body positions. Shape is (N, num_bodies, 3).
+            body_rotations: Body rotations, as wxyz quaternions. Shape is (N, num_bodies, 4).
+            body_linear_velocities: Body linear velocities. Shape is (N, num_bodies, 3).
+            body_angular_velocities: Body angular velocities. Shape is (N, num_bodies, 3).
+
+        Returns:
+            The features. Shape is (N, feature_dim).
+        """
+        samples = (
+            dof_positions,
+            dof_velocities,
+            body_positions,
+            body_rotations,
+            body_linear_velocities,
+            body_angular_velocities,
+        )
+        observations = self.builder.build(*[values.to(self.device, torch.float32) for values in samples])
+        return observations.sub_(self.mean).div_(self.std)
+
+    def search(
+        self, queries: torch.Tensor, k: int = 1, num_probes: Optional[int] = None, chunk_size: int = 8192
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Find the nearest indexed frames of query features.
+
+        Args:
+            queries: The query features (see :meth:`encode`). Shape is (Q, feature_dim).
+            k: Number of nearest frames per query.
+            num_probes: Number of nearest clusters searched per query, if the frames are clustered.
+                If not defined, or if the frames are not clustered, all the frames are searched (exact search).
+            chunk_size: Number of indexed frames compared to all the queries at once. The memory used is
+                proportional to ``Q * chunk_size``.
+
+        Returns:
+            The (Euclidean) distances of the nearest frames, sorted by distance, their clip indexes (in
+            :attr:`motion_files`) and their times in the clips. Shape is (Q, k) each. If fewer than ``k``
+            frames were searched, the missing neighbors have an infinite distance and a clip index of -1.
+        """
+        queries = queries.to(self.device, torch.float32)
+        best_distances = torch.full((queries.shape[0], k), torch.inf, device=self.device)
+        best_indices = torch.full((queries.shape[0], k), -1, dtype=torch.long, device=self.device)
+
+        if num_probes is None or self.centroids is None:
+            for start in range(0, self.num_frames, chunk_size):
+                end = min(start + chunk_size, self.num_frames)
+                distances = self._distances(queries, start, end)
+                best_distances, best_indices = _merge_top_k(best_distances, best_indices, distances, start)
+        else:
+            centroid_distances = torch.cdist(queries, self.centroids)
+            probes = torch.topk(centroid_distances, min(num_probes, self.num_clusters), largest=False).indices
+            offsets = self.cluster_offsets.tolist()
+            for cluster in torch.unique(probes).tolist():
+                start, end = offsets[cluster], offsets[cluster + 1]
+                if start == end:
+                    continue
+                query_indices = torch.nonzero((probes == cluster).any(dim=-1)).squeeze(-1)
+                for chunk_start in range(start, end, chunk_size):
+                    chunk_end = min(chunk_start + chunk_size, end)
+                    distances = self._distances(queries[query_indices], chunk_start, chunk_end)
+                    best_distances[query_indices], best_indices[query_indices] = _merge_top_k(
+                        best_distances[query_indices], best_indices[query_indices], distances, chunk_start
+                    )
+
+        # distances to the queries: add the squared norms of the queries, constant for the ranking
+        best_distances = (best_distances + (queries * queries).sum(dim=-1, keepdim=True)).clamp_min(0.0).sqrt()
+        found = best_indices >= 0
+        frames = best_indices.clamp_min(0)
+        clip_indices = torch.where(found, self.clip_indices[frames].long(), -1)
+        times = torch.where(found, self.times[frames], 0.0)
+        return best_distances, clip_indices, times
+
+    def _distances(self, queries: torch.Tensor, start: int, end: int) -> torch.Tensor:
+        """Squared distances between queries and indexed frames, minus the squared norms of the queries"""
+        return torch.addmm(self._norms[start:end].unsqueeze(0), queries, self.features[start:end].T, alpha=-2.0)
+
+    def save(self, index_file: str) -> None:
+        """Save the index to a file.
+
+        Args:
+            index_file: The index file (``.npz``).
+        """
+        arrays = {
+            "config": np.asarray(json.dumps(self.config)),
+            "features": self.features.cpu().numpy(),
+            "clip_indices": self.clip_indices.cpu().numpy(),
+            "times": self.times.cpu().numpy(),
+            "mean": self.mean.cpu().numpy(),
+            "std": self.std.cpu().numpy(),
+        }
+        if self.centroids is not None:
+            arrays["centroids"] = self.centroids.cpu().numpy()
+            arrays["cluster_offsets"] = self.cluster_offsets.cpu().numpy()
+        # write atomically, so concurrent jobs never read a partially written index, through a temporary file
+        # unique to this process, as several jobs may save the same index at once
+        fd, temporary_file = tempfile.mkstemp(
+            prefix=f"{os.path.basename(index_file)}.", suffix=".tmp", dir=os.path.dirname(index_file) or "."
+        )
+        try:
+            if os.name == "posix":
+                # mkstemp creates the file readable by its owner only
+                os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temporary_file, index_file)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary_file)
+            raise
+
+    @classmethod
+    def load(cls, index_file: str, device: torch.device | str = "cpu") -> "PoseIndex":
+        """Load an index saved with :meth:`save`.
+
+        Args:
+            index_file: The index file.
+            device: The device of the index.
+
+        Returns:
+            The index.
+        """
+        with np.load(index_file) as data:
+            config = json.loads(str(data["config"]))
+            tensors = {name: torch.as_tensor(data[name], device=device) for name in data.files if name != "config"}
+        builder = ObservationBuilder(
+            config["body_names"], len(config["dof_names"]), config["bodies"], config["root_body"], config["features"]
+        )
+        return cls(
+            builder,
+            config,
+            tensors["features"],
+            tensors["clip_indices"],
+            tensors["times"],
+            tensors["mean"],
+            tensors["std"],
+            tensors.get("centroids"),
+            tensors.get("cluster_offsets"),
+        )
+
+
+def _merge_top_k(
+    best_distances: torch.Tensor, best_indices: torch.Tensor, distances: torch.Tensor, offset: int
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Merge the (Q, m) distances to the frames ``offset:offset + m`` into the current (Q, k) nearest frames"""
+    k = best_distances.shape[1]
+    distances, indices = torch.topk(distances, min(k, distances.shape[1]), dim=-1, largest=False)
+    candidates = torch.cat([best_distances, distances], dim=-1)
+    candidate_indices = torch.cat([best_indices, indices + offset], dim=-1)
+    best_distances, order = torch.topk(candidates, k, dim=-1, largest=False)
+    return best_distances, torch.gather(candidate_indices, -1, order)
+
+
+def _kmeans(
+    features: torch.Tensor,
+    num_clusters: int,
+    iterations: int = 20,
+    chunk_size: int = 65536,
+    generator: Optional[torch.Generator] = None,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Cluster features by k-means (Lloyd iterations, initialized with random features).
+
+    Args:
+        features: The features. Shape is (N, D).
+        num_clusters: Number of clusters.
+        iterations: Number of Lloyd iterations.
+        chunk_size: Number of features assigned to the clusters at once.
+        generator: The random generator of the initialization.
+
+    Returns:
+        The centroids (with shape (num_clusters, D)) and the cluster of each feature (with shape (N,)).
+    """
+    num_clusters = min(num_clusters, features.shape[0])
+    initial = torch.randperm(features.shape[0], generator=generator, device=features.device)[:num_clusters]
+    centroids = features[initial].clone()
+    assignments = torch.empty(features.shape[0], dtype=torch.long, device=features.device)
+    for _ in range(iterations):
+        norms = (centroids * centroids).sum(dim=-1)
+        for start in range(0, features.shape[0], chunk_size):
+            chunk = features[start : start + chunk_size]
+            distances = torch.addmm(norms.unsqueeze(0), chunk, centroids.T, alpha=-2.0)
+            assignments[start : start + chunk_size] = distances.argmin(dim=-1)
+        counts = torch.bincount(assignments, minlength=num_clusters)
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, features)
+        # empty clusters keep their centroid
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty].unsqueeze(-1)
+    return centroids, assignments
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-dir", type=str, required=True, help="Directory of motion files to index")
+    parser.add_argument("--output", type=str, required=True, help="Index file")
+    parser.add_argument("--bodies", type=str, nargs="*", default=None, help="Indexed bodies")
+    parser.add_argument("--root-body", type=str, default=None, help="Body defining the heading frame")
+    parser.add_argument("--features", type=str, nargs="+", default=list(POSE_FEATURES), help="Pose features")
+    parser.add_argument("--clusters", type=int, default=0, help="Number of k-means clusters (approximate search)")
+    parser.add_argument("--device", type=str, default="cpu", help="Torch device")
+    args, _ = parser.parse_known_args()
+
+    files = sorted(glob.glob(os.path.join(args.dataset_dir, "**", "*.npz"), recursive=True))
+    index = PoseIndex.build(
+        files, args.bodies, args.root_body, tuple(args.features), num_clusters=args.clusters, device=args.device
+    )
+    index.save(args.output)
+    print(f"Indexed {index.num_frames} frames of {len(files)} motions ({index.num_clusters} clusters): {args.output}")
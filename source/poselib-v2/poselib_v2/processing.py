@@ -0,0 +1,287 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .math_utils import quat_conjugate, quat_mul, quat_to_rotvec, rotvec_to_quat
+    from .motion_io import load_motion_data, save_motion_data
+except ImportError:
+    from math_utils import quat_conjugate, quat_mul, quat_to_rotvec, rotvec_to_quat
+    from motion_io import load_motion_data, save_motion_data
+
+
+class MotionPostProcessor:
+    """
+    Post-processing of extracted motion frames.
+
+    The frames can be processed all at once or in consecutive chunks: the state needed at the chunk
+    boundaries (first frame offset, last positions and rotations) is carried over, so processing
+    in chunks gives the same result as processing the whole motion at once.
+    """
+
+    def __init__(self, fps: float, scaling_ratio: float = 1.0, cancel_offset: bool = True) -> None:
+        """
+        Args:
+            fps: The frame rate of the motion.
+            scaling_ratio: The scaling ratio applied to the body positions.
+            cancel_offset: Whether to cancel the global XY offset of the first frame.
+        """
+        self.dt = 1.0 / fps
+        self.scaling_ratio = scaling_ratio
+        self.cancel_offset = cancel_offset
+
+        self._offset = None
+        self._last_dof_positions = None
+        self._last_body_positions = None
+        self._last_body_rotations = None
+
+    def process(
+        self,
+        dof_positions: np.ndarray,
+        body_positions: np.ndarray,
+        body_rotations: np.ndarray,
+    ) -> dict[str, np.ndarray]:
+        """Process the next chunk of frames.
+
+        Args:
+            dof_positions: Joint positions. Shape is (F, D).
+            body_positions: Body world positions, before scaling. Shape is (F, B, 3).
+            body_rotations: Body world rotations, as (w, x, y, z) quaternions. Shape is (F, B, 4).
+
+        Returns:
+            The processed motion fields of the chunk: ``dof_positions``, ``dof_velocities``, ``body_positions``,
+            ``body_rotations``, ``body_linear_velocities`` and ``body_angular_velocities``.
+        """
+        body_positions = body_positions.astype(np.float32, copy=True)
+
+        # cancel first frame global offset
+        if self._offset is None:
+            self._offset = np.zeros(3, dtype=np.float32)
+            if self.cancel_offset:
+                self._offset[:2] = np.mean(body_positions[0, :, :2], axis=0)
+        body_positions -= self._offset
+
+        # in Blender, scaling the armature does not scale the retreived bone position, so we need to
+        # manually apply the scaling to the sampled data here.
+        body_positions *= self.scaling_ratio
+
+        # calculate velocities
+        dof_velocities, self._last_dof_positions = self._differentiate(dof_positions, self._last_dof_positions)
+        body_linear_velocities, self._last_body_positions = self._differentiate(
+            body_positions, self._last_body_positions
+        )
+
+        # calculate angular velocities, as the rotation vectors of q_t * q_{t-1}^-1 (world frame), the same
+        # convention as the smoothed motions and the velocities derived by the motion loader
+        body_rotations = body_rotations.astype(np.float64)
+        previous = body_rotations[:1] if self._last_body_rotations is None else self._last_body_rotations[None]
+        previous_rotations = np.concatenate([previous, body_rotations[:-1]])
+        relative_rotations = quat_mul(body_rotations, quat_conjugate(previous_rotations))
+        body_angular_velocities = quat_to_rotvec(relative_rotations) / self.dt
+        self._last_body_rotations = body_rotations[-1]
+
+        return {
+            "dof_positions": dof_positions.astype(np.float32),
+            "dof_velocities": dof_velocities.astype(np.float32),
+            "body_positions": body_positions,
+            "body_rotations": body_rotations.astype(np.float32),
+            "body_linear_velocities": body_linear_velocities.astype(np.float32),
+            "body_angular_velocities": body_angular_velocities.astype(np.float32),
+        }
+
+    def _differentiate(self, values: np.ndarray, last: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+        """Backward finite difference, the first frame of the motion has zero velocity.
+
+        Args:
+            values: The chunk values. Shape is (F, ...).
+            last: The last value of the previous chunk, or None for the first chunk.
+
+        Returns:
+            The derivatives of the chunk values and the last value of the chunk.
+        """
+        previous = values[:1] if last is None else last[None]
+        return np.diff(values, axis=0, prepend=previous) / self.dt, values[-1]
+
+
+def savgol_coefficients(window: int, polyorder: int) -> np.ndarray:
+    """Compute the Savitzky-Golay smoothing coefficients.
+
+    Args:
+        window: The window length, in frames. Must be odd.
+        polyorder: The order of the polynomial fitted over the window. Must be lower than ``window``.
+
+    Returns:
+        The (symmetric) filter coefficients. Shape is (window,).
+    """
+    assert window % 2 == 1 and polyorder < window, f"Invalid Savitzky-Golay filter: {window=}, {polyorder=}"
+    offsets = np.arange(window) - window // 2
+    # value at the center of the least squares polynomial fit
+    return np.linalg.pinv(offsets[:, None] ** np.arange(polyorder + 1))[0]
+
+
+def lowpass_coefficients(window: int, cutoff: float, fps: float) -> np.ndarray:
+    """Compute the coefficients of a windowed-sinc (Hamming) low-pass filter.
+
+    Args:
+        window: The window length, in frames. Must be odd.
+        cutoff: The cutoff frequency, in Hz.
+        fps: The frame rate of the motion.
+
+    Returns:
+        The (symmetric) filter coefficients, with unit gain at zero frequency. Shape is (window,).
+    """
+    assert window % 2 == 1 and 0.0 < cutoff < 0.5 * fps, f"Invalid low-pass filter: {window=}, {cutoff=}, {fps=}"
+    offsets = np.arange(window) - window // 2
+    coefficients = np.sinc(2.0 * cutoff / fps * offsets) * np.hamming(window)
+    return coefficients / coefficients.sum()
+
+
+def _filter(values: np.ndarray, coefficients: np.ndarray) -> np.ndarray:
+    """Apply a symmetric (zero-phase) filter along the frames of (F, ...) values.
+
+    The motion is extended at both ends by point reflection, which preserves the trend at the boundaries.
+    """
+    half = len(coefficients) // 2
+    if len(values) <= half:
+        return values
+    padded = np.concatenate([2 * values[:1] - values[half:0:-1], values, 2 * values[-1:] - values[-2 : -half - 2 : -1]])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, len(coefficients), axis=0)
+    return windows @ coefficients
+
+
+def _filter_rotations(rotations: np.ndarray, coefficients: np.ndarray) -> np.ndarray:
+    """Apply a symmetric (zero-phase) filter along the frames of (F, B, 4) quaternions, in tangent space.
+
+    The rotations of each window are expressed as rotation vectors relative to the rotation of the window center,
+    the rotation vectors are filtered, and the result is mapped back onto the rotation of the window center.
+    The motion is extended at both ends by point reflection (``q[-k] = q[0] q[k]^-1 q[0]``).
+    """
+    half = len(coefficients) // 2
+    if len(rotations) <= half:
+        return rotations
+    before, after = rotations[half:0:-1], rotations[-2 : -half - 2 : -1]
+    first, last = np.broadcast_to(rotations[:1], before.shape), np.broadcast_to(rotations[-1:], after.shape)
+    padded = np.concatenate([
+        quat_mul(quat_mul(first, quat_conjugate(before)), first),
+        rotations,
+        quat_mul(quat_mul(last, quat_conjugate(after)), last),
+    ])
+    # windows of shape (F, W, B, 4)
+    windows = np.moveaxis(np.lib.stride_tricks.sliding_window_view(padded, len(coefficients), axis=0), -1, 1)
+    centers = np.broadcast_to(quat_conjugate(rotations)[:, None], windows.shape)
+    tangents = quat_to_rotvec(quat_mul(centers, np.ascontiguousarray(windows)))
+    smoothed = quat_mul(rotations, rotvec_to_quat(np.einsum("w,fwbc->fbc", coefficients, tangents)))
+    return np.where(smoothed[..., :1] < 0, -smoothed, smoothed)
+
+
+def smooth_motion(
+    motion_data: dict,
+    method: str = "savgol",
+    window: int = 9,
+    polyorder: int = 3,
+    cutoff: float = 6.0,
+) -> dict:
+    """Smooth a whole motion with a zero-phase filter, and re-derive its velocities from the smoothed data.
+
+    DOF and body positions are filtered directly, body rotations are filtered in tangent space.
+    The velocities are then computed by backward differences of the smoothed data (the first frame
+    has zero velocity), the angular velocities being computed from the relative rotations between frames.
+
+    Args:
+        motion_data: The motion data (see :func:`~poselib_v2.motion_io.load_motion_data`).
+        method: The filter, ``savgol`` (Savitzky-Golay) or ``lowpass`` (windowed-sinc low-pass).
+        window: The filter window length, in frames. Must be odd.
+        polyorder: The polynomial order of the Savitzky-Golay filter.
+        cutoff: The cutoff frequency of the low-pass filter, in Hz.
+
+    Raises:
+        ValueError: If the filter method is unknown.
+
+    Returns:
+        The smoothed motion data.
+    """
+    fps = float(np.asarray(motion_data["fps"]).reshape(-1)[0])
+    if method == "savgol":
+        coefficients = savgol_coefficients(window, polyorder)
+    elif method == "lowpass":
+        coefficients = lowpass_coefficients(window, cutoff, fps)
+    else:
+        msg = f"Unknown smoothing method: {method}, expected savgol or lowpass"
+        raise ValueError(msg)
+
+    dof_positions = _filter(motion_data["dof_positions"].astype(np.float64), coefficients)
+    body_positions = _filter(motion_data["body_positions"].astype(np.float64), coefficients)
+    body_rotations = _filter_rotations(motion_data["body_rotations"].astype(np.float64), coefficients)
+
+    # backward differences, the first frame has zero velocity
+    def differentiate(values: np.ndarray) -> np.ndarray:
+        return np.diff(values, axis=0, prepend=values[:1]) * fps
+
+    previous_rotations = np.concatenate([body_rotations[:1], body_rotations[:-1]])
+    body_angular_velocities = quat_to_rotvec(quat_mul(body_rotations, quat_conjugate(previous_rotations))) * fps
+
+    smoothed = dict(motion_data)
+    smoothed.update({
+        "dof_positions": dof_positions.astype(np.float32),
+        "dof_velocities": differentiate(dof_positions).astype(np.float32),
+        "body_positions": body_positions.astype(np.float32),
+        "body_rotations": body_rotations.astype(np.float32),
+        "body_linear_velocities": differentiate(body_positions).astype(np.float32),
+        "body_angular_velocities": body_angular_velocities.astype(np.float32),
+    })
+    return smoothed
+
+
+def _smooth_file(motion_file: str, output_file: str, kwargs: dict) -> str:
+    """Smooth one motion file (worker process)"""
+    motion_data = smooth_motion(load_motion_data(motion_file), **kwargs)
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    save_motion_data(output_file, motion_data)
+    return output_file
+
+
+def smooth_dataset(
+    motion_files: list[str], output_files: list[str], num_workers: int | None = None, **kwargs
+) -> list[str]:
+    """Smooth motion files in parallel over the motions.
+
+    Args:
+        motion_files: The motion files to smooth.
+        output_files: The smoothed motion files to write, in the order of ``motion_files``.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+        kwargs: The smoothing parameters (see :func:`smooth_motion`).
+
+    Returns:
+        The written files.
+    """
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_smooth_file, a, b, kwargs) for a, b in zip(motion_files, output_files)]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Motion file to smooth")
+    parser.add_argument("--dataset-dir", type=str, default=None, help="Directory of motion files to smooth")
+    parser.add_argument("--output", type=str, required=True, help="Smoothed motion file, or directory (dataset)")
+    parser.add_argument("--method", type=str, choices=["savgol", "lowpass"], default="savgol", help="Filter")
+    parser.add_argument("--window", type=int, default=9, help="Filter window length, in frames (odd)")
+    parser.add_argument("--polyorder", type=int, default=3, help="Polynomial order (savgol)")
+    parser.add_argument("--cutoff", type=float, default=6.0, help="Cutoff frequency in Hz (lowpass)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args, _ = parser.parse_known_args()
+
+    kwargs = {"method": args.method, "window": args.window, "polyorder": args.polyorder, "cutoff": args.cutoff}
+    if args.dataset_dir:
+        files = sorted(glob.glob(os.path.join(args.dataset_dir, "**", "*.npz"), recursive=True))
+        outputs = [os.path.join(args.output, os.path.relpath(file, args.dataset_dir)) for file in files]
+        smooth_dataset(files, outputs, num_workers=args.workers, **kwargs)
+        print(f"Smoothed {len(files)} motions to {args.output}")
+    else:
+        assert args.file, "Either --file or --dataset-dir is required"
+        smooth_dataset([args.file], [args.output], num_workers=1, **kwargs)
+        print(f"Smoothed motion saved to {args.output}")
@@ -0,0 +1,173 @@
+"""
+Downsampling of motions to a lower frame rate.
+
+Motions sampled with the Hermite interpolation of :class:`~poselib_v2.motion_loader.MotionLoader` (which uses
+the velocities as tangents) can be stored with a few times fewer frames for the same accuracy as the linear
+interpolation. The velocities of the downsampled motions are central differences of the original frames,
+which are the tangents of the motion at the frames (backward differences lag by half a frame).
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .math_utils import quat_conjugate, quat_mul, quat_to_rotvec
+    from .motion_io import FRAME_FIELDS, load_motion_data, save_motion_data
+    from .motion_loader import MotionLoader
+except ImportError:
+    from math_utils import quat_conjugate, quat_mul, quat_to_rotvec
+    from motion_io import FRAME_FIELDS, load_motion_data, save_motion_data
+    from motion_loader import MotionLoader
+
+
+def central_velocities(motion_data: dict) -> dict[str, np.ndarray]:
+    """Compute the velocities of a motion by central differences (one-sided at the first and last frames).
+
+    Args:
+        motion_data: The motion data (see :func:`~poselib_v2.motion_io.load_motion_data`).
+
+    Returns:
+        The DOF velocities, body linear velocities and body angular velocities.
+    """
+    fps = float(np.asarray(motion_data["fps"]).reshape(-1)[0])
+    rotations = motion_data["body_rotations"].astype(np.float64)
+    # rotation vectors of q_next * q_previous^-1, over two frames inside the motion and one frame at its ends
+    next_rotations = np.concatenate([rotations[1:], rotations[-1:]])
+    previous_rotations = np.concatenate([rotations[:1], rotations[:-1]])
+    frames = np.full((rotations.shape[0],) + (1,) * (rotations.ndim - 1), 2.0)
+    frames[0] = frames[-1] = 1.0
+    angular_velocities = quat_to_rotvec(quat_mul(next_rotations, quat_conjugate(previous_rotations))) * fps / frames
+    return {
+        "dof_velocities": np.gradient(motion_data["dof_positions"].astype(np.float64), axis=0) * fps,
+        "body_linear_velocities": np.gradient(motion_data["body_positions"].astype(np.float64), axis=0) * fps,
+        "body_angular_velocities": angular_velocities,
+    }
+
+
+def downsample_motion(motion_data: dict, factor: int) -> dict:
+    """Keep one frame every ``factor`` frames of a motion, with central-difference velocities.
+
+    The frames after the last kept frame (less than ``factor``) are dropped.
+
+    Args:
+        motion_data: The motion data (see :func:`~poselib_v2.motion_io.load_motion_data`).
+        factor: The downsampling factor.
+
+    Raises:
+        ValueError: If the motion has non-uniform frames (``frame_times``, e.g. a decimated motion), or if its
+            frame rate is not a multiple of the factor.
+
+    Returns:
+        The downsampled motion data.
+    """
+    if "frame_times" in motion_data:
+        msg = "The motion has non-uniform frames (frame_times), only motions at a fixed frame rate can be downsampled"
+        raise ValueError(msg)
+    fps = int(np.asarray(motion_data["fps"]).reshape(-1)[0])
+    if factor < 1 or fps % factor:
+        msg = f"The motion frame rate ({fps}) is not a multiple of the downsampling factor ({factor})"
+        raise ValueError(msg)
+
+    downsampled = dict(motion_data)
+    downsampled.update(central_velocities(motion_data))
+    for name in FRAME_FIELDS:
+        downsampled[name] = downsampled[name][::factor].astype(np.float32)
+    # same shape as the input frame rate, e.g. (1,) for the motions written by the builder
+    downsampled["fps"] = np.full_like(np.asarray(motion_data["fps"]), fps // factor)
+    return downsampled
+
+
+def reconstruction_errors(motion_data: dict, downsampled: dict) -> dict[str, dict[str, float]]:
+    """Maximum error of the linear and Hermite interpolations of a downsampled motion at the original frames.
+
+    Args:
+        motion_data: The original motion data.
+        downsampled: The downsampled motion data (see :func:`downsample_motion`).
+
+    Returns:
+        For each interpolation (``linear`` and ``hermite``), the maximum error of the DOF positions (rad),
+        body positions (m) and body rotations (angle, in rad).
+    """
+    duration = (downsampled["dof_positions"].shape[0] - 1) / float(np.asarray(downsampled["fps"]).reshape(-1)[0])
+    fps = float(np.asarray(motion_data["fps"]).reshape(-1)[0])
+    times = np.arange(motion_data["dof_positions"].shape[0]) / fps
+    times = times[times <= duration + 1e-9]
+    dof_positions = motion_data["dof_positions"][: len(times)].astype(np.float64)
+    body_positions = motion_data["body_positions"][: len(times)].astype(np.float64)
+    body_rotations = motion_data["body_rotations"][: len(times)].astype(np.float64)
+
+    errors = {}
+    for interpolation in ("linear", "hermite"):
+        motion = MotionLoader.from_data(downsampled, "cpu", interpolation=interpolation)
+        samples = [values.double().numpy() for values in motion.sample(0, times=times)]
+        # angle of the rotation between the sampled and original rotations
+        relative_rotations = quat_to_rotvec(quat_mul(samples[3], quat_conjugate(body_rotations)))
+        errors[interpolation] = {
+            "dof_positions": float(np.abs(samples[0] - dof_positions).max()),
+            "body_positions": float(np.linalg.norm(samples[2] - body_positions, axis=-1).max()),
+            "body_rotations": float(np.linalg.norm(relative_rotations, axis=-1).max()),
+        }
+    return errors
+
+
+def _downsample_file(motion_file: str, output_file: str, factor: int) -> dict[str, dict[str, float]]:
+    """Downsample one motion file (worker process)"""
+    motion_data = load_motion_data(motion_file)
+    downsampled = downsample_motion(motion_data, factor)
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    save_motion_data(output_file, downsampled)
+    return reconstruction_errors(motion_data, downsampled)
+
+
+def downsample_dataset(
+    motion_files: list[str], output_files: list[str], factor: int, num_workers: int | None = None
+) -> dict[str, dict[str, float]]:
+    """Downsample motion files in parallel over the motions, and report the reconstruction errors.
+
+    Args:
+        motion_files: The motion files to downsample.
+        output_files: The downsampled motion files to write, in the order of ``motion_files``.
+        factor: The downsampling factor.
+        num_workers: Number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        The maximum reconstruction error of each field over all the motions, for each interpolation.
+    """
+    errors = {}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_downsample_file, a, b, factor) for a, b in zip(motion_files, output_files)]
+        for motion_file, future in zip(motion_files, futures):
+            for interpolation, field_errors in future.result().items():
+                maximum = errors.setdefault(interpolation, dict.fromkeys(field_errors, 0.0))
+                for name, error in field_errors.items():
+                    maximum[name] = max(maximum[name], error)
+            print(f"Downsampled {motion_file}")
+
+    print(f"Maximum reconstruction error at the original frames (downsampling factor: {factor}):")
+    print(f"{'field':>16} {'linear':>10} {'hermite':>10}")
+    for name in errors.get("linear", {}):
+        print(f"{name:>16} {errors['linear'][name]:>10.5f} {errors['hermite'][name]:>10.5f}")
+    return errors
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Motion file to downsample")
+    parser.add_argument("--dataset-dir", type=str, default=None, help="Directory of motion files to downsample")
+    parser.add_argument("--output", type=str, required=True, help="Downsampled motion file, or directory (dataset)")
+    parser.add_argument("--factor", type=int, default=2, help="Downsampling factor")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args, _ = parser.parse_known_args()
+
+    if args.dataset_dir:
+        files = sorted(glob.glob(os.path.join(args.dataset_dir, "**", "*.npz"), recursive=True))
+        outputs = [os.path.join(args.output, os.path.relpath(file, args.dataset_dir)) for file in files]
+        downsample_dataset(files, outputs, args.factor, num_workers=args.workers)
+    else:
+        assert args.file, "Either --file or --dataset-dir is required"
+        downsample_dataset([args.file], [args.output], args.factor, num_workers=1)
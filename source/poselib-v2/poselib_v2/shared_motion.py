@@ -0,0 +1,253 @@
+"""
+Motion data stored in shared memory, so that several worker processes can use the same motion without
+each of them holding a copy of it.
+
+One process creates the shared block from the motion data, the other processes attach to it by name,
+and get NumPy arrays (and CPU tensors) mapping the shared memory directly. On Linux, the arrays map
+a read-only view of the block, so writing into them (even through a tensor) fails instead of silently
+changing the motion of every process; elsewhere, the arrays are flagged read-only. The block counts its
+attached handles, and is unlinked when the last one is closed.
+"""
+
+import contextlib
+import json
+import mmap
+import os
+import sys
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+try:
+    from .motion_io import FRAME_FIELDS, OPTIONAL_FIELDS
+except ImportError:
+    from motion_io import FRAME_FIELDS, OPTIONAL_FIELDS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# layout of the shared block: reference count (int64), header size (int64), JSON header, then the arrays
+_COUNTER_SIZE = 16
+_ALIGNMENT = 64
+# directory of the POSIX shared memory blocks on Linux
+_SHM_DIR = "/dev/shm"
+
+
+class _BlockLock:
+    """Inter-process lock of a shared block, held on a lock file named after the block."""
+
+    def __init__(self, name: str) -> None:
+        self.path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+    def __enter__(self) -> "_BlockLock":
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *args) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+
+
+class SharedMotionData:
+    """
+    Motion data in a named shared memory block.
+
+    Use :meth:`create` in one process and :meth:`attach` in the others. Every handle must be closed
+    (or used as a context manager): the block is unlinked when the last handle is closed.
+    If the creating process exits without closing its handle (e.g. it crashed), the block is unlinked
+    by the Python resource tracker; the processes already attached keep their mapping.
+    """
+
+    def __init__(self, block: shared_memory.SharedMemory, arrays: dict[str, np.ndarray], tracked: bool) -> None:
+        """Use :meth:`create` or :meth:`attach` instead."""
+        self._block = block
+        self._tracked = tracked
+        self._counter = np.ndarray((1,), dtype=np.int64, buffer=block.buf)
+        self.arrays = arrays
+        self.closed = False
+
+    @property
+    def name(self) -> str:
+        """The name of the shared memory block, used to attach to it."""
+        return self._block.name
+
+    @classmethod
+    def create(cls, motion_data: dict, name: str | None = None) -> "SharedMotionData":
+        """Copy motion data into a new shared memory block.
+
+        Args:
+            motion_data: The motion data (see :func:`~poselib_v2.motion_io.load_motion_data`).
+            name: The name of the block. If not defined, a unique name is generated.
+
+        Returns:
+            The handle of the block, attached once.
+        """
+        names = FRAME_FIELDS + tuple(name_ for name_ in OPTIONAL_FIELDS if name_ in motion_data)
+        fields = {name_: np.ascontiguousarray(motion_data[name_]) for name_ in names}
+        header = {
+            "metadata": {
+                "fps": np.asarray(motion_data["fps"]).tolist(),
+                "dof_names": np.asarray(motion_data["dof_names"]).tolist(),
+                "body_names": np.asarray(motion_data["body_names"]).tolist(),
+            },
+            "fields": {},
+        }
+        # the header size depends on the offsets, reserve a generous upper bound for it
+        offset = _COUNTER_SIZE + _align(len(json.dumps(header)) + 128 * len(fields))
+        for field, values in fields.items():
+            header["fields"][field] = {"dtype": values.dtype.str, "shape": values.shape, "offset": offset}
+            offset = _align(offset + values.nbytes)
+        encoded_header = json.dumps(header).encode()
+        assert _COUNTER_SIZE + len(encoded_header) <= header["fields"][FRAME_FIELDS[0]]["offset"]
+
+        block = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+        with _BlockLock(block.name):
+            np.ndarray((2,), dtype=np.int64, buffer=block.buf)[:] = [1, len(encoded_header)]
+            block.buf[_COUNTER_SIZE : _COUNTER_SIZE + len(encoded_header)] = encoded_header
+            for field, values in fields.items():
+                spec = header["fields"][field]
+                np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf, offset=spec["offset"])[...] = values
+        return cls(block, cls._map_arrays(block), tracked=os.name == "posix")
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedMotionData":
+        """Attach to an existing shared memory block, without copying the motion data.
+
+        Args:
+            name: The name of the block (see :attr:`name`).
+
+        Raises:
+            FileNotFoundError: If the block doesn't exist (anymore).
+
+        Returns:
+            The handle of the block.
+        """
+        # the lifetime of the block is handled by the reference count: the block is not registered
+        # to the resource tracker, which would unlink it when this process exits
+        block = _attach_untracked(name)
+        with _BlockLock(block.name):
+            counter = np.ndarray((1,), dtype=np.int64, buffer=block.buf)
+            if counter[0] <= 0:
+                del counter
+                block.close()
+                msg = f"The shared motion block {name} was already released."
+                raise FileNotFoundError(msg)
+            counter[0] += 1
+            del counter
+        return cls(block, cls._map_arrays(block), tracked=False)
+
+    @staticmethod
+    def _map_arrays(block: shared_memory.SharedMemory) -> dict[str, np.ndarray]:
+        """Map read-only arrays of the motion fields onto the shared block"""
+        header_size = int(np.ndarray((2,), dtype=np.int64, buffer=block.buf)[1])
+        header = json.loads(bytes(block.buf[_COUNTER_SIZE : _COUNTER_SIZE + header_size]))
+        # a read-only mapping of the block, if the platform exposes the blocks as files (Linux)
+        path = os.path.join(_SHM_DIR, block.name)
+        if os.path.exists(path):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                buffer = mmap.mmap(fd, block.size, prot=mmap.PROT_READ)
+            finally:
+                os.close(fd)
+        else:
+            buffer = block.buf.toreadonly()
+        arrays = {name: np.asarray(value) for name, value in header["metadata"].items()}
+        for field, spec in header["fields"].items():
+            values = np.ndarray(spec["shape"], dtype=np.dtype(spec["dtype"]), buffer=buffer, offset=spec["offset"])
+            values.flags.writeable = False
+            arrays[field] = values
+        return arrays
+
+    def close(self) -> None:
+        """Detach from the block, and unlink it if this was the last attached handle.
+
+        The memory stays mapped while arrays (or tensors) created from it are still referenced.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        with _BlockLock(self.name):
+            self._counter[0] -= 1
+            release = self._counter[0] <= 0
+        self.arrays = {}
+        del self._counter
+        if release:
+            with contextlib.suppress(FileNotFoundError):
+                if isinstance(self._block, shared_memory.SharedMemory) and not self._tracked:
+                    if os.name == "posix" and sys.version_info < (3, 13):
+                        # unlink() also unregisters the block from the resource tracker, which must know it
+                        resource_tracker.register(self._block._name, "shared_memory")
+                self._block.unlink()
+                os.remove(_BlockLock(self.name).path)
+        elif self._tracked:
+            # other processes still use the block, it must outlive this process (registering again first, as
+            # a process attached through the fallback of _attach_untracked may have unregistered it)
+            resource_tracker.register(self._block._name, "shared_memory")
+            resource_tracker.unregister(self._block._name, "shared_memory")
+        try:
+            self._block.close()
+        except BufferError:
+            # arrays are still exported, the mapping is released once they are garbage collected
+            pass
+
+    def __enter__(self) -> "SharedMotionData":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class _MappedBlock:
+    """Shared memory block attached through its file (Linux), with the interface of ``SharedMemory``"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._path = os.path.join(_SHM_DIR, name)
+        fd = os.open(self._path, os.O_RDWR)
+        try:
+            self.size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._mmap)
+
+    def close(self) -> None:
+        self.buf.release()
+        self._mmap.close()
+
+    def unlink(self) -> None:
+        os.remove(self._path)
+
+
+def _attach_untracked(name: str) -> "shared_memory.SharedMemory | _MappedBlock":
+    """Attach to a shared memory block without registering it to the resource tracker, which would unlink it
+    when this process exits"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    if os.path.exists(os.path.join(_SHM_DIR, name)):
+        return _MappedBlock(name)
+    block = shared_memory.SharedMemory(name=name)
+    if os.name == "posix":
+        # other POSIX systems: unregister this block only. If this process shares the resource tracker of the
+        # creating process, the block is no longer unlinked if the creating process crashes.
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+def _align(offset: int) -> int:
+    """Round an offset up to the array alignment"""
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
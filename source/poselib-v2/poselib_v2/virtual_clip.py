@@ -0,0 +1,238 @@
+"""
+Virtual clips: trimmed, concatenated and looped motions, as views of loaded motions.
+
+A virtual clip is a list of segments, each one playing a frame range of a loaded motion
+(:class:`~poselib_v2.motion_loader.MotionLoader`) from a time offset of the clip. Editing clips only creates
+new segment lists referencing the tensors of the loaded motions, so curricula of thousands of edited clips
+cost almost no extra memory. Consecutive segments may overlap in time: the samples falling in an overlap
+window are cross-faded from one segment to the next, the other samples are sampled from one segment only.
+"""
+
+from typing import Optional
+
+import numpy as np
+import torch
+
+try:
+    from .augmentation import MotionAugmentation
+    from .motion_loader import MotionLoader
+except ImportError:
+    from augmentation import MotionAugmentation
+    from motion_loader import MotionLoader
+
+
+class ClipSegment:
+    """
+    Frame range of a loaded motion, played from a time offset of a virtual clip.
+    """
+
+    def __init__(
+        self, source: MotionLoader, start_frame: int = 0, end_frame: Optional[int] = None, time_offset: float = 0.0
+    ) -> None:
+        """
+        Args:
+            source: The loaded motion.
+            start_frame: The first frame of the range.
+            end_frame: The last frame of the range (included). Defaults to the last frame of the motion.
+            time_offset: The time of the clip at which the first frame is played, in seconds.
+
+        Raises:
+            ValueError: If the frame range is empty or out of the motion.
+        """
+        end_frame = source.num_frames - 1 if end_frame is None else end_frame
+        if not 0 <= start_frame < end_frame < source.num_frames:
+            msg = f"Invalid frame range [{start_frame}, {end_frame}] of a motion of {source.num_frames} frames"
+            raise ValueError(msg)
+        self.source = source
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.time_offset = time_offset
+        # times of the frame range in the source motion
+        if source.frame_times is None:
+            self.source_start, source_end = start_frame * source.dt, end_frame * source.dt
+        else:
+            self.source_start, source_end = source.frame_times[[start_frame, end_frame]].tolist()
+        self.duration = source_end - self.source_start
+
+    @property
+    def end_time(self) -> float:
+        """The time of the clip at which the last frame is played, in seconds."""
+        return self.time_offset + self.duration
+
+    def shifted(self, offset: float) -> "ClipSegment":
+        """Get the same segment, played ``offset`` seconds later."""
+        return ClipSegment(self.source, self.start_frame, self.end_frame, self.time_offset + offset)
+
+
+class VirtualClip:
+    """
+    Clip made of segments of loaded motions, sampled like a :class:`~poselib_v2.motion_loader.MotionLoader`.
+
+    At most two segments may overlap at any time. The clip starts at time 0: a time between two segments
+    (or before the first one) holds the nearest frame of the previous (or first) segment.
+    """
+
+    def __init__(self, segments: list[ClipSegment]) -> None:
+        """
+        Args:
+            segments: The segments of the clip. The motions must share the same skeleton.
+
+        Raises:
+            ValueError: If there is no segment, the skeletons differ, or more than two segments overlap.
+        """
+        if not segments:
+            msg = "A virtual clip requires at least one segment"
+            raise ValueError(msg)
+        segments = sorted(segments, key=lambda segment: segment.time_offset)
+        skeleton = (segments[0].source.dof_names, segments[0].source.body_names)
+        for segment in segments:
+            if (segment.source.dof_names, segment.source.body_names) != skeleton:
+                msg = "The motions of the segments of a virtual clip must share the same skeleton"
+                raise ValueError(msg)
+
+        self.segments = segments
+        self._starts = np.array([segment.time_offset for segment in segments])
+        self._ends = np.array([segment.end_time for segment in segments])
+        self._source_starts = np.array([segment.source_start for segment in segments])
+        if np.any(self._ends[:-2] > self._starts[2:]):
+            msg = "At most two segments of a virtual clip may overlap at any time"
+            raise ValueError(msg)
+        # the distinct source motions, and the source of each segment
+        self._sources: list[MotionLoader] = []
+        for segment in segments:
+            if not any(segment.source is source for source in self._sources):
+                self._sources.append(segment.source)
+        self._segment_sources = np.array(
+            [next(i for i, source in enumerate(self._sources) if source is segment.source) for segment in segments]
+        )
+        self.duration = float(self._ends.max())
+
+    @classmethod
+    def from_motion(cls, source: MotionLoader, start_frame: int = 0, end_frame: Optional[int] = None) -> "VirtualClip":
+        """Create a clip playing a frame range (e.g. a trimmed motion) of a loaded motion.
+
+        Args:
+            source: The loaded motion.
+            start_frame: The first frame of the range.
+            end_frame: The last frame of the range (included). Defaults to the last frame of the motion.
+
+        Returns:
+            The virtual clip.
+        """
+        return cls([ClipSegment(source, start_frame, end_frame)])
+
+    @classmethod
+    def concatenate(cls, clips: list["VirtualClip"], blend_duration: float = 0.0) -> "VirtualClip":
+        """Play clips one after the other.
+
+        Args:
+            clips: The clips.
+            blend_duration: Duration of the cross-fade between consecutive clips, in seconds: each clip starts
+                ``blend_duration`` before the end of the previous one.
+
+        Returns:
+            The virtual clip.
+        """
+        segments, offset = [], 0.0
+        for clip in clips:
+            segments.extend(segment.shifted(offset) for segment in clip.segments)
+            offset += clip.duration - blend_duration
+        return cls(segments)
+
+    def loop(self, count: int, blend_duration: float = 0.0) -> "VirtualClip":
+        """Play the clip ``count`` times in a row (see :meth:`concatenate`)."""
+        return VirtualClip.concatenate([self] * count, blend_duration)
+
+    @property
+    def dof_names(self) -> list[str]:
+        """Skeleton DOF names."""
+        return self._sources[0].dof_names
+
+    @property
+    def body_names(self) -> list[str]:
+        """Skeleton rigid body names."""
+        return self._sources[0].body_names
+
+    def sample_times(self, num_samples: int, duration: float | None = None) -> np.ndarray:
+        """Sample random clip times uniformly (see :meth:`MotionLoader.sample_times`)."""
+        duration = self.duration if duration is None else duration
+        assert (
+            duration <= self.duration
+        ), f"The specified duration ({duration}) is longer than the clip duration ({self.duration})"
+        return duration * np.random.uniform(low=0.0, high=1.0, size=num_samples)
+
+    def sample(
+        self,
+        num_samples: int,
+        times: Optional[np.ndarray] = None,
+        duration: float | None = None,
+        augmentation: Optional[MotionAugmentation] = None,
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Sample the clip (see :meth:`MotionLoader.sample`).
+
+        The clip times are resolved to the segments and the times of their source motions at once, then each
+        source motion is sampled once for all its samples.
+
+        Args:
+            num_samples: Number of time samples to generate. If ``times`` is defined, this parameter is ignored.
+            times: Clip times used for sampling. If not defined, the clip is random sampled uniformly in time.
+            duration: Maximum clip duration to sample. If ``times`` is defined, this parameter is ignored.
+            augmentation: Per-sample augmentation applied to the sampled data.
+
+        Returns:
+            The sampled DOF positions, DOF velocities, body positions, body rotations, body linear velocities
+            and body angular velocities (see :meth:`MotionLoader.sample`).
+        """
+        if times is None:
+            times = self.sample_times(num_samples, duration)
+        elif augmentation is not None and augmentation.time_scale is not None:
+            times = times * augmentation.time_scale.cpu().numpy()
+        times = np.clip(np.asarray(times, dtype=np.float64), 0.0, self.duration)
+
+        # latest segment started at each time, and the previous segment if it overlaps
+        segments = np.maximum(np.searchsorted(self._starts, times, side="right") - 1, 0)
+        previous = segments - 1
+        overlapping = np.flatnonzero((previous >= 0) & (self._ends[np.maximum(previous, 0)] > times))
+        samples = self._sample_segments(segments, times)
+
+        if len(overlapping):
+            outgoing = self._sample_segments(previous[overlapping], times[overlapping])
+            incoming = segments[overlapping]
+            window = self._ends[incoming - 1] - self._starts[incoming]
+            blend = (times[overlapping] - self._starts[incoming]) / window
+            blend = torch.as_tensor(blend, dtype=torch.float32, device=samples[0].device)
+            source = self._sources[0]
+            indices = torch.as_tensor(overlapping, device=samples[0].device)
+            for i, (values, outgoing_values) in enumerate(zip(samples, outgoing)):
+                if i == 3:
+                    blended = source._slerp(outgoing_values, q1=values[indices], blend=blend)
+                else:
+                    blended = source._interpolate(outgoing_values, b=values[indices], blend=blend)
+                values[indices] = blended
+
+        if augmentation is None:
+            return samples
+        mirroring = self._sources[0]._get_mirroring() if augmentation.mirror is not None else {}
+        return augmentation.apply(*samples, **mirroring)
+
+    def _sample_segments(self, segments: np.ndarray, times: np.ndarray) -> tuple[torch.Tensor, ...]:
+        """Sample clip times from given segments, grouping the samples by source motion"""
+        # times in the source motions, holding the first and last frames of the segments
+        local_times = np.clip(times - self._starts[segments], 0.0, self._ends[segments] - self._starts[segments])
+        local_times = local_times + self._source_starts[segments]
+        sources = self._segment_sources[segments]
+        if len(self._sources) == 1:
+            return self._sources[0].sample(0, times=local_times)
+
+        samples = None
+        for index, source in enumerate(self._sources):
+            selected = np.flatnonzero(sources == index)
+            if not len(selected):
+                continue
+            source_samples = source.sample(0, times=local_times[selected])
+            if samples is None:
+                samples = tuple(values.new_empty((len(times), *values.shape[1:])) for values in source_samples)
+            selected = torch.as_tensor(selected, device=source_samples[0].device)
+            for values, source_values in zip(samples, source_samples):
+                values[selected] = source_values
+        return samples
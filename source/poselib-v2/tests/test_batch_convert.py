@@ -0,0 +1,70 @@
+"""
+Checks of the batch conversion scheduler of :mod:`poselib_v2.batch_convert` with a stub converter backend.
+"""
+
+import json
+import os
+
+from poselib_v2.batch_convert import MANIFEST_FILENAME, BatchConverter, ConverterBackend
+
+
+class StubBackend(ConverterBackend):
+    """Copies the sources, raises on the sources named ``fail*`` and kills the worker on the ``crash*`` ones"""
+
+    def convert(self, source_file: str, output_file: str, mapping_name: str) -> None:
+        name = os.path.basename(source_file)
+        if name.startswith("crash"):
+            os._exit(1)
+        if name.startswith("fail"):
+            raise RuntimeError("conversion failed")
+        with open(source_file, "rb") as source, open(output_file, "wb") as output:
+            output.write(source.read())
+
+
+def _write_sources(input_dir, names: list[str]) -> None:
+    for name in names:
+        path = input_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode())
+
+
+def _jobs(output_dir) -> dict:
+    with open(output_dir / MANIFEST_FILENAME) as f:
+        return json.load(f)["jobs"]
+
+
+def test_failures_are_isolated(tmp_path):
+    input_dir, output_dir = tmp_path / "input", tmp_path / "output"
+    names = ["a.vmd", "b.vmd", "crash.vmd", "sub/c.vmd", "fail.vmd", "d.vmd"]
+    _write_sources(input_dir, names)
+
+    backend = StubBackend()
+    converter = BatchConverter(str(input_dir), str(output_dir), "Stub.table", backend, num_workers=3, max_retries=1)
+    summary = converter.run()
+
+    assert summary == {"done": 4, "failed": 2}
+    jobs = _jobs(output_dir)
+    for name in ("a.vmd", "b.vmd", "sub/c.vmd", "d.vmd"):
+        # the jobs in flight when the worker died are run again, without counting an attempt
+        assert jobs[name]["status"] == "done"
+        assert jobs[name]["attempts"] == 1
+        assert (output_dir / name.replace(".vmd", ".npz")).read_bytes() == name.encode()
+    for name in ("crash.vmd", "fail.vmd"):
+        assert jobs[name]["status"] == "failed"
+        assert jobs[name]["attempts"] == 2
+    assert "BrokenProcessPool" in jobs["crash.vmd"]["error"]
+    assert "RuntimeError" in jobs["fail.vmd"]["error"]
+    assert not list(output_dir.rglob("*.partial.npz"))
+
+
+def test_resume(tmp_path):
+    input_dir, output_dir = tmp_path / "input", tmp_path / "output"
+    _write_sources(input_dir, ["a.vmd", "fail.vmd"])
+    BatchConverter(str(input_dir), str(output_dir), "Stub.table", StubBackend(), max_retries=0).run()
+
+    # only the failed and the new sources are converted again
+    _write_sources(input_dir, ["b.vmd"])
+    converter = BatchConverter(str(input_dir), str(output_dir), "Stub.table", StubBackend(), max_retries=0)
+    assert converter.pending_jobs() == ["b.vmd", "fail.vmd"]
+    assert converter.run() == {"done": 2, "failed": 1}
+    assert _jobs(output_dir)["a.vmd"]["attempts"] == 1
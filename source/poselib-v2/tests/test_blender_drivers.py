@@ -0,0 +1,251 @@
+"""
+Checks of the frame extraction and keyframe writing of :mod:`poselib_v2.blender_drivers` against a stub ``bpy``
+module modelling the API used by the drivers (scene frames, depsgraph evaluation, bulk ``foreach_get`` reads,
+and F-curves recording their bulk ``keyframe_points`` calls).
+"""
+
+import importlib
+import sys
+import types
+
+import numpy as np
+import pytest
+
+
+NUM_BONES = 400
+NUM_FRAMES = 25
+
+
+def _bone_state(frame: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Heads, tails and pose matrices (row-major) of all the stub bones at a frame"""
+    indices = np.arange(NUM_BONES)
+    heads = np.stack([indices * 0.1, np.full(NUM_BONES, frame * 0.01), np.zeros(NUM_BONES)], axis=-1)
+    tails = heads + np.array([0.0, 0.0, 1.0])
+    angles = 0.05 * frame * (indices + 1)
+    matrices = np.tile(np.eye(4), (NUM_BONES, 1, 1))
+    matrices[:, 0, 0], matrices[:, 0, 1] = np.cos(angles), -np.sin(angles)
+    matrices[:, 1, 0], matrices[:, 1, 1] = np.sin(angles), np.cos(angles)
+    return heads, tails, matrices
+
+
+class _PoseBones:
+    """Pose bone collection with the bulk ``foreach_get`` access of ``bpy_prop_collection``"""
+
+    def __init__(self, scene: "_Scene") -> None:
+        self._scene = scene
+        self._names = [f"bone_{idx}" for idx in range(NUM_BONES)]
+
+    def __len__(self) -> int:
+        return NUM_BONES
+
+    def keys(self) -> list[str]:
+        return self._names
+
+    def foreach_get(self, name: str, buffer: np.ndarray) -> None:
+        heads, tails, matrices = _bone_state(self._scene.frame)
+        # Blender flattens the matrices in column-major order
+        values = {"head": heads, "tail": tails, "matrix": matrices.transpose(0, 2, 1)}[name]
+        buffer[:] = values.ravel()
+
+
+class _Scene:
+    def __init__(self) -> None:
+        self.frame = 0
+        self.frame_start = 0
+        self.frame_end = NUM_FRAMES - 1
+        self.render = types.SimpleNamespace(fps=30, fps_base=1.0)
+
+    def frame_set(self, frame: int) -> None:
+        self.frame = frame
+
+
+class _KeyframePoints:
+    """Keyframe points of an F-curve, recording the bulk calls"""
+
+    def __init__(self, calls: list) -> None:
+        self.calls = calls
+        self.co = np.zeros(0, dtype=np.float32)
+
+    def add(self, count: int) -> None:
+        self.calls.append(("add", count))
+        self.co = np.concatenate([self.co, np.zeros(2 * count, dtype=np.float32)])
+
+    def clear(self) -> None:
+        self.calls.append(("clear",))
+        self.co = np.zeros(0, dtype=np.float32)
+
+    def foreach_set(self, name: str, values: np.ndarray) -> None:
+        self.calls.append(("foreach_set", name))
+        self.co[:] = values
+
+
+class _FCurve:
+    def __init__(self, data_path: str, index: int, group: str) -> None:
+        self.data_path, self.array_index, self.group = data_path, index, group
+        self.calls = []
+        self.keyframe_points = _KeyframePoints(self.calls)
+
+    def update(self) -> None:
+        self.calls.append(("update",))
+
+
+class _FCurves(list):
+    def __init__(self) -> None:
+        super().__init__()
+        self.created = []
+
+    def find(self, data_path: str, index: int = 0) -> "_FCurve | None":
+        return next((fcurve for fcurve in self if (fcurve.data_path, fcurve.array_index) == (data_path, index)), None)
+
+    def new(self, data_path: str, index: int = 0, action_group: str = "") -> _FCurve:
+        self.created.append((data_path, index))
+        fcurve = _FCurve(data_path, index, action_group)
+        self.append(fcurve)
+        return fcurve
+
+
+class _Actions(dict):
+    def new(self, name: str) -> types.SimpleNamespace:
+        self[name] = types.SimpleNamespace(name=name, fcurves=_FCurves())
+        return self[name]
+
+
+class _PoseBone:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.rotation_mode = "XYZ"
+
+    def path_from_id(self, prop: str) -> str:
+        return f'pose.bones["{self.name}"].{prop}'
+
+
+@pytest.fixture
+def drivers(monkeypatch):
+    """The drivers module, imported against the stub ``bpy``"""
+    scene = _Scene()
+    armature = types.SimpleNamespace(pose=types.SimpleNamespace(bones=_PoseBones(scene)))
+    armature.evaluated_get = lambda depsgraph: armature
+    redraws = []
+    bpy = types.ModuleType("bpy")
+    bpy.context = types.SimpleNamespace(
+        scene=scene,
+        evaluated_depsgraph_get=lambda: object(),
+        view_layer=types.SimpleNamespace(update=lambda: None),
+    )
+    bpy.data = types.SimpleNamespace(objects={}, actions=_Actions())
+    bpy.ops = types.SimpleNamespace(wm=types.SimpleNamespace(redraw_timer=lambda **kwargs: redraws.append(kwargs)))
+    bpy.types = types.SimpleNamespace(bpy_prop_collection=object, Action=object)
+    bpy_types = types.ModuleType("bpy_types")
+    bpy_types.Object = object
+    mathutils = types.ModuleType("mathutils")
+    mathutils.Vector = np.array
+    for name, module in (("bpy", bpy), ("bpy_types", bpy_types), ("mathutils", mathutils)):
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.delitem(sys.modules, "poselib_v2.blender_drivers", raising=False)
+    module = importlib.import_module("poselib_v2.blender_drivers")
+    yield module, armature, redraws
+    sys.modules.pop("poselib_v2.blender_drivers", None)
+
+
+MAPPING = {
+    "pelvis": ("bone_5", "head"),
+    "left_hand": ("bone_390", "tail"),
+    "spine": ("bone_5", 0.5),
+}
+
+
+def test_build_motion_data(drivers, capsys):
+    module, armature, redraws = drivers
+    motion_data = module.build_motion_data(armature, MAPPING, progress_interval=1e6)
+
+    bones = [5, 390, 5]
+    blends = np.array([0.0, 1.0, 0.5])
+    expected_positions, expected_angles = [], []
+    for frame in range(NUM_FRAMES):
+        heads, tails, _ = _bone_state(frame)
+        expected_positions.append(heads[bones] + blends[:, None] * (tails[bones] - heads[bones]))
+        expected_angles.append(0.05 * frame * (np.array(bones) + 1))
+    expected_positions = np.array(expected_positions)
+    expected_positions[..., :2] -= expected_positions[0, :, :2].mean(axis=0)
+    expected_angles = np.array(expected_angles)
+
+    assert motion_data["body_names"].tolist() == list(MAPPING)
+    assert motion_data["body_positions"].shape == (NUM_FRAMES, 3, 3)
+    np.testing.assert_allclose(motion_data["body_positions"], expected_positions, atol=1e-5)
+    # rotations about Z, compared up to the sign of the quaternions
+    rotations = motion_data["body_rotations"]
+    angles = 2.0 * np.arctan2(rotations[..., 3], rotations[..., 0])
+    np.testing.assert_allclose(np.cos(angles), np.cos(expected_angles), atol=1e-5)
+    np.testing.assert_allclose(np.sin(angles), np.sin(expected_angles), atol=1e-5)
+
+    # no UI redraw, and the progress output is throttled
+    assert not redraws
+    assert "Processing:" not in capsys.readouterr().out
+
+
+def test_build_motion_data_force_redraw(drivers):
+    module, armature, redraws = drivers
+    module.build_motion_data(armature, MAPPING, force_redraw=True, progress_interval=1e6)
+    assert len(redraws) == NUM_FRAMES
+
+
+def test_used_bones_plan():
+    from poselib_v2.mapping import compile_mapping
+
+    plan = compile_mapping(MAPPING, [f"bone_{idx}" for idx in range(NUM_BONES)])
+    used_plan = plan.used_bones_plan()
+    assert used_plan.bone_names == ["bone_5", "bone_390"]
+    head_tail = np.random.default_rng(0).normal(size=(4, NUM_BONES, 2, 3))
+    np.testing.assert_allclose(
+        used_plan.gather_positions(head_tail[:, plan.used_bone_indices]), plan.gather_positions(head_tail)
+    )
+
+
+def test_write_keyframes(drivers):
+    module, _, _ = drivers
+    action = module.D.actions.new("Action")
+    frames = np.arange(NUM_FRAMES, dtype=np.float32)
+    values = np.random.default_rng(0).normal(size=(NUM_FRAMES, 3))
+    data_path = 'pose.bones["pelvis"].location'
+    module.write_keyframes(action, data_path, frames, values, group="pelvis")
+    # writing again replaces the keyframes of the existing F-curves
+    module.write_keyframes(action, data_path, frames, values, group="pelvis")
+
+    assert action.fcurves.created == [(data_path, index) for index in range(3)]
+    for channel, fcurve in enumerate(action.fcurves):
+        bulk_calls = [("add", NUM_FRAMES), ("foreach_set", "co"), ("update",)]
+        assert fcurve.calls == bulk_calls + [("clear",)] + bulk_calls
+        np.testing.assert_allclose(fcurve.keyframe_points.co[0::2], frames)
+        np.testing.assert_allclose(fcurve.keyframe_points.co[1::2], values[:, channel], rtol=1e-6)
+
+
+def test_load_replay(drivers, tmp_path):
+    module, _, _ = drivers
+    rng = np.random.default_rng(0)
+    joint_order = ["left_knee_joint", "right_knee_joint"]
+    replay = {
+        "fps": np.array(50),
+        "joint_order": np.array(joint_order),
+        "root_positions": rng.normal(size=(NUM_FRAMES, 3)).astype(np.float32),
+        "root_quaternions": rng.normal(size=(NUM_FRAMES, 4)).astype(np.float32),
+        "joint_positions": rng.normal(size=(NUM_FRAMES, len(joint_order))).astype(np.float32),
+    }
+    np.savez(tmp_path / "replay.npz", **replay)
+    bones = {name: _PoseBone(name) for name in ("pelvis", "left_knee", "right_knee")}
+    armature = types.SimpleNamespace(name="Armature", animation_data=None, pose=types.SimpleNamespace(bones=bones))
+    armature.animation_data_create = lambda: setattr(armature, "animation_data", types.SimpleNamespace(action=None))
+    module.load_replay({}, armature, str(tmp_path / "replay.npz"))
+
+    fcurves = armature.animation_data.action.fcurves
+    expected = [('pose.bones["pelvis"].location', index) for index in range(3)]
+    expected += [('pose.bones["pelvis"].rotation_quaternion', index) for index in range(4)]
+    expected += [('pose.bones["left_knee"].rotation_euler', 1), ('pose.bones["right_knee"].rotation_euler', 1)]
+    assert fcurves.created == expected
+    assert bones["pelvis"].rotation_mode == "QUATERNION"
+    channels = np.concatenate(
+        [replay["root_positions"], replay["root_quaternions"], replay["joint_positions"]], axis=-1
+    )
+    for channel, fcurve in enumerate(fcurves):
+        assert fcurve.calls == [("add", NUM_FRAMES), ("foreach_set", "co"), ("update",)]
+        np.testing.assert_array_equal(fcurve.keyframe_points.co[0::2], np.arange(NUM_FRAMES))
+        np.testing.assert_array_equal(fcurve.keyframe_points.co[1::2], channels[:, channel])
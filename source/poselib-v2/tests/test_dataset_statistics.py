@@ -0,0 +1,52 @@
+"""
+Checks of the dataset statistics of :mod:`poselib_v2.dataset_statistics` and of their cache file.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from poselib_v2.dataset import MANIFEST_FILENAME
+from poselib_v2.dataset_statistics import STATISTICS_FILENAME, compute_statistics, load_dataset_statistics
+from poselib_v2.motion_io import save_motion_data
+
+
+def _write_motion(motion_file: str, dof_names: list[str], num_frames: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    dof_positions = rng.normal(size=(num_frames, len(dof_names))).astype(np.float32)
+    motion_data = {
+        "fps": np.array([30]),
+        "dof_names": np.array(dof_names),
+        "body_names": np.array(["pelvis", "foot"]),
+        "dof_positions": dof_positions,
+        "dof_velocities": np.zeros((num_frames, len(dof_names)), dtype=np.float32),
+        "body_positions": rng.normal(size=(num_frames, 2, 3)).astype(np.float32),
+        "body_rotations": np.tile(np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32), (num_frames, 2, 1)),
+        "body_linear_velocities": np.zeros((num_frames, 2, 3), dtype=np.float32),
+        "body_angular_velocities": np.zeros((num_frames, 2, 3), dtype=np.float32),
+    }
+    save_motion_data(motion_file, motion_data)
+    return dof_positions
+
+
+def test_dataset_statistics(tmp_path):
+    dof_positions = np.concatenate(
+        [_write_motion(str(tmp_path / f"clip_{clip}.npz"), ["knee", "hip"], 50 + clip, clip) for clip in range(3)]
+    )
+    statistics = load_dataset_statistics(str(tmp_path), num_workers=1)
+    np.testing.assert_allclose(statistics["dof_positions"]["mean"], dof_positions.mean(axis=0), atol=1e-5)
+    np.testing.assert_allclose(statistics["dof_positions"]["std"], dof_positions.std(axis=0), atol=1e-5)
+    assert int(statistics["dof_positions"]["count"]) == len(dof_positions)
+    # the cache is written without leaving its temporary file behind
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [MANIFEST_FILENAME, STATISTICS_FILENAME] + [f"clip_{clip}.npz" for clip in range(3)]
+    )
+
+
+def test_different_skeletons(tmp_path):
+    # same number of DOFs, but not the same DOFs
+    _write_motion(str(tmp_path / "a.npz"), ["knee", "hip"], 20, 0)
+    _write_motion(str(tmp_path / "b.npz"), ["hip", "knee"], 20, 1)
+    with pytest.raises(ValueError, match="skeleton"):
+        compute_statistics([str(tmp_path / "a.npz"), str(tmp_path / "b.npz")], num_workers=1)
@@ -0,0 +1,123 @@
+"""
+Checks of :class:`poselib_v2.motion_library.MotionLibrary` loaded by several local ranks at once, as the processes
+of a data-parallel training do, on a dataset without a manifest yet.
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+
+from poselib_v2.dataset import MANIFEST_FILENAME, load_dataset_manifest
+from poselib_v2.features import load_features
+from poselib_v2.motion_io import save_motion_data
+
+
+NUM_CLIPS = 12
+NUM_ROUNDS = 20
+
+
+def _motion_data(num_frames: int, body_names: list[str], rng: np.random.Generator) -> dict:
+    num_bodies = len(body_names)
+    rotations = rng.normal(size=(num_frames, num_bodies, 4)).astype(np.float32)
+    return {
+        "fps": np.array(30),
+        "dof_names": np.array(["knee", "hip"]),
+        "body_names": np.array(body_names),
+        "dof_positions": rng.normal(size=(num_frames, 2)).astype(np.float32),
+        "dof_velocities": rng.normal(size=(num_frames, 2)).astype(np.float32),
+        "body_positions": rng.normal(scale=0.1, size=(num_frames, num_bodies, 3)).astype(np.float32),
+        "body_rotations": rotations / np.linalg.norm(rotations, axis=-1, keepdims=True),
+        "body_linear_velocities": rng.normal(scale=0.2, size=(num_frames, num_bodies, 3)).astype(np.float32),
+        "body_angular_velocities": rng.normal(size=(num_frames, num_bodies, 3)).astype(np.float32),
+    }
+
+
+def _write_dataset(dataset_dir) -> None:
+    rng = np.random.default_rng(0)
+    for clip in range(NUM_CLIPS):
+        motion_data = _motion_data(10 + 5 * clip, ["pelvis", "foot"], rng)
+        save_motion_data(os.path.join(dataset_dir, f"clip_{clip:02d}.npz"), motion_data)
+
+
+def _update_manifest(rank: int, dataset_dir: str, barrier, queue) -> None:
+    """Create the manifest at the same time as the other ranks, over several rounds"""
+    try:
+        for _ in range(NUM_ROUNDS):
+            if rank == 0:
+                manifest_file = os.path.join(dataset_dir, MANIFEST_FILENAME)
+                if os.path.exists(manifest_file):
+                    os.remove(manifest_file)
+            barrier.wait()
+            assert len(load_dataset_manifest(dataset_dir)["motions"]) == NUM_CLIPS
+            barrier.wait()
+        queue.put((rank, None))
+    except Exception as error:  # noqa: BLE001 - reported to the test process
+        barrier.abort()
+        queue.put((rank, f"{type(error).__name__}: {error}"))
+
+
+def _load_shard(rank: int, world_size: int, dataset_dir: str, barrier, queue) -> None:
+    from poselib_v2.motion_library import MotionLibrary
+
+    barrier.wait()
+    try:
+        library = MotionLibrary(dataset_dir, "cpu", rank=rank, world_size=world_size)
+        queue.put((rank, library.clip_ids.tolist(), float(library.shard_weight)))
+    except Exception as error:  # noqa: BLE001 - reported to the test process
+        queue.put((rank, f"{type(error).__name__}: {error}", 0.0))
+
+
+def _run(target, world_size: int, *args) -> list:
+    context = multiprocessing.get_context("spawn")
+    barrier, queue = context.Barrier(world_size), context.Queue()
+    processes = [context.Process(target=target, args=(rank, *args, barrier, queue)) for rank in range(world_size)]
+    for process in processes:
+        process.start()
+    results = sorted(queue.get(timeout=120) for _ in processes)
+    for process in processes:
+        process.join()
+    return results
+
+
+def test_concurrent_manifest_creation(tmp_path):
+    _write_dataset(tmp_path)
+    results = _run(_update_manifest, 4, str(tmp_path))
+    assert [error for _, error in results] == [None] * 4
+    # no temporary file is left behind
+    assert sorted(os.listdir(tmp_path)) == sorted([MANIFEST_FILENAME] + [f"clip_{i:02d}.npz" for i in range(NUM_CLIPS)])
+
+
+def test_sharded_loading_without_manifest(tmp_path):
+    _write_dataset(tmp_path)
+    results = _run(_load_shard, 3, 3, str(tmp_path))
+    assert all(isinstance(clip_ids, list) for _, clip_ids, _ in results), results
+    # the shards are disjoint and cover the dataset
+    assert sorted(clip for _, clip_ids, _ in results for clip in clip_ids) == list(range(NUM_CLIPS))
+    assert np.isclose(sum(shard_weight for _, _, shard_weight in results), 1.0)
+
+
+def test_features_remapping(tmp_path):
+    from poselib_v2.motion_library import MotionLibrary
+
+    rng = np.random.default_rng(0)
+    skeletons = {
+        "a.npz": ["pelvis", "left_foot", "right_foot"],
+        "b.npz": ["pelvis", "hand", "right_foot"],
+    }
+    for path, body_names in skeletons.items():
+        save_motion_data(str(tmp_path / path), _motion_data(40, body_names, rng))
+    library = MotionLibrary(str(tmp_path), "cpu", features=True)
+
+    assert library.body_names == ["pelvis", "left_foot", "right_foot", "hand"]
+    assert library.foot_bodies == ["left_foot", "right_foot"]
+    for motion, (path, body_names) in zip(library.motions, skeletons.items()):
+        original = load_features(str(tmp_path / path))
+        assert motion.foot_bodies == library.foot_bodies
+        for body, name in enumerate(library.body_names):
+            expected = original["root_local_positions"][:, body_names.index(name)] if name in body_names else 0.0
+            np.testing.assert_array_equal(motion.features["root_local_positions"][:, body].numpy(), expected)
+        for foot, name in enumerate(library.foot_bodies):
+            foot_bodies = original["foot_bodies"].tolist()
+            expected = original["contacts"][:, foot_bodies.index(name)] if name in foot_bodies else False
+            np.testing.assert_array_equal(motion.features["contacts"][:, foot].numpy(), expected)
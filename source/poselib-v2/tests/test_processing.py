@@ -0,0 +1,58 @@
+"""
+Checks of the post-processing of extracted motion frames in :mod:`poselib_v2.processing`.
+"""
+
+import numpy as np
+import torch
+
+from poselib_v2.math_utils import quat_mul, rotvec_to_quat
+from poselib_v2.motion_loader import MotionLoader
+from poselib_v2.processing import MotionPostProcessor
+
+
+FPS = 30
+
+
+def _compound_rotations(num_frames: int) -> np.ndarray:
+    """Rotations about two changing axes at once, for which Euler angle rates differ from angular velocities"""
+    t = np.arange(num_frames)[:, None] / FPS
+    yaw = rotvec_to_quat(np.concatenate([np.zeros((num_frames, 2)), 2.0 * t], axis=-1))
+    tilt = rotvec_to_quat(np.concatenate([1.2 * np.sin(3.0 * t), np.zeros((num_frames, 1)), 0.8 * t], axis=-1))
+    return np.stack([quat_mul(yaw, tilt), tilt], axis=1)
+
+
+def _process(body_rotations: np.ndarray, chunk_size: int) -> dict[str, np.ndarray]:
+    num_frames = body_rotations.shape[0]
+    processor = MotionPostProcessor(FPS)
+    chunks = []
+    for start in range(0, num_frames, chunk_size):
+        end = min(start + chunk_size, num_frames)
+        body_positions = np.zeros((end - start, 2, 3), dtype=np.float32)
+        chunks.append(processor.process(np.zeros((end - start, 0)), body_positions, body_rotations[start:end]))
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def test_angular_velocities_match_derived_velocities():
+    body_rotations = _compound_rotations(300)
+    processed = _process(body_rotations, chunk_size=300)
+
+    # the stored velocities are the ones derived by the loader from the rotations
+    motion_data = {"fps": np.array([FPS]), "dof_names": np.array([]), "body_names": np.array(["a", "b"])}
+    motion_data.update(processed)
+    stored = MotionLoader.from_data(motion_data, "cpu")
+    derived = MotionLoader.from_data(motion_data, "cpu", derive_velocities=True)
+    times = np.arange(300) / FPS
+    torch.testing.assert_close(derived.sample(0, times=times)[5], stored.sample(0, times=times)[5], atol=2e-5, rtol=0)
+
+    # world-frame angular velocities: integrating them over one frame gives the next rotation
+    steps = rotvec_to_quat(processed["body_angular_velocities"][1:].astype(np.float64) / FPS)
+    integrated = quat_mul(steps, body_rotations[:-1])
+    np.testing.assert_allclose(np.abs(np.sum(integrated * body_rotations[1:], axis=-1)), 1.0, atol=1e-6)
+
+
+def test_chunked_processing():
+    body_rotations = _compound_rotations(250)
+    whole = _process(body_rotations, chunk_size=250)
+    chunked = _process(body_rotations, chunk_size=64)
+    for name, values in whole.items():
+        np.testing.assert_allclose(chunked[name], values, atol=1e-6)
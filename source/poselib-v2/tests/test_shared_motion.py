@@ -0,0 +1,113 @@
+"""
+Checks of the reference-counted lifetime and of the read-only mapping of
+:class:`poselib_v2.shared_motion.SharedMotionData`, with spawned worker processes attaching to the block.
+"""
+
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from poselib_v2.shared_motion import SharedMotionData
+
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="the shared memory blocks are not files")
+
+NUM_FRAMES = 30
+
+
+def _motion_data() -> dict:
+    rng = np.random.default_rng(0)
+    rotations = rng.normal(size=(NUM_FRAMES, 2, 4)).astype(np.float32)
+    return {
+        "fps": np.array([30]),
+        "dof_names": np.array(["knee", "hip"]),
+        "body_names": np.array(["pelvis", "foot"]),
+        "dof_positions": rng.normal(size=(NUM_FRAMES, 2)).astype(np.float32),
+        "dof_velocities": rng.normal(size=(NUM_FRAMES, 2)).astype(np.float32),
+        "body_positions": rng.normal(size=(NUM_FRAMES, 2, 3)).astype(np.float32),
+        "body_rotations": rotations / np.linalg.norm(rotations, axis=-1, keepdims=True),
+        "body_linear_velocities": rng.normal(size=(NUM_FRAMES, 2, 3)).astype(np.float32),
+        "body_angular_velocities": rng.normal(size=(NUM_FRAMES, 2, 3)).astype(np.float32),
+    }
+
+
+def _attach(name: str, queue, close_event) -> None:
+    """Attach to the block, check its arrays, and close it when asked to (worker process)"""
+    shared = SharedMotionData.attach(name)
+    try:
+        shared.arrays["dof_positions"][0, 0] = 1.0
+        writable = True
+    except ValueError:
+        writable = False
+    queue.put((writable, shared.arrays["dof_positions"].copy()))
+    close_event.wait()
+    shared.close()
+    queue.put("closed")
+
+
+def _write_tensor(name: str) -> None:
+    """Write into the tensors of a motion loader attached to the block (worker process)"""
+    from poselib_v2.motion_loader import MotionLoader
+
+    loader = MotionLoader.from_shared(name, "cpu")
+    loader.dof_positions.add_(1.0)
+
+
+def _close_in_order(creator_first: bool) -> None:
+    """Create a block, attach to it from a spawned worker, and close both handles in the given order"""
+    context = multiprocessing.get_context("spawn")
+    motion_data = _motion_data()
+    shared = SharedMotionData.create(motion_data)
+    path = os.path.join("/dev/shm", shared.name)
+    queue, close_event = context.Queue(), context.Event()
+    worker = context.Process(target=_attach, args=(shared.name, queue, close_event))
+    worker.start()
+    writable, dof_positions = queue.get(timeout=60)
+    assert not writable, "the attached arrays are writable"
+    np.testing.assert_array_equal(dof_positions, motion_data["dof_positions"])
+
+    if creator_first:
+        shared.close()
+        assert os.path.exists(path), "the block was unlinked while a worker was still attached"
+        close_event.set()
+        assert queue.get(timeout=60) == "closed"
+    else:
+        close_event.set()
+        assert queue.get(timeout=60) == "closed"
+        assert os.path.exists(path), "the block was unlinked while its creator was still attached"
+        shared.close()
+    worker.join()
+    assert not os.path.exists(path), "the block was not unlinked after its last handle was closed"
+
+
+@pytest.mark.parametrize("creator_first", [True, False])
+def test_reference_counting(creator_first):
+    # run in a separate interpreter, to capture the warnings of its resource tracker when it shuts down
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    code = f"import sys; sys.path.insert(0, {tests_dir!r}); import test_shared_motion as t; "
+    code += f"t._close_in_order({creator_first})"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(tests_dir), os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=300, env=env)
+    assert result.returncode == 0, result.stderr
+    assert "resource_tracker" not in result.stderr, result.stderr
+
+
+def test_read_only_tensors():
+    motion_data = _motion_data()
+    with SharedMotionData.create(motion_data) as shared:
+        # the tensors map a read-only mapping of the block: writing into them kills the worker (there are no
+        # read-only tensors to raise an error), instead of changing the motion of every process
+        context = multiprocessing.get_context("spawn")
+        worker = context.Process(target=_write_tensor, args=(shared.name,))
+        worker.start()
+        worker.join(timeout=120)
+        assert worker.exitcode == -signal.SIGSEGV
+        np.testing.assert_array_equal(shared.arrays["dof_positions"], motion_data["dof_positions"])
+        # the reference of the killed worker is never released, drop it so closing the creator unlinks the block
+        shared._counter[0] -= 1
+    assert not os.path.exists(os.path.join("/dev/shm", shared.name))